@@ -0,0 +1,217 @@
+# Exportação analítica em formato colunar (motos, vendas, receitas, gastos)
+#
+# Gera arquivos tipados, particionados por mês, para análise fora do MySQL de produção:
+#
+#   <saida>/<tabela>/mes=YYYY-MM/dados.<ext>   (mes=sem_data para registros sem data)
+#   <saida>/manifesto.json                     (formato, colunas, partições e linhas)
+#
+# O layout "coluna=valor" é o particionamento lido direto por pyarrow.dataset, DuckDB, Spark e
+# pandas. Formato: Parquet quando o pyarrow está instalado; Feather se o pyarrow não tiver o
+# módulo parquet; sem pyarrow, NPZ do numpy (um array por coluna, com máscara `<coluna>__nulo`
+# para inteiros nulos). Dados pessoais (CPF, endereço, anexos) não entram.
+import datetime
+import json
+import os
+import shutil
+from decimal import Decimal
+
+import database
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PASTA_PADRAO = os.environ.get(
+    "ANALITICO_PASTA", os.path.join(os.path.dirname(os.path.abspath(__file__)), "analitico"))
+
+# tabela: (coluna de data que define o mês, ((coluna, tipo), ...))
+CONJUNTOS = {
+    "motos": ("data_cadastro", (
+        ("id", "int"), ("marca", "str"), ("modelo", "str"), ("ano", "int"), ("cor", "str"),
+        ("km", "float"), ("preco", "float"), ("combustivel", "str"), ("status", "str"),
+        ("data_cadastro", "date"), ("ultima_venda_id", "int"),
+    )),
+    "vendas": ("data_dt", (
+        ("id", "int"), ("moto_id", "int"), ("vendedor", "str"), ("data_dt", "datetime"),
+        ("preco_final", "float"),
+    )),
+    "receitas": ("adicionado_em_dt", (
+        ("id", "int"), ("categoria", "str"), ("adicionado_em_dt", "date"), ("valor", "float"),
+    )),
+    "gastos": ("retirado_em_dt", (
+        ("id", "int"), ("categoria", "str"), ("retirado_em_dt", "date"), ("valor", "float"),
+    )),
+}
+SEM_DATA = "sem_data"
+
+
+def formato_disponivel():
+    if pq is not None:
+        return "parquet"
+    if feather is not None:
+        return "feather"
+    if np is not None:
+        return "npz"
+    return None
+
+
+def _converter(valor, tipo):
+    if valor is None:
+        return None
+    if tipo == "int":
+        return int(valor)
+    if tipo == "float":
+        return float(valor) if isinstance(valor, (Decimal, int, float)) else float(str(valor).replace(",", "."))
+    if tipo == "date":
+        return valor.date() if isinstance(valor, datetime.datetime) else valor
+    if tipo == "str":
+        return str(valor)
+    return valor
+
+
+def _gravar_arrow(colunas, tipos, destino, formato):
+    tipos_arrow = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(),
+                   "date": pa.date32(), "datetime": pa.timestamp("s")}
+    tabela = pa.table({nome: pa.array(valores, type=tipos_arrow[tipos[nome]]) for nome, valores in colunas.items()})
+    if formato == "parquet":
+        pq.write_table(tabela, destino, compression="zstd")
+    else:
+        feather.write_feather(tabela, destino, compression="zstd")
+
+
+def _gravar_npz(colunas, tipos, destino):
+    arrays = {}
+    for nome, valores in colunas.items():
+        tipo = tipos[nome]
+        if tipo == "int":
+            nulos = [v is None for v in valores]
+            arrays[nome] = np.array([0 if v is None else v for v in valores], dtype="int64")
+            if any(nulos):
+                arrays[f"{nome}__nulo"] = np.array(nulos, dtype=bool)
+        elif tipo == "float":
+            arrays[nome] = np.array([np.nan if v is None else v for v in valores], dtype="float64")
+        elif tipo in ("date", "datetime"):
+            unidade = "datetime64[D]" if tipo == "date" else "datetime64[s]"
+            arrays[nome] = np.array(["NaT" if v is None else v for v in valores], dtype=unidade)
+        else:
+            # Unicode de largura fixa: carrega sem allow_pickle
+            arrays[nome] = np.array(["" if v is None else v for v in valores], dtype=str)
+    with open(destino, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def _gravar_particao(pasta_tabela, mes, colunas, tipos, formato):
+    pasta = os.path.join(pasta_tabela, f"mes={mes}")
+    os.makedirs(pasta, exist_ok=True)
+    destino = os.path.join(pasta, f"dados.{formato}")
+    tmp = database._caminho_temporario(destino)
+    try:
+        if formato == "npz":
+            _gravar_npz(colunas, tipos, tmp)
+        else:
+            _gravar_arrow(colunas, tipos, tmp, formato)
+        os.replace(tmp, destino)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # Troca de formato: o arquivo da exportação anterior não fica junto
+    for nome in os.listdir(pasta):
+        if nome.startswith("dados.") and nome != os.path.basename(destino):
+            os.remove(os.path.join(pasta, nome))
+
+
+def exportar_tabela(tabela, saida, formato):
+    """
+    Lê `tabela` em lotes (ordenada pela data) e grava uma partição por mês.
+    Retorna {mes: linhas}. Partições de meses que não têm mais registros são apagadas.
+    """
+    coluna_data, definicao = CONJUNTOS[tabela]
+    nomes = [nome for nome, _tipo in definicao]
+    tipos = dict(definicao)
+    indice_data = nomes.index(coluna_data)
+    pasta_tabela = os.path.join(saida, tabela)
+    sql = (f"SELECT {', '.join(nomes)} FROM {tabela} "
+           f"ORDER BY {coluna_data} IS NULL, {coluna_data}, id")
+
+    particoes = {}
+    mes_atual, colunas = None, None
+
+    def _fechar():
+        if colunas is not None:
+            _gravar_particao(pasta_tabela, mes_atual, colunas, tipos, formato)
+            particoes[mes_atual] = len(colunas[nomes[0]])
+
+    for linha in database.iterar_consulta(sql):
+        data = linha[indice_data]
+        mes = data.strftime("%Y-%m") if hasattr(data, "strftime") else SEM_DATA
+        if mes != mes_atual:
+            _fechar()
+            mes_atual, colunas = mes, {nome: [] for nome in nomes}
+        for nome, valor in zip(nomes, linha):
+            colunas[nome].append(_converter(valor, tipos[nome]))
+    _fechar()
+
+    if os.path.isdir(pasta_tabela):
+        for entrada in os.listdir(pasta_tabela):
+            if entrada.startswith("mes=") and entrada[len("mes="):] not in particoes:
+                shutil.rmtree(os.path.join(pasta_tabela, entrada), ignore_errors=True)
+    return particoes
+
+
+def exportar(saida=None, tabelas=None, formato=None):
+    """
+    Exporta as `tabelas` (padrão: todas de CONJUNTOS) para `saida` e grava o manifesto.
+    Retorna o manifesto (dicionário).
+    """
+    saida = saida or PASTA_PADRAO
+    formato = formato or formato_disponivel()
+    if formato is None:
+        raise RuntimeError("Exportação analítica requer pyarrow ou numpy")
+    if formato in ("parquet", "feather") and (pa is None or (pq if formato == "parquet" else feather) is None):
+        raise RuntimeError(f"Formato {formato} requer o pacote pyarrow")
+    if formato == "npz" and np is None:
+        raise RuntimeError("Formato npz requer o pacote numpy")
+    os.makedirs(saida, exist_ok=True)
+    manifesto = {
+        "formato": formato,
+        "gerado_em": datetime.datetime.now().isoformat(timespec="seconds"),
+        "tabelas": {},
+    }
+    caminho_manifesto = os.path.join(saida, "manifesto.json")
+    if os.path.exists(caminho_manifesto):
+        # Exportação parcial (--tabelas): mantém as outras tabelas do manifesto anterior
+        try:
+            with open(caminho_manifesto, encoding="utf-8") as f:
+                anterior = json.load(f)
+            if anterior.get("formato") == formato:
+                manifesto["tabelas"].update(anterior.get("tabelas", {}))
+        except (OSError, ValueError):
+            pass
+    for tabela in tabelas or CONJUNTOS:
+        coluna_data, definicao = CONJUNTOS[tabela]
+        particoes = exportar_tabela(tabela, saida, formato)
+        manifesto["tabelas"][tabela] = {
+            "particionado_por": coluna_data,
+            "colunas": [{"nome": nome, "tipo": tipo} for nome, tipo in definicao],
+            "particoes": particoes,
+            "linhas": sum(particoes.values()),
+        }
+    tmp = database._caminho_temporario(caminho_manifesto)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, caminho_manifesto)
+    return manifesto
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, session, send_file, flash, url_for
+from flask import Flask, render_template, request, redirect, session, send_file, flash, url_for, jsonify
 try:
     from flask_compress import Compress
 except Exception:
@@ -8,10 +8,20 @@ except Exception:
             pass
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from static_index import IndiceArquivos
 import database
+import analitico
+import armazenamento
+import coleta_arquivos
+import digitalizacao
+import exportacao
+import doc_jobs
+import fotos
+import kpis
+import click
 import pandas as pd
+import io
 import os
-import uuid
 import logging
 
 app = Flask(__name__)
@@ -28,19 +38,34 @@ app.config['DEBUG'] = os.environ.get("FLASK_DEBUG", "0") == "1"
 # Enable gzip/br compression for faster responses over the network
 Compress(app)
 
-# Inicializa e migra o banco de dados para garantir que o schema está atualizado
-database.iniciar_db()
-database.migrar_db()
-# Garante usuários básicos (admin e vendedor) caso não existam
-try:
-    database.ensure_usuarios_basicos()
-except Exception as e:
-    print(f"Aviso: falha ao garantir usuários básicos: {e}")
-# Inicializa categorias financeiras padrão
+@app.after_request
+def _cache_estaticos_versionados(response):
+    # Arquivos estáticos pedidos com ?v= (ex.: fotos) nunca mudam naquela URL
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+        response.cache_control.max_age = 60 * 60 * 24 * 365
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+# Uma conexão do pool por requisição: devolvida ao pool ao final de cada requisição
+app.teardown_appcontext(database.liberar_conexao_requisicao)
+
+# Esquema do banco: as migrações rodam uma vez por deploy (hook do gunicorn em gunicorn.conf.py
+# ou `flask --app app migrar`); aqui cada worker só confere a versão com uma consulta.
 try:
-    database.inicializar_categorias_padrao()
+    _versao_esquema = database.versao_esquema_atual()
+    if _versao_esquema < database.VERSAO_ESQUEMA:
+        # Execução sem o hook (ex.: `flask run` local): migra aqui mesmo, protegido pelo lock do banco
+        print(f"Esquema na versão {_versao_esquema}, esperado {database.VERSAO_ESQUEMA}: aplicando migrações.")
+        database.migrar_db()
 except Exception as e:
-    print(f"Aviso: falha ao inicializar categorias padrão: {e}")
+    print(f"Aviso: falha ao verificar a versão do esquema: {e}")
+
+@app.cli.command("migrar")
+def migrar_comando():
+    """Aplica as migrações pendentes do banco de dados."""
+    versao = database.aplicar_migracoes()
+    print(f"Esquema na versão {versao}.")
 
 # Caminhos absolutos para evitar problemas de diretório de trabalho
 STATIC_FOLDER_ABS = os.path.join(app.root_path, 'static')
@@ -52,27 +77,68 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
+os.makedirs(fotos.PASTA_DERIVADOS, exist_ok=True)
+
+# Índice em memória de static/ e static/uploads/: as URLs de anexos e fotos são resolvidas
+# sem stat no disco; quem grava arquivos registra no índice e a reconciliação pega o resto
+indice_static = IndiceArquivos(STATIC_FOLDER_ABS, subpastas=("", "uploads", "uploads/derivados"),
+                               intervalo=float(os.environ.get("STATIC_INDEX_INTERVALO", "15")))
+indice_static.carregar()
+indice_static.iniciar_reconciliacao()
+
+# Jobs de documento que ficaram 'pendente' quando um worker reiniciou voltam para a fila
+doc_jobs.iniciar_recuperacao()
+
+# Coleta agendada de arquivos órfãos (opcional): GC_ARQUIVOS_INTERVALO_HORAS > 0 liga
+_gc_intervalo = float(os.environ.get("GC_ARQUIVOS_INTERVALO_HORAS", "0") or 0)
+if _gc_intervalo > 0:
+    coleta_arquivos.iniciar_agendamento(_gc_intervalo, indice_static)
 
 # Helper para salvar arquivo com nome único evitando sobrescrita
 def save_unique(file_storage, field_name: str = "file", prefix: str | None = None) -> str:
     """
-    Salva um arquivo em `UPLOAD_FOLDER` usando um nome único no formato:
-    [prefix_]field_YYYYMMDD_HHMMSS_UUID8.ext
+    Salva um arquivo em `UPLOAD_FOLDER` com nome pelo conteúdo: {sha256}{ext}.
 
-    Retorna apenas o nome do arquivo salvo (sem caminho).
+    Retorna apenas o nome do arquivo salvo (sem caminho). O mesmo documento enviado de novo
+    devolve o mesmo nome sem gravar outra cópia; imagens podem ser gravadas otimizadas e com
+    outra extensão (ver `_gravar_documento`). `prefix` é mantido por compatibilidade.
     """
     fname = secure_filename(file_storage.filename)
     base, ext = os.path.splitext(fname)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    uniq = uuid.uuid4().hex[:8]
-    parts = [p for p in [prefix, field_name, ts, uniq] if p]
-    safe_name = f"{'_'.join(parts)}{ext.lower()}"
-    dest = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
-    file_storage.save(dest)
-    return safe_name
-
-# Gera modelos PDF básicos em static/ se não existirem
+    return _gravar_documento(file_storage, ext, field_name)
+
+def _gravar_documento(file_storage, ext, campo):
+    """
+    Grava um documento enviado em UPLOAD_FOLDER passando pela otimização de digitalizações
+    (redução, recompressão e remoção do EXIF) e registra os tamanhos antes/depois.
+    Retorna o nome do arquivo gravado.
+    """
+    nome, original, final, otimizado = digitalizacao.gravar(file_storage, app.config['UPLOAD_FOLDER'], ext)
+    indice_static.registrar(f"uploads/{nome}")
+    # Nome por conteúdo: se o objeto já está no bucket, não há o que enviar (só renovar a data)
+    armazenamento.publicar(os.path.join(app.config['UPLOAD_FOLDER'], nome), f"uploads/{nome}",
+                           se_ausente=True, renovar=True)
+    if otimizado:
+        database.registrar_upload_otimizado(nome, campo, original, final)
+    return nome
+
+# Versão do layout dos modelos: incrementar ao mudar o código de desenho abaixo
+MODELOS_VERSAO = 1
+
+def _hash_modelo(titulo: str, linhas) -> str:
+    import hashlib
+    import json
+    bruto = json.dumps([MODELOS_VERSAO, titulo, list(linhas)], ensure_ascii=False)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+# Gera modelos PDF básicos em static/ apenas quando o conteúdo mudou
 def ensure_model_docs():
+    """
+    Cada modelo é identificado pelo hash de (versão do layout, título, linhas), gravado ao lado
+    do PDF em `.NOME.pdf.sha256`. Se o hash bate e o PDF existe, nada é renderizado; caso
+    contrário o PDF é escrito num arquivo temporário e trocado com os.replace, para que outros
+    workers nunca leiam um arquivo pela metade.
+    """
     try:
         from reportlab.pdfgen import canvas
         from reportlab.lib.pagesizes import A4
@@ -107,8 +173,18 @@ def ensure_model_docs():
         ]
         for nome, titulo, linhas in docs:
             caminho = os.path.join(STATIC_FOLDER_ABS, nome)
-            # Sempre (re)gerar o PDF do modelo para refletir atualizações de conteúdo
-            c = canvas.Canvas(caminho, pagesize=A4)
+            caminho_hash = os.path.join(STATIC_FOLDER_ABS, f".{nome}.sha256")
+            digest = _hash_modelo(titulo, linhas)
+            try:
+                with open(caminho_hash, "r", encoding="utf-8") as f:
+                    atual = f.read().strip()
+            except OSError:
+                atual = None
+            if atual == digest and os.path.exists(caminho):
+                armazenamento.publicar(caminho, nome, se_ausente=True)
+                continue
+            tmp = f"{caminho}.{os.getpid()}.tmp"
+            c = canvas.Canvas(tmp, pagesize=A4)
             width, height = A4
             c.setFont("Helvetica-Bold", 18)
             c.drawString(72, height - 72, titulo)
@@ -121,13 +197,70 @@ def ensure_model_docs():
             c.drawString(72, 36, f"Gerado automaticamente em {datetime.date.today().isoformat()}")
             c.showPage()
             c.save()
+            os.replace(tmp, caminho)
+            armazenamento.publicar(caminho, nome)
+            tmp_hash = f"{caminho_hash}.{os.getpid()}.tmp"
+            with open(tmp_hash, "w", encoding="utf-8") as f:
+                f.write(digest)
+            os.replace(tmp_hash, caminho_hash)
     except Exception as e:
         print(f"Não foi possível gerar modelos PDF: {e}")
 
 ensure_model_docs()
 
 # Função global para checar existência de arquivo na pasta de uploads
-app.jinja_env.globals['file_exists'] = lambda filename: bool(filename) and os.path.exists(os.path.join(UPLOAD_FOLDER, filename))
+def _salvar_foto_moto(foto, moto_id, ext):
+    """Grava a foto enviada como uploads/foto_moto_{id}{ext} e retorna o nome do arquivo."""
+    foto_name = f"foto_moto_{moto_id}{ext.lower()}"
+    foto_path = os.path.join(app.config['UPLOAD_FOLDER'], foto_name)
+    foto.save(foto_path)
+    indice_static.registrar(f"uploads/{foto_name}")
+    armazenamento.publicar(foto_path, f"uploads/{foto_name}")
+    return foto_name
+
+def _url_static(chave, nome_download=None, **params):
+    """
+    URL de um arquivo de static/ (chave = caminho relativo). No backend remoto, só para chaves
+    que o bucket já tem: URL pública estável para fotos e derivados versionados (?v=), senão
+    pré-assinada (anexos pessoais nunca ganham URL sem expiração). O resto vai pela rota
+    /static do Flask (cópia local desta instância).
+    """
+    if armazenamento.existe_remoto(chave):
+        return armazenamento.url(chave, nome_download, imutavel="v" in params, versao=params.get("v"))
+    return url_for('static', filename=chave, **params)
+
+def _existe_static(chave):
+    """Arquivo disponível nesta instância (índice do disco) ou no backend remoto compartilhado."""
+    return indice_static.existe(chave) or armazenamento.existe_remoto(chave)
+
+def _url_foto(foto, versao=None):
+    """URL da foto com sufixo de versão (?v=): muda a cada troca, então pode ficar em cache para sempre."""
+    if not foto:
+        return None
+    return _url_static(f"uploads/{foto}", v=versao or 0)
+
+def _derivados_foto(moto_id, versao):
+    """
+    URLs dos derivados da foto (miniatura 1x/2x em JPEG e WebP e tamanho de detalhe) para
+    <picture>/srcset, ou None enquanto ainda não foram gerados (a página usa o original).
+    """
+    urls = {}
+    for tamanho, _caixa in fotos.TAMANHOS:
+        for ext, _formato, _opcoes in fotos.FORMATOS:
+            nome = fotos.nome_derivado(moto_id, versao, tamanho, ext)
+            if not _existe_static(f"uploads/derivados/{nome}"):
+                return None
+            urls[(tamanho, ext)] = _url_static(f"uploads/derivados/{nome}", v=versao or 0)
+    return {
+        "src": urls[("p", "jpg")],
+        "srcset": f"{urls[('p', 'jpg')]} 1x, {urls[('m', 'jpg')]} 2x",
+        "srcset_webp": f"{urls[('p', 'webp')]} 1x, {urls[('m', 'webp')]} 2x",
+        "detalhe": urls[("g", "jpg")],
+    }
+
+app.jinja_env.globals['foto_url'] = _url_foto
+app.jinja_env.globals['static_url'] = _url_static
+app.jinja_env.globals['file_exists'] = lambda filename: bool(filename) and _existe_static(f"uploads/{filename}")
 
 # Helper para obter a URL correta do arquivo (procura em static/uploads e fallback para static)
 from flask import url_for
@@ -140,16 +273,14 @@ def _file_url(filename: str):
     # Caso já venha como 'static/...'
     if 'static/' in p:
         rel = p.split('static/', 1)[1]
-        full = os.path.join(STATIC_FOLDER_ABS, rel)
-        if os.path.exists(full):
-            return url_for('static', filename=rel)
+        if _existe_static(rel):
+            return _url_static(rel)
 
     # Caso venha como 'uploads/...'
     if 'uploads/' in p:
         rel = p.split('uploads/', 1)[1]
-        full = os.path.join(UPLOAD_FOLDER, rel)
-        if os.path.exists(full):
-            return url_for('static', filename=f'uploads/{rel}')
+        if _existe_static(f'uploads/{rel}'):
+            return _url_static(f'uploads/{rel}')
 
     # Tenta com apenas o nome do arquivo
     base = os.path.basename(p)
@@ -166,12 +297,10 @@ def _file_url(filename: str):
             return None
     except Exception:
         pass
-    caminho_uploads = os.path.join(UPLOAD_FOLDER, base)
-    if os.path.exists(caminho_uploads):
-        return url_for('static', filename=f'uploads/{base}')
-    caminho_static = os.path.join(STATIC_FOLDER_ABS, base)
-    if os.path.exists(caminho_static):
-        return url_for('static', filename=base)
+    if _existe_static(f'uploads/{base}'):
+        return _url_static(f'uploads/{base}')
+    if _existe_static(base):
+        return _url_static(base)
     # Sem arquivo correspondente: não gerar URL inválida
     return None
 
@@ -205,20 +334,35 @@ def is_image(filename):
     except Exception:
         return False
 
+# Documentos gerados (garantia/procuração/recibos) com ETag = fingerprint dos dados:
+# o navegador revalida a cada clique e recebe 304 enquanto nada mudou.
+def _enviar_documento(caminho, nome_download):
+    # Backend remoto: o PDF já foi publicado na geração; o download vai direto do bucket
+    chave = os.path.relpath(caminho, STATIC_FOLDER_ABS).replace(os.sep, "/")
+    if armazenamento.existe_remoto(chave):
+        return redirect(armazenamento.url(chave, nome_download))
+    return send_file(caminho, as_attachment=True, download_name=nome_download,
+                     etag=database.fingerprint_documento(caminho) or True, max_age=0)
+
+# Documentos gerados em memória (recibos): enviados sem passar pelo disco
+def _enviar_documento_memoria(conteudo, mimetype, nome_download, fp=None, anexo=True):
+    return send_file(io.BytesIO(conteudo), mimetype=mimetype, as_attachment=anexo,
+                     download_name=nome_download, etag=fp or False, max_age=0)
+
 # ROTAS DE DOWNLOAD DE MODELOS PDF
 @app.route("/download/garantia")
 def download_garantia():
     caminho = os.path.join(STATIC_FOLDER_ABS, "GARANTIA.pdf")
     if not os.path.exists(caminho):
         return redirect("/cadastro_moto")
-    return send_file(caminho, as_attachment=True, download_name="GARANTIA.pdf")
+    return _enviar_documento(caminho, "GARANTIA.pdf")
 
 @app.route("/download_procuracao")
 def download_procuracao():
     caminho = os.path.join(STATIC_FOLDER_ABS, "PROCURACAO.pdf")
     if not os.path.exists(caminho):
         return redirect("/cadastro_moto")
-    return send_file(caminho, as_attachment=True, download_name="PROCURACAO.pdf")
+    return _enviar_documento(caminho, "PROCURACAO.pdf")
 
 # Procuração dinâmica por moto
 @app.route("/download_procuracao/<int:moto_id>")
@@ -228,7 +372,7 @@ def download_procuracao_moto(moto_id: int):
     try:
         caminho_pdf = database.gerar_pdf_procuracao(moto_id)
         if caminho_pdf and os.path.exists(caminho_pdf):
-            return send_file(caminho_pdf, as_attachment=True, download_name=f"procuracao_moto_{moto_id}.pdf")
+            return _enviar_documento(caminho_pdf, f"procuracao_moto_{moto_id}.pdf")
         else:
             print(f"Procuração não encontrada/gerada para moto {moto_id}: {caminho_pdf}")
             return redirect("/listar_motos")
@@ -244,7 +388,7 @@ def gerar_garantia_moto(moto_id: int):
     try:
         caminho_pdf = database.gerar_pdf_garantia(moto_id)
         if caminho_pdf and os.path.exists(caminho_pdf):
-            return send_file(caminho_pdf, as_attachment=True, download_name=f"garantia_moto_{moto_id}.pdf")
+            return _enviar_documento(caminho_pdf, f"garantia_moto_{moto_id}.pdf")
         else:
             flash("Não foi possível gerar a garantia. Verifique os dados da moto e do comprador.", "danger")
             return redirect(request.referrer or "/motos_vendidas")
@@ -277,15 +421,19 @@ def menu():
         return redirect("/")
 
     if session["tipo"] == "admin":
-        # Coleta os dados para o dashboard apenas para admin
-        stats_estoque = database.get_stats_estoque()
-        stats_vendas = database.get_stats_vendas_mes()
-        
+        # Coleta os dados para o dashboard apenas para admin (indicadores em cache: ver kpis.py)
+        stats_estoque = kpis.estoque()
+        stats_vendas = kpis.vendas_mes()
+        receitas_mes, gastos_mes = kpis.financeiro_mes()
+
         dashboard_data = {
             'motos_disponiveis': stats_estoque[0],
             'valor_estoque': stats_estoque[1],
             'vendas_mes_qtd': stats_vendas[0],
-            'vendas_mes_valor': stats_vendas[1]
+            'vendas_mes_valor': stats_vendas[1],
+            'receitas_mes': receitas_mes,
+            'gastos_mes': gastos_mes,
+            'saldo_mes': receitas_mes - gastos_mes,
         }
         return render_template("menu_admin.html", usuario=session["usuario"], dashboard=dashboard_data)
     else:  # Vendedor
@@ -344,30 +492,28 @@ def cadastro_moto():
                 saved_name = save_unique(file, field_name=db_campo)
                 dados[db_campo] = saved_name
 
+        # Foto da moto: gravada com o ID obtido no INSERT, na mesma transação do cadastro
+        salvar_foto = None
+        foto = request.files.get('foto_moto')
+        if foto and foto.filename:
+            _, ext = os.path.splitext(secure_filename(foto.filename))
+            if ext.lower() in database.FOTO_EXTENSOES:
+                def salvar_foto(moto_id):
+                    return _salvar_foto_moto(foto, moto_id, ext)
+            else:
+                flash('Formato de imagem não suportado. Use JPG, PNG, GIF ou WEBP.', 'warning')
+
         try:
-            # 1. Cadastrar a moto no banco para obter o ID
-            moto_id = database.cadastrar_moto(dados)
+            # 1. Cadastrar a moto (e a foto) no banco para obter o ID
+            moto_id = database.cadastrar_moto(dados, salvar_foto=salvar_foto)
+            if salvar_foto is not None:
+                fotos.agendar(moto_id, indice_static)
 
-            # 2. Salvar a foto da moto usando o ID obtido
-            foto = request.files.get('foto_moto')
-            if foto and foto.filename:
-                try:
-                    fname = secure_filename(foto.filename)
-                    _, ext = os.path.splitext(fname)
-                    if ext.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                        foto_name = f"foto_moto_{moto_id}{ext.lower()}"
-                        foto_path = os.path.join(app.config['UPLOAD_FOLDER'], foto_name)
-                        foto.save(foto_path)
-                    else:
-                        flash('Formato de imagem não suportado. Use JPG, PNG, GIF ou WEBP.', 'warning')
-                except Exception as e:
-                    app.logger.warning(f"Falha ao salvar foto da moto {moto_id}: {e}")
-            
-            # 3. Gerar procuração
+            # 2. Gerar procuração em segundo plano (fica pronta no cache para o download)
             try:
-                database.gerar_pdf_procuracao(moto_id)
+                doc_jobs.enfileirar("procuracao", moto_id)
             except Exception as e:
-                app.logger.warning(f"Falha ao gerar procuração para moto {moto_id}: {e}")
+                app.logger.warning(f"Falha ao agendar procuração para moto {moto_id}: {e}")
 
             flash('Moto cadastrada com sucesso!', 'success')
             return redirect('/cadastro_moto')
@@ -383,6 +529,7 @@ def listar_motos():
     if "usuario" not in session:
         return redirect("/")
     filtros = {
+        "q": request.args.get("q", "").strip(),
         "marca_modelo": request.args.get("marca_modelo", ""),
         "placa": request.args.get("placa", ""),
         "renavam": request.args.get("renavam", ""),
@@ -396,100 +543,41 @@ def listar_motos():
         "status": request.args.get("status", ""),
         # deduplica por placa dentro do mesmo status para permitir exibir 'disponível' e 'consignado' juntos
         "dedup_por_status": True,
+        # traz preço/data/anexos da última venda e a foto na mesma consulta
+        "incluir_venda": True,
+        "incluir_foto": True,
     }
     # Quando o usuário deixa Status em branco, mostrar estoque (disponível + consignado)
     if not filtros["status"]:
         filtros["estoque_apenas"] = True
-    lista = database.filtrar_motos_completo(filtros)
     # Filtro por mês de CADASTRO (apenas estoque: não vendidas) opcional: periodo=YYYY-MM
     periodo = request.args.get('periodo', '').strip()
-    if periodo:
-        def matches_period_estoque(moto_row):
-            # Índices segundo SELECT em database.filtrar_motos_completo
-            # 0:id, 9:status, 15:data_cadastro
-            st = (moto_row[9] or '').lower()
-            if st == 'vendida':
-                return False
-            dc = str(moto_row[15] or '')
-            if not dc:
-                return False
-            try:
-                # data_cadastro pode estar como DD/MM/YYYY
-                if '/' in dc:
-                    partes = dc.split('/')
-                    ym = f"{partes[2]}-{partes[1]}"
-                elif '-' in dc and dc[4] == '-':
-                    ym = dc[:7]
-                else:
-                    return False
-                return ym == periodo
-            except Exception:
-                return False
-        lista = [row for row in lista if matches_period_estoque(row)]
-    # Buscar preço de venda (preco_final) mais recente por moto
-    sale_prices = {}
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT v.moto_id, v.preco_final
-            FROM vendas v
-            INNER JOIN (
-                SELECT moto_id, MAX(id) AS max_id
-                FROM vendas
-                GROUP BY moto_id
-            ) ult ON ult.moto_id = v.moto_id AND ult.max_id = v.id
-            WHERE v.preco_final IS NOT NULL
-            """
-        )
-        for moto_id, preco_final in cursor.fetchall():
-            sale_prices[moto_id] = float(preco_final)
-        # Também carregar anexos da última venda (CNH, Garantia assinada, Endereço)
-        anexos_venda = {}
-        cursor.execute(
-            """
-            SELECT v.moto_id, v.cnh_path, v.garantia_path, v.endereco_path
-            FROM vendas v
-            INNER JOIN (
-                SELECT moto_id, MAX(id) AS max_id
-                FROM vendas
-                GROUP BY moto_id
-            ) ult ON ult.moto_id = v.moto_id AND ult.max_id = v.id
-            WHERE v.cnh_path IS NOT NULL OR v.garantia_path IS NOT NULL OR v.endereco_path IS NOT NULL
-            """
-        )
-        for moto_id, cnh_p, gar_p, end_p in cursor.fetchall():
-            anexos_venda[moto_id] = {
-                'cnh': _file_url(cnh_p) if cnh_p else None,
-                'garantia': _file_url(gar_p) if gar_p else None,
-                'endereco': _file_url(end_p) if end_p else None,
-            }
-        conn.close()
-    except Exception as e:
-        print(f"Aviso: falha ao carregar preços de venda: {e}")
+    if _periodo_valido(periodo):
+        filtros["periodo_cadastro"] = periodo
+    lista, pagina = _paginar_motos(filtros)
+    # Preço de venda (preco_final) e anexos da última venda já vêm na linha (índices 26..30)
+    sale_prices, _sale_dates, anexos_venda = _dados_ultima_venda(lista)
     # Mapear links de Folha de Exibição, Procuração e Foto por moto (Garantia NÃO deve aparecer na listagem)
     exibicao_urls = {}
     procuracao_urls = {}
     foto_urls = {}
+    foto_derivados = {}
     try:
-        base_static = os.path.join(os.path.dirname(database.__file__), "static")
         for row in lista:
             moto_id = row[0]
-            pdf_path = os.path.join(base_static, f"exibicao_moto_{moto_id}.pdf")
-            if os.path.exists(pdf_path):
-                exibicao_urls[moto_id] = url_for('static', filename=os.path.basename(pdf_path))
+            if _existe_static(f"exibicao_moto_{moto_id}.pdf"):
+                exibicao_urls[moto_id] = _url_static(f"exibicao_moto_{moto_id}.pdf")
             # Sempre usar rota dinâmica para garantir dados atualizados
             try:
                 procuracao_urls[moto_id] = url_for('download_procuracao_moto', moto_id=moto_id)
             except Exception:
                 pass
-            # Foto: procurar por extensões conhecidas
-            for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                p = os.path.join(app.config['UPLOAD_FOLDER'], f"foto_moto_{moto_id}{ext}")
-                if os.path.exists(p):
-                    foto_urls[moto_id] = url_for('static', filename=f"uploads/{os.path.basename(p)}")
-                    break
+            # Foto: nome e versão vêm nas duas últimas colunas da linha
+            if row[-2]:
+                foto_urls[moto_id] = _url_foto(row[-2], row[-1])
+                derivados = _derivados_foto(moto_id, row[-1])
+                if derivados:
+                    foto_derivados[moto_id] = derivados
     except Exception:
         pass
     return render_template(
@@ -500,8 +588,10 @@ def listar_motos():
         exibicao_urls=exibicao_urls,
         procuracao_urls=procuracao_urls,
         foto_urls=foto_urls,
+        foto_derivados=foto_derivados,
         sale_prices=sale_prices,
-        anexos_venda=anexos_venda if 'anexos_venda' in locals() else {},
+        anexos_venda=anexos_venda,
+        pagina=pagina,
     )
 
 @app.route("/motos_vendidas")
@@ -510,6 +600,7 @@ def motos_vendidas():
         return redirect("/")
     # Filtra apenas motos vendidas
     filtros = {
+        "q": request.args.get("q", "").strip(),
         "marca_modelo": request.args.get("marca_modelo", ""),
         "placa": request.args.get("placa", ""),
         "renavam": request.args.get("renavam", ""),
@@ -522,79 +613,22 @@ def motos_vendidas():
         "preco_max": request.args.get("preco_max", ""),
         "status": "vendida",
         "dedup_placa": True,
+        "incluir_venda": True,
+        "incluir_foto": True,
     }
-    lista = database.filtrar_motos_completo(filtros)
-    # Buscar preço de venda (preco_final) mais recente por moto e anexos (CNH, Garantia assinada, Endereço)
-    sale_prices = {}
-    sale_dates = {}
-    anexos_venda = {}
-    try:
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT v.moto_id, v.preco_final, v.data
-            FROM vendas v
-            INNER JOIN (
-                SELECT moto_id, MAX(id) AS max_id
-                FROM vendas
-                GROUP BY moto_id
-            ) ult ON ult.moto_id = v.moto_id AND ult.max_id = v.id
-            """
-        )
-        for moto_id, preco_final, data_venda in cursor.fetchall():
-            if preco_final is not None:
-                sale_prices[moto_id] = float(preco_final)
-            # Guardar data (string como salva no banco)
-            sale_dates[moto_id] = data_venda
-        cursor.execute(
-            """
-            SELECT v.moto_id, v.cnh_path, v.garantia_path, v.endereco_path
-            FROM vendas v
-            INNER JOIN (
-                SELECT moto_id, MAX(id) AS max_id
-                FROM vendas
-                GROUP BY moto_id
-            ) ult ON ult.moto_id = v.moto_id AND ult.max_id = v.id
-            WHERE v.cnh_path IS NOT NULL OR v.garantia_path IS NOT NULL OR v.endereco_path IS NOT NULL
-            """
-        )
-        for moto_id, cnh_p, gar_p, end_p in cursor.fetchall():
-            anexos_venda[moto_id] = {
-                'cnh': _file_url(cnh_p) if cnh_p else None,
-                'garantia': _file_url(gar_p) if gar_p else None,
-                'endereco': _file_url(end_p) if end_p else None,
-            }
-        conn.close()
-    except Exception as e:
-        print(f"Aviso: falha ao carregar dados de vendas para motos vendidas: {e}")
-
     # Filtro opcional por mês (YYYY-MM) da data de saída
     periodo = request.args.get('periodo', '').strip()
-    if periodo:
-        def match_period(row):
-            mid = row[0]
-            dv = str(sale_dates.get(mid, '') or '')
-            if not dv:
-                return False
-            try:
-                if '-' in dv and dv[4] == '-':
-                    ym = dv[:7]
-                elif '/' in dv:
-                    partes = dv.split(' ')[0].split('/')
-                    ym = f"{partes[2]}-{partes[1]}"
-                else:
-                    return False
-                return ym == periodo
-            except Exception:
-                return False
-        lista = [row for row in lista if match_period(row)]
+    if _periodo_valido(periodo):
+        filtros["periodo_venda"] = periodo
+    lista, pagina = _paginar_motos(filtros)
+    # Preço de venda (preco_final), data e anexos da última venda já vêm na linha (índices 26..30)
+    sale_prices, sale_dates, anexos_venda = _dados_ultima_venda(lista)
 
     # Mapear links de Procuração e Foto por moto (Garantia NÃO deve aparecer na listagem)
     procuracao_urls = {}
     foto_urls = {}
+    foto_derivados = {}
     try:
-        base_static = os.path.join(os.path.dirname(database.__file__), "static")
         for row in lista:
             moto_id = row[0]
             # Sempre usar rota dinâmica para garantir dados atualizados
@@ -602,12 +636,12 @@ def motos_vendidas():
                 procuracao_urls[moto_id] = url_for('download_procuracao_moto', moto_id=moto_id)
             except Exception:
                 pass
-            # Foto: procurar por extensões conhecidas
-            for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                p = os.path.join(app.config['UPLOAD_FOLDER'], f"foto_moto_{moto_id}{ext}")
-                if os.path.exists(p):
-                    foto_urls[moto_id] = url_for('static', filename=f"uploads/{os.path.basename(p)}")
-                    break
+            # Foto: nome e versão vêm nas duas últimas colunas da linha
+            if row[-2]:
+                foto_urls[moto_id] = _url_foto(row[-2], row[-1])
+                derivados = _derivados_foto(moto_id, row[-1])
+                if derivados:
+                    foto_derivados[moto_id] = derivados
     except Exception:
         pass
 
@@ -617,52 +651,108 @@ def motos_vendidas():
         filtros=filtros,
         procuracao_urls=procuracao_urls,
         foto_urls=foto_urls,
+        foto_derivados=foto_derivados,
         sale_prices=sale_prices,
         sale_dates=sale_dates,
         anexos_venda=anexos_venda,
-        lucros_por_mes=_calcular_lucros_por_mes(lista, sale_prices, sale_dates),
+        periodo=periodo,
+        pagina=pagina,
+        # Resumo considera todas as vendas do filtro, não só a página atual
+        lucros_por_mes=database.lucros_por_mes(filtros) if session.get("tipo") == "admin" else {},
     )
 
-def _calcular_lucros_por_mes(lista_motos, sale_prices, sale_dates):
+# Paginação por chave (keyset) das listagens de motos
+POR_PAGINA_OPCOES = (25, 50, 100, 200)
+POR_PAGINA_PADRAO = 50
+
+def _periodo_valido(periodo: str) -> bool:
+    """Aceita apenas 'YYYY-MM' (valor do input type=month)."""
+    import re
+    return bool(periodo) and re.match(r"^\d{4}-(0[1-9]|1[0-2])$", periodo) is not None
+
+def _paginar_motos(filtros):
     """
-    Calcula lucros por mês (YYYY-MM) com base no preço de venda mais recente (sale_prices)
-    menos o preço cadastrado (coluna 6 da lista) e agrupa pela data da venda em sale_dates.
-    Retorna um dicionário { 'YYYY-MM': total_lucro_float } ordenado por mês.
+    Busca uma página de motos usando os parâmetros da URL (apos/antes/por_pagina; na busca
+    por relevância, inicio/por_pagina).
+
+    Retorna (linhas, pagina) onde `pagina` traz o total (cacheado) e as URLs de navegação,
+    preservando todos os filtros da query string para que as páginas possam ser salvas/compartilhadas.
     """
-    try:
-        # Agrupar somatórios
-        somas = {}
-        for row in lista_motos:
-            try:
-                moto_id = row[0]
-                preco_base = float(row[6] or 0)
-                pv = sale_prices.get(moto_id)
-                if pv is None:
-                    continue
-                lucro = float(pv) - preco_base
-                data_venda = str(sale_dates.get(moto_id) or '')
-                if not data_venda:
-                    continue
-                # Normalizar para YYYY-MM
-                ym = None
-                if '-' in data_venda and len(data_venda) >= 7:
-                    ym = data_venda[:7]
-                elif '/' in data_venda:
-                    try:
-                        apenas_data = data_venda.split(' ')[0]
-                        d, m, a = apenas_data.split('/')
-                        ym = f"{a}-{m}"
-                    except Exception:
-                        ym = None
-                if not ym:
-                    continue
-                somas[ym] = somas.get(ym, 0.0) + lucro
-            except Exception:
-                continue
-        # Ordenar pelo mês
-        return dict(sorted(somas.items()))
-    except Exception:
-        return {}
+    por_pagina = request.args.get("por_pagina", POR_PAGINA_PADRAO, type=int)
+    if por_pagina not in POR_PAGINA_OPCOES:
+        por_pagina = POR_PAGINA_PADRAO
+    apos = request.args.get("apos", type=int)
+    antes = request.args.get("antes", type=int) if apos is None else None
+
+    relevancia = bool(database.termos_busca(filtros.get("q"))) and database.indice_busca_disponivel()
+    inicio = 0
+    if relevancia:
+        # Busca por relevância: a ordem não é por ID, então navega por deslocamento (?inicio=N).
+        # O resultado de uma busca é pequeno; o OFFSET não chega a pesar como numa listagem inteira.
+        apos = antes = None
+        inicio = max(request.args.get("inicio", 0, type=int), 0)
+        lista = database.filtrar_motos_completo(filtros, limite=por_pagina + 1, deslocamento=inicio)
+        tem_proxima = len(lista) > por_pagina
+        lista = lista[:por_pagina]
+        tem_anterior = inicio > 0
+    elif antes is not None:
+        lista = database.filtrar_motos_completo(filtros, antes_id=antes, limite=por_pagina + 1)
+        tem_anterior = len(lista) > por_pagina
+        lista = lista[-por_pagina:]
+        tem_proxima = True
+    else:
+        # Busca um registro a mais para saber se existe página seguinte
+        lista = database.filtrar_motos_completo(filtros, apos_id=apos, limite=por_pagina + 1)
+        tem_proxima = len(lista) > por_pagina
+        lista = lista[:por_pagina]
+        tem_anterior = apos is not None
+
+    args = {k: v for k, v in request.args.items() if k not in ("apos", "antes", "inicio")}
+    def _url(**extra):
+        return url_for(request.endpoint, **dict(args, **extra))
+    if relevancia:
+        anterior_url = (_url(inicio=inicio - por_pagina) if inicio > por_pagina else _url()) if tem_anterior else None
+        proxima_url = _url(inicio=inicio + por_pagina) if tem_proxima else None
+    else:
+        anterior_url = _url(antes=lista[0][0]) if (tem_anterior and lista) else None
+        proxima_url = _url(apos=lista[-1][0]) if (tem_proxima and lista) else None
+    pagina = {
+        "por_pagina": por_pagina,
+        "relevancia": relevancia,
+        "total": database.contar_motos(filtros),
+        "primeira_url": _url() if (apos is not None or antes is not None or inicio) else None,
+        "anterior_url": anterior_url,
+        "proxima_url": proxima_url,
+        "opcoes": [(n, url_for(request.endpoint, **dict(args, por_pagina=n))) for n in POR_PAGINA_OPCOES],
+    }
+    return lista, pagina
+
+def _dados_ultima_venda(lista_motos):
+    """
+    Monta os dicionários usados pelas listagens a partir das colunas da última venda
+    (filtrar_motos_completo com 'incluir_venda'): preços, datas e URLs dos anexos por moto.
+    """
+    sale_prices = {}
+    sale_dates = {}
+    anexos_venda = {}
+    for row in lista_motos:
+        if len(row) < 31:
+            continue
+        moto_id = row[0]
+        preco_final, data_venda, cnh_p, gar_p, end_p = row[26:31]
+        if preco_final is not None:
+            sale_prices[moto_id] = float(preco_final)
+        if data_venda is not None:
+            # Guardar data (string como salva no banco)
+            sale_dates[moto_id] = data_venda
+        if cnh_p or gar_p or end_p:
+            anexos_venda[moto_id] = {
+                'cnh': _file_url(cnh_p) if cnh_p else None,
+                'garantia': _file_url(gar_p) if gar_p else None,
+                'endereco': _file_url(end_p) if end_p else None,
+            }
+    return sale_prices, sale_dates, anexos_venda
+
 @app.route("/editar_moto/<int:id>", methods=["GET", "POST"])
 def editar_moto(id):
     if "usuario" not in session or session["tipo"] not in ["admin", "vendedor"]:
@@ -731,21 +821,19 @@ def editar_moto(id):
 
         
 
-        # Processar foto da moto (opcional)
+        # Processar foto da moto (opcional); o nome vai para motos.foto no mesmo UPDATE
         foto = request.files.get('foto_moto')
         if foto and foto.filename:
-            fname = secure_filename(foto.filename)
-            _, ext = os.path.splitext(fname)
-            ext = (ext or '').lower()
-            if ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                foto_name = f"foto_moto_{id}{ext}"
-                foto_path = os.path.join(app.config['UPLOAD_FOLDER'], foto_name)
-                foto.save(foto_path)
+            _, ext = os.path.splitext(secure_filename(foto.filename))
+            if ext.lower() in database.FOTO_EXTENSOES:
+                dados["foto"] = _salvar_foto_moto(foto, id, ext)
             else:
                 flash('Formato de imagem não suportado. Use JPG, PNG, GIF ou WEBP.', 'warning')
 
         # Efetivar atualização e redirecionar
         database.atualizar_moto(id, dados)
+        if dados.get("foto"):
+            fotos.agendar(id, indice_static)
         return redirect("/listar_motos")
     return render_template("editar_moto.html", moto=moto)
 
@@ -811,12 +899,8 @@ def registrar_venda():
                 f = request.files.get(campo)
                 if f and f.filename:
                     fname = secure_filename(f.filename)
-                    # prefixar com moto e timestamp para evitar conflitos
-                    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
                     base, ext = os.path.splitext(fname)
-                    safe_name = f"{campo}_{moto_id}_{ts}{ext.lower()}"
-                    dest = os.path.join(app.config['UPLOAD_FOLDER'], safe_name)
-                    f.save(dest)
+                    safe_name = _gravar_documento(f, ext, campo)
                     if varname == "cnh_filename":
                         cnh_filename = safe_name
                     elif varname == "garantia_filename":
@@ -836,12 +920,20 @@ def registrar_venda():
             endereco_path=endereco_filename,
         )
         if resultado:
-            # resultado é o venda_id; usar para gerar garantia com data da venda
-            pdf_path = database.gerar_pdf_garantia(moto_id, venda_id=resultado)
-            pdf_url = url_for('static', filename=os.path.basename(pdf_path)) if pdf_path else None
-            # gerar Procuração e montar URL
-            procuracao_path = database.gerar_pdf_procuracao(moto_id, venda_id=resultado)
-            procuracao_url = url_for('static', filename=os.path.basename(procuracao_path)) if procuracao_path else None
+            # resultado é o venda_id; garantia (com data da venda) e procuração são geradas em
+            # segundo plano e a página mostra links pendentes que se atualizam sozinhos
+            pdf_url = procuracao_url = None
+            jobs_pendentes = {}
+            for tipo in ("garantia", "procuracao"):
+                try:
+                    job_id = doc_jobs.enfileirar(tipo, moto_id, venda_id=resultado)
+                    jobs_pendentes[tipo] = url_for("status_documento", job_id=job_id)
+                    if tipo == "garantia":
+                        pdf_url = url_for("baixar_documento", job_id=job_id)
+                    else:
+                        procuracao_url = url_for("baixar_documento", job_id=job_id)
+                except Exception as e:
+                    print(f"Aviso: não foi possível agendar {tipo} da moto {moto_id}: {e}")
             # Montar URLs de visualização/impressão dos anexos (se existirem)
             cnh_url = _file_url(cnh_filename) if cnh_filename else None
             garantia_anexada_url = _file_url(garantia_filename) if garantia_filename else None
@@ -853,6 +945,7 @@ def registrar_venda():
                 moto_id=moto_id,
                 pdf_garantia_url=pdf_url,
                 pdf_procuracao_url=procuracao_url,
+                jobs_pendentes=jobs_pendentes,
                 cnh_url=cnh_url,
                 garantia_anexada_url=garantia_anexada_url,
                 endereco_url=endereco_url,
@@ -867,6 +960,7 @@ def registrar_venda():
 
     # Exibe a página de busca e seleção de motos
     filtros = {
+        "q": request.args.get("q", "").strip(),
         "marca_modelo": request.args.get("marca_modelo", ""),
         "placa": request.args.get("placa", ""),
         "renavam": request.args.get("renavam", ""),
@@ -883,12 +977,13 @@ def registrar_venda():
         "dedup_por_status": True,
     }
     # Lista estoque (disponíveis + consignado); aplica filtros adicionais se informados
-    lista_motos = database.filtrar_motos_completo(filtros)
+    lista_motos, pagina = _paginar_motos(filtros)
     
     return render_template(
         tpl_registro,
         motos=lista_motos,
         filtros=filtros,
+        pagina=pagina,
         sucesso=None,
     )
 
@@ -903,10 +998,8 @@ def recibo_venda(id):
     pdf_garantia_url = None
     try:
         moto_id = dados[0]
-        base_static = os.path.join(os.path.dirname(database.__file__), "static")
-        gar = os.path.join(base_static, f"garantia_moto_{moto_id}.pdf")
-        if os.path.exists(gar):
-            pdf_garantia_url = url_for('static', filename=os.path.basename(gar))
+        if _existe_static(f"garantia_moto_{moto_id}.pdf"):
+            pdf_garantia_url = _url_static(f"garantia_moto_{moto_id}.pdf")
     except Exception:
         pass
     # Importante: Não expor link de Procuração aqui; Procuração só deve aparecer na listagem de motos.
@@ -916,12 +1009,13 @@ def recibo_venda(id):
 def download_recibo(id):
     # Nota: id aqui é o moto_id, mas precisamos usar a função original para manter compatibilidade
     try:
-        caminho_pdf = database.gerar_pdf_recibo(id)
-        if caminho_pdf and os.path.exists(caminho_pdf):
-            return send_file(caminho_pdf, as_attachment=True, download_name=f"recibo_moto_{id}.pdf")
+        recibo = database.gerar_pdf_recibo(id)
+        if recibo:
+            conteudo, mimetype, fp = recibo
+            return _enviar_documento_memoria(conteudo, mimetype, f"recibo_moto_{id}.pdf", fp)
         else:
-            # Se o arquivo não foi criado ou não existe, redireciona com erro
-            print(f"Arquivo PDF não encontrado: {caminho_pdf}")
+            # Se o recibo não pôde ser gerado, redireciona com erro
+            print(f"Recibo não gerado para a moto {id}")
             return redirect("/relatorio?erro=pdf_nao_encontrado")
     except Exception as e:
         print(f"Erro ao gerar/baixar recibo: {e}")
@@ -932,17 +1026,16 @@ def download_recibo(id):
 @app.route("/download_recibo_venda/<int:venda_id>")
 def download_recibo_venda(venda_id):
     try:
-        caminho_arquivo = database.gerar_pdf_recibo_por_venda_id(venda_id)
-        if caminho_arquivo and os.path.exists(caminho_arquivo):
-            # Verificar se é PDF ou HTML
-            if caminho_arquivo.endswith('.pdf'):
-                nome_download = f"recibo_venda_{venda_id}.pdf"
-                return send_file(caminho_arquivo, as_attachment=True, download_name=nome_download)
-            elif caminho_arquivo.endswith('.html'):
-                # Para HTML, abrir em nova aba ao invés de download
-                return send_file(caminho_arquivo, mimetype='text/html')
+        recibo = database.gerar_pdf_recibo_por_venda_id(venda_id)
+        if recibo:
+            conteudo, mimetype, fp = recibo
+            # PDF vai como download; o HTML alternativo abre em nova aba (e com extensão .html se salvo)
+            eh_pdf = mimetype == "application/pdf"
+            return _enviar_documento_memoria(conteudo, mimetype,
+                                             f"recibo_venda_{venda_id}.{'pdf' if eh_pdf else 'html'}", fp,
+                                             anexo=eh_pdf)
         else:
-            print(f"Arquivo não encontrado: {caminho_arquivo}")
+            print(f"Recibo não gerado para a venda {venda_id}")
             return redirect("/relatorio?erro=arquivo_nao_encontrado")
     except Exception as e:
         print(f"Erro ao baixar recibo da venda {venda_id}: {e}")
@@ -953,7 +1046,8 @@ def download_recibo_venda(venda_id):
 def relatorio():
     if "usuario" not in session:
         return redirect("/")
-    estoque, vendas, resumo = database.gerar_relatorio()
+    estoque, resumo = database.gerar_relatorio()
+    vendas = [(vendedor, total) for vendedor, total, _receita in kpis.vendas_por_vendedor()]
     return render_template("relatorio.html", estoque=estoque, vendas=vendas, resumo=resumo)
 
 @app.route("/redefinir_senha_usuario/<int:usuario_id>", methods=["POST"])
@@ -1314,6 +1408,15 @@ def vendas_por_vendedor():
     data_fim = request.args.get("data_fim")
     ordenar = request.args.get("ordenar_por", "total_vendas")
 
+    inicio_dt = database.parse_data_legada(data_inicio)
+    fim_dt = database.parse_data_legada(data_fim)
+    if not inicio_dt and not fim_dt:
+        # Sem filtro de datas: totais de todo o período vêm do cache de indicadores
+        vendas = kpis.vendas_por_vendedor()
+        if ordenar == "total_receita":
+            vendas = sorted(vendas, key=lambda v: v[2], reverse=True)
+        return render_template("vendas_por_vendedor.html", vendas=vendas)
+
     conn = database.get_db_connection()
     cursor = conn.cursor()
 
@@ -1328,12 +1431,14 @@ def vendas_por_vendedor():
     """
     params = []
 
-    if data_inicio:
-        query += " AND v.data >= %s"
-        params.append(data_inicio)
-    if data_fim:
-        query += " AND v.data <= %s"
-        params.append(data_fim)
+    # Faixa de datas sobre a coluna tipada/indexada (data_fim inclusiva: até o fim do dia)
+    if inicio_dt:
+        query += " AND v.data_dt >= %s"
+        params.append(inicio_dt)
+    if fim_dt:
+        from datetime import timedelta
+        query += " AND v.data_dt < %s"
+        params.append(fim_dt + timedelta(days=1))
 
     # Ajustar ordenação baseada no parâmetro
     if ordenar == "total_receita":
@@ -1346,53 +1451,321 @@ def vendas_por_vendedor():
 
     return render_template("vendas_por_vendedor.html", vendas=vendas)
 
-# EXPORTAÇÃO PARA EXCEL
+# EXPORTAÇÃO PARA EXCEL/CSV (cache por versão das tabelas: ver exportacao.py)
+def _resposta_exportacao(nome_base, cabecalho, linhas, formato, titulo, tabelas):
+    """
+    Envia a exportação em cache para as versões atuais de `tabelas`, gerando-a se alguma mudou.
+    `linhas()` produz as linhas (só é chamada quando o arquivo precisa ser gerado).
+    """
+    parametros = (tuple(cabecalho), formato)
+    versoes = database.versoes_tabelas(*tabelas)
+    nome_download = f"{nome_base}.{formato}"
+    chave = exportacao.chave_armazenamento(nome_base, parametros, versoes, formato)
+    if armazenamento.existe_remoto(chave, confirmar=True):
+        # Versão já no bucket (gerada por qualquer instância): download direto de lá
+        return redirect(armazenamento.url(chave, nome_download))
+    if formato == "csv":
+        arquivo, blocos, etag = exportacao.csv_em_cache(nome_base, parametros, versoes, cabecalho, linhas)
+        if blocos is not None:
+            # Esta requisição gera a versão: o CSV sai para o cliente enquanto é gravado no cache
+            resposta = app.response_class(
+                blocos,
+                mimetype="text/csv",
+                headers={"Content-Disposition": f"attachment; filename={nome_download}"},
+            )
+            resposta.set_etag(etag)
+            resposta.cache_control.max_age = 0
+            return resposta
+        mimetype = "text/csv"
+    else:
+        gravar = lambda destino: exportacao.gravar_xlsx(cabecalho, linhas(), destino, titulo)
+        arquivo, etag = exportacao.em_cache(nome_base, parametros, versoes, formato, gravar)
+        if arquivo is None:
+            return redirect(armazenamento.url(chave, nome_download))
+        mimetype = exportacao.MIMETYPE_XLSX
+    resposta = send_file(arquivo, mimetype=mimetype, as_attachment=True,
+                         download_name=nome_download, etag=etag, max_age=0)
+    if resposta.status_code == 200:
+        resposta.content_length = os.fstat(arquivo.fileno()).st_size
+    return resposta
+
+def _formato_exportacao():
+    return "csv" if request.args.get("formato", "").lower() == "csv" else "xlsx"
+
 @app.route("/exportar_vendas_excel")
 def exportar_vendas_excel():
-    import pandas as pd
-    conn = database.get_db_connection()
-    df = pd.read_sql(
-        """
-        SELECT v.vendedor,
-               COUNT(m.id) AS total_vendas,
-               COALESCE(SUM(COALESCE(v.preco_final, m.preco)), 0) AS receita_total
-        FROM vendas v
-        INNER JOIN motos m ON v.moto_id = m.id
-        GROUP BY v.vendedor
-        ORDER BY total_vendas DESC
-        """,
-        conn,
+    if "usuario" not in session:
+        return redirect("/")
+    return _resposta_exportacao("vendas_por_vendedor", database.CABECALHO_VENDAS_POR_VENDEDOR,
+                                database.iterar_vendas_por_vendedor, _formato_exportacao(),
+                                "Vendas por vendedor", ("vendas", "motos"))
+
+def _colunas_exportacao_motos():
+    """Colunas pedidas em ?colunas=... (na ordem da tabela); sem seleção, as colunas de sempre."""
+    pedidas = set(request.args.getlist("colunas"))
+    colunas = [chave for chave, _titulo in database.COLUNAS_EXPORTACAO_MOTOS if chave in pedidas]
+    return colunas or list(database.COLUNAS_EXPORTACAO_MOTOS_PADRAO)
+
+# Exportação de Motos para Excel/CSV (admin)
+@app.route("/exportar_motos")
+def exportar_motos():
+    if "usuario" not in session or session.get("tipo") != "admin":
+        return redirect("/")
+    return render_template("exportar_motos.html", colunas=database.COLUNAS_EXPORTACAO_MOTOS,
+                           padrao=database.COLUNAS_EXPORTACAO_MOTOS_PADRAO,
+                           cursor_alteracoes=database.cursor_alteracoes())
+
+@app.route("/exportar_motos_excel")
+def exportar_motos_excel():
+    if "usuario" not in session or session.get("tipo") != "admin":
+        return redirect("/")
+    colunas = _colunas_exportacao_motos()
+    return _resposta_exportacao("motos", colunas, lambda: database.iterar_exportacao_motos(colunas),
+                                _formato_exportacao(), "Motos", ("motos",))
+
+# Alterações de motos/vendas desde um cursor (sincronização incremental, admin)
+def _cursor_alteracoes():
+    """Cursor em ?since= (id da última alteração já recebida); None se inválido."""
+    try:
+        return max(int(request.args.get("since") or 0), 0)
+    except ValueError:
+        return None
+
+@app.route("/api/changes")
+def api_changes():
+    if "usuario" not in session:
+        return jsonify(erro="não autenticado"), 401
+    if session.get("tipo") != "admin":
+        return jsonify(erro="acesso restrito ao admin"), 403
+    desde = _cursor_alteracoes()
+    tabela = request.args.get("tabela") or None
+    if desde is None or (tabela and tabela not in database.COLUNAS_ALTERACOES):
+        return jsonify(erro="parâmetros inválidos"), 400
+    limite = min(max(request.args.get("limite", 1000, type=int), 1), 5000)
+    linhas = database.listar_alteracoes(desde, limite, tabela)
+    return jsonify(
+        alteracoes=[
+            {"cursor": i, "tabela": t, "id": registro_id, "operacao": op, "em": str(em)}
+            for i, t, registro_id, op, em in linhas
+        ],
+        cursor=linhas[-1][0] if linhas else desde,
+        mais=len(linhas) == limite,
     )
-    conn.close()
 
-    pasta = os.path.join(app.root_path, "static", "exports")
-    os.makedirs(pasta, exist_ok=True)
-    caminho = os.path.join(pasta, "vendas_por_vendedor.xlsx")
-    df.to_excel(caminho, index=False)
+@app.route("/exportar_alteracoes")
+def exportar_alteracoes():
+    if "usuario" not in session or session.get("tipo") != "admin":
+        return redirect("/")
+    tabela = request.args.get("tabela", "motos")
+    desde = _cursor_alteracoes()
+    if tabela not in database.COLUNAS_ALTERACOES or desde is None:
+        flash("Tabela ou cursor inválido.", "danger")
+        return redirect(url_for("exportar_motos"))
+    ate = database.cursor_alteracoes()
+    cabecalho = database.cabecalho_alteracoes(tabela)
+    linhas = database.iterar_alteracoes_tabela(tabela, desde, ate)
+    # O nome do arquivo (e o cabeçalho X-Cursor) traz o cursor para a próxima exportação
+    nome = f"alteracoes_{tabela}_{desde}_{ate}"
+    if _formato_exportacao() == "csv":
+        resposta = app.response_class(
+            exportacao.gerar_csv(cabecalho, linhas),
+            mimetype="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={nome}.csv"},
+        )
+    else:
+        resposta = send_file(exportacao.xlsx_temporario(cabecalho, linhas, f"Alterações {tabela}"),
+                             mimetype=exportacao.MIMETYPE_XLSX, as_attachment=True,
+                             download_name=f"{nome}.xlsx", max_age=0)
+    resposta.headers["X-Cursor"] = str(ate)
+    return resposta
+
+# Documentos gerados em segundo plano (doc_jobs)
+def _url_fallback_documento(job):
+    # Job falhou: o link cai na geração síncrona da própria moto
+    if job[1] == "garantia":
+        return url_for("gerar_garantia_moto", moto_id=job[2])
+    return url_for("download_procuracao_moto", moto_id=job[2])
+
+@app.route("/documentos/<int:job_id>/status")
+def status_documento(job_id: int):
+    if "usuario" not in session:
+        return jsonify(erro="não autenticado"), 401
+    job = database.buscar_job_documento(job_id)
+    if not job:
+        return jsonify(erro="job não encontrado"), 404
+    status = job[4]
+    url = None
+    if status == "pronto" and job[6]:
+        url = _url_static(job[6])
+    elif status == "erro":
+        url = _url_fallback_documento(job)
+    return jsonify(id=job[0], tipo=job[1], status=status, tentativas=job[5], url=url, erro=job[7])
+
+@app.route("/documentos/<int:job_id>")
+def baixar_documento(job_id: int):
+    if "usuario" not in session:
+        return redirect("/")
+    job = database.buscar_job_documento(job_id)
+    if not job:
+        return redirect("/registrar_venda")
+    if job[4] == "pronto" and job[6]:
+        return redirect(_url_static(job[6]))
+    if job[4] == "erro":
+        return redirect(_url_fallback_documento(job))
+    return render_template("documento_pendente.html", job=job)
+
+def _filtros_lote(ids="", status="", periodo=""):
+    """Filtros do lote de documentos: lista de IDs, status e/ou mês da venda (YYYY-MM)."""
+    filtros = {}
+    lista_ids = [int(x) for x in str(ids or "").replace(";", ",").replace(" ", ",").split(",") if x.strip().isdigit()]
+    if lista_ids:
+        filtros["ids"] = lista_ids
+    if status:
+        filtros["status"] = status
+    if periodo and _periodo_valido(periodo):
+        filtros["periodo_venda"] = periodo
+    return filtros
+
+def _tipos_lote(tipos):
+    escolhidos = [t for t in str(tipos or "").split(",") if t in doc_jobs.TIPOS_DOCUMENTO]
+    return escolhidos or list(doc_jobs.TIPOS_DOCUMENTO)
+
+# Reimpressão em lote: ZIP com garantias/procurações geradas em paralelo, enviado em streaming
+@app.route("/documentos/lote")
+def documentos_lote():
+    if "usuario" not in session or session.get("tipo") != "admin":
+        return redirect("/")
+    filtros = _filtros_lote(request.args.get("ids", ""), request.args.get("status", "").strip(),
+                            request.args.get("periodo", "").strip())
+    if not filtros:
+        flash("Informe IDs, status ou período para gerar os documentos em lote.", "warning")
+        return redirect(request.referrer or "/motos_vendidas")
+    moto_ids = [row[0] for row in database.filtrar_motos_completo(filtros)]
+    if not moto_ids:
+        flash("Nenhuma moto encontrada para os filtros informados.", "warning")
+        return redirect(request.referrer or "/motos_vendidas")
+    tipos = _tipos_lote(request.args.get("tipos", ""))
+    nome = f"documentos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return app.response_class(
+        doc_jobs.zip_lote(tipos, moto_ids),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={nome}"},
+    )
 
-    return send_file(caminho, as_attachment=True, download_name="vendas_por_vendedor.xlsx")
+@app.cli.command("documentos-lote")
+@click.option("--ids", default="", help="IDs das motos separados por vírgula")
+@click.option("--status", default="", help="Status das motos (ex.: vendida)")
+@click.option("--periodo", default="", help="Mês da venda no formato YYYY-MM")
+@click.option("--tipos", default="garantia,procuracao", help="garantia, procuracao ou ambos")
+@click.option("--processos", default=0, type=int, help="Processos em paralelo (padrão: núcleos da CPU)")
+@click.option("--saida", default="documentos.zip", help="Arquivo ZIP de saída")
+def documentos_lote_comando(ids, status, periodo, tipos, processos, saida):
+    """Gera garantias/procurações das motos filtradas em um arquivo ZIP."""
+    filtros = _filtros_lote(ids, status, periodo)
+    if not filtros:
+        raise click.UsageError("Informe --ids, --status ou --periodo.")
+    moto_ids = [row[0] for row in database.filtrar_motos_completo(filtros)]
+    with open(saida, "wb") as f:
+        for parte in doc_jobs.zip_lote(_tipos_lote(tipos), moto_ids, processos or None):
+            f.write(parte)
+    print(f"{len(moto_ids)} moto(s) processada(s): {saida}")
+
+@app.cli.command("fotos-derivados")
+@click.option("--refazer", is_flag=True, help="Regera também os derivados já existentes")
+def fotos_derivados_comando(refazer):
+    """Gera miniaturas/WebP das fotos já cadastradas (backfill de static/uploads)."""
+    if fotos.Image is None:
+        raise click.ClickException("Pillow não está instalado.")
+    total = gerados = 0
+    for moto_id, foto, versao in database.listar_fotos_motos():
+        total += 1
+        try:
+            gravados, _removidos = fotos.gerar_derivados(moto_id, foto, versao, refazer=refazer)
+            gerados += len(gravados)
+        except Exception as e:
+            print(f"Aviso: foto da moto {moto_id} ({foto}) ignorada: {e}")
+    print(f"{total} foto(s) verificada(s), {gerados} derivado(s) gerado(s).")
+
+@app.cli.command("exportar-analitico")
+@click.option("--saida", default=None, help="Pasta de saída (padrão: ANALITICO_PASTA ou ./analitico)")
+@click.option("--tabelas", default="", help="Tabelas separadas por vírgula (padrão: motos,vendas,receitas,gastos)")
+@click.option("--formato", type=click.Choice(["parquet", "feather", "npz"]), default=None,
+              help="Padrão: parquet com pyarrow, senão npz")
+def exportar_analitico_comando(saida, tabelas, formato):
+    """Exporta motos/vendas/receitas/gastos em arquivos colunares particionados por mês."""
+    nomes = [t.strip() for t in tabelas.split(",") if t.strip()]
+    invalidas = [t for t in nomes if t not in analitico.CONJUNTOS]
+    if invalidas:
+        raise click.UsageError(f"Tabela(s) desconhecida(s): {', '.join(invalidas)}")
+    try:
+        manifesto = analitico.exportar(saida, nomes or None, formato)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for tabela, info in manifesto["tabelas"].items():
+        if not nomes or tabela in nomes:
+            print(f"{tabela}: {info['linhas']} linha(s) em {len(info['particoes'])} partição(ões)")
+    print(f"Formato {manifesto['formato']}: {saida or analitico.PASTA_PADRAO}")
+
+@app.cli.command("sincronizar-armazenamento")
+def sincronizar_armazenamento_comando():
+    """Envia ao bucket (ARMAZENAMENTO=s3) os arquivos de static/ que ele ainda não tem."""
+    try:
+        enviados, existentes = armazenamento.sincronizar(STATIC_FOLDER_ABS)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    print(f"{enviados} arquivo(s) enviado(s), {existentes} já estavam no bucket.")
 
-# Exportação de Motos para Excel (admin)
-@app.route("/exportar_motos_excel")
-def exportar_motos_excel():
+@app.route("/admin/documentos")
+def jobs_documentos():
     if "usuario" not in session or session.get("tipo") != "admin":
         return redirect("/")
-    import pandas as pd
-    conn = database.get_db_connection()
-    df = pd.read_sql(
-        """
-        SELECT id, marca, modelo, ano, cor, km, preco, placa, combustivel, status
-        FROM motos
-        ORDER BY id DESC
-        """,
-        conn,
+    return render_template("documentos_jobs.html", jobs=database.listar_jobs_documentos(100))
+
+def _formatar_bytes(n):
+    for unidade in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unidade == "GB":
+            return f"{n:.0f} {unidade}" if unidade == "B" else f"{n:.1f} {unidade}"
+        n /= 1024
+
+@app.cli.command("limpar-arquivos")
+@click.option("--apagar", is_flag=True, help="Apaga os arquivos (sem esta opção só informa)")
+@click.option("--carencia-horas", default=None, type=float,
+              help="Só considera órfãos modificados há mais de N horas (padrão: GC_ARQUIVOS_CARENCIA_HORAS ou 24)")
+@click.option("--listar", is_flag=True, help="Lista cada arquivo órfão")
+def limpar_arquivos_comando(apagar, carencia_horas, listar):
+    """Procura (e opcionalmente apaga) arquivos de static/ e static/uploads sem referência no banco."""
+    relatorio = coleta_arquivos.coletar(carencia_horas=carencia_horas, apagar=apagar)
+    if listar:
+        for rel, tamanho in relatorio["candidatos"]:
+            print(f"{_formatar_bytes(tamanho):>10}  {rel}")
+    print(f"{len(relatorio['candidatos'])} arquivo(s) órfão(s), {_formatar_bytes(relatorio['bytes'])} liberáveis; "
+          f"{relatorio['em_carencia']} ainda na carência.")
+    if apagar:
+        print(f"{relatorio['apagados']} apagado(s), {_formatar_bytes(relatorio['bytes_liberados'])} liberados.")
+
+# Economia da otimização de documentos digitalizados (admin)
+@app.route("/admin/uploads_stats")
+def uploads_stats():
+    if "usuario" not in session or session.get("tipo") != "admin":
+        return redirect("/")
+    (quantidade, original, final), recentes = database.resumo_uploads_otimizados()
+    return jsonify(
+        otimizados=quantidade,
+        bytes_originais=int(original),
+        bytes_gravados=int(final),
+        bytes_economizados=int(original) - int(final),
+        recentes=[
+            {"arquivo": a, "campo": c, "original": int(o), "gravado": int(g), "em": str(em)}
+            for a, c, o, g, em in recentes
+        ],
     )
-    conn.close()
-    pasta = os.path.join(app.root_path, "static", "exports")
-    os.makedirs(pasta, exist_ok=True)
-    caminho = os.path.join(pasta, "motos.xlsx")
-    df.to_excel(caminho, index=False)
-    return send_file(caminho, as_attachment=True, download_name="motos.xlsx")
+
+# Estatísticas do pool de conexões deste processo (admin)
+@app.route("/admin/pool_stats")
+def pool_stats():
+    if "usuario" not in session or session.get("tipo") != "admin":
+        return redirect("/")
+    return jsonify(pid=os.getpid(), pool=database.estatisticas_pool())
 
 @app.errorhandler(404)
 def not_found(e):
@@ -1400,5 +1773,4 @@ def not_found(e):
 
 # INICIALIZAÇÃO DO SISTEMA
 if __name__ == "__main__":
-    database.iniciar_db()
     app.run(debug=True, port=8080)
\ No newline at end of file
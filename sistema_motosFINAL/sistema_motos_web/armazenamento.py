@@ -0,0 +1,401 @@
+# Armazenamento de arquivos: backends (disco local ou S3) e anexos por conteúdo.
+# Cada anexo em static/uploads se chama {sha256}{ext}, então o mesmo documento enviado de novo (cadastro, edição, venda) aponta
+# para o objeto já gravado em vez de criar outra cópia.
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import time
+from urllib.parse import quote
+
+TAMANHO_BLOCO = 1024 * 1024
+_NOME_OBJETO = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)?$")
+# Derivados das fotos (fotos.nome_derivado): a versão faz parte do nome
+_DERIVADO = re.compile(r"^foto_moto_\d+_v\d+_[a-z]+\.[a-z0-9]+$")
+# Fotos das motos e seus derivados: as únicas chaves que podem ter URL pública (sem expiração)
+_FOTO_PUBLICA = re.compile(r"^uploads/(foto_moto_\d+\.[a-z0-9]+|derivados/foto_moto_\d+_v\d+_[a-z]+\.[a-z0-9]+)$")
+
+
+def nome_objeto(digest, ext):
+    return f"{digest}{(ext or '').lower()}"
+
+
+def eh_objeto(nome):
+    """True se `nome` já é um nome por conteúdo ({sha256}{ext})."""
+    return bool(nome) and _NOME_OBJETO.match(nome) is not None
+
+
+def _caminho_temporario(pasta):
+    return os.path.join(pasta, f".upload.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _reaproveitar(destino):
+    """
+    True se o objeto `destino` já existe. Renova o mtime dele: a carência da coleta de órfãos
+    (coleta_arquivos) volta a contar, então o objeto não é apagado antes de a linha que vai
+    apontar para ele ser gravada.
+    """
+    try:
+        os.utime(destino, None)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _publicar(tmp, pasta, nome):
+    """Move o temporário para o nome final; se o objeto já existe, só descarta o temporário."""
+    destino = os.path.join(pasta, nome)
+    if _reaproveitar(destino):
+        os.remove(tmp)
+        return False
+    os.replace(tmp, destino)
+    return True
+
+
+def gravar_stream(stream, pasta, ext):
+    """
+    Copia `stream` para `pasta` calculando o SHA-256 durante a cópia.
+
+    Retorna (nome, tamanho, novo); `novo` é False quando um objeto idêntico já existia
+    (nesse caso nada novo fica no disco).
+    """
+    tmp = _caminho_temporario(pasta)
+    h = hashlib.sha256()
+    tamanho = 0
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                bloco = stream.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                h.update(bloco)
+                f.write(bloco)
+                tamanho += len(bloco)
+        nome = nome_objeto(h.hexdigest(), ext)
+        return nome, tamanho, _publicar(tmp, pasta, nome)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def gravar_bytes(dados, pasta, ext):
+    """Como `gravar_stream`, para conteúdo já em memória (não escreve nada se o objeto existe)."""
+    nome = nome_objeto(hashlib.sha256(dados).hexdigest(), ext)
+    if _reaproveitar(os.path.join(pasta, nome)):
+        return nome, len(dados), False
+    tmp = _caminho_temporario(pasta)
+    with open(tmp, "wb") as f:
+        f.write(dados)
+    return nome, len(dados), _publicar(tmp, pasta, nome)
+
+
+def hash_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+# Backends de armazenamento dos arquivos servidos em /static (anexos, fotos, PDFs gerados e
+# exportações). A chave é o caminho relativo a static/ ('uploads/<hash>.pdf', 'garantia_moto_3.pdf',
+# 'exports/motos.xlsx'). O disco local continua sendo a área de trabalho (os PDFs são renderizados
+# nele); o backend decide onde a cópia servida aos usuários fica e qual URL o navegador recebe.
+def _content_type(chave):
+    return mimetypes.guess_type(chave)[0] or "application/octet-stream"
+
+
+class ArmazenamentoLocal:
+    """Arquivos servidos pelo próprio Flask a partir de static/ (um único disco)."""
+
+    remoto = False
+
+    def __init__(self, raiz):
+        self.raiz = raiz
+
+    def _caminho(self, chave):
+        return os.path.join(self.raiz, chave)
+
+    def publicar(self, caminho_local, chave):
+        destino = self._caminho(chave)
+        if os.path.abspath(caminho_local) != os.path.abspath(destino):
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            shutil.copyfile(caminho_local, destino)
+
+    def existe(self, chave):
+        return os.path.isfile(self._caminho(chave))
+
+    def remover(self, chave):
+        try:
+            os.remove(self._caminho(chave))
+        except FileNotFoundError:
+            pass
+
+    def url(self, chave, nome_download=None, imutavel=False, versao=None):
+        # None: a aplicação usa a rota /static
+        return None
+
+
+class ArmazenamentoS3:
+    """
+    Bucket S3 ou compatível (MinIO, R2, Backblaze...) compartilhado por todas as instâncias.
+
+    As chaves do bucket ficam em um índice em memória (uma listagem a cada `intervalo` segundos,
+    mais o que esta instância publica/remove), então `existe` não faz chamada de rede por página.
+    URLs: fotos das motos e derivados pedidos com versão (?v=) usam a URL pública estável
+    (S3_URL_PUBLICA: bucket público ou CDN), que o navegador guarda em cache; as demais chaves,
+    inclusive os anexos por conteúdo (CNH, comprovantes: dados pessoais), sempre URLs
+    pré-assinadas, reaproveitadas por metade da validade.
+    """
+
+    remoto = True
+
+    def __init__(self, bucket, prefixo="", endpoint_url=None, regiao=None, expira=900,
+                 url_publica=None, intervalo=60.0, cliente=None):
+        if cliente is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError as e:
+                raise RuntimeError("ARMAZENAMENTO=s3 requer o pacote boto3") from e
+            # Endereçamento por caminho: funciona com MinIO/local sem DNS por bucket
+            cliente = boto3.client(
+                "s3",
+                endpoint_url=endpoint_url or None,
+                region_name=regiao or None,
+                config=Config(signature_version="s3v4", s3={"addressing_style": "path"}),
+            )
+        self._cliente = cliente
+        self.bucket = bucket
+        self.prefixo = prefixo.strip("/")
+        self.expira = int(expira)
+        self.url_publica = (url_publica or "").rstrip("/") or None
+        self.intervalo = float(intervalo)
+        self._chaves = None
+        self._chaves_em = 0.0
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, chave):
+        return f"{self.prefixo}/{chave}" if self.prefixo else chave
+
+    def listar_objetos(self):
+        """(chave relativa ao prefixo, bytes, LastModified em segundos desde a época) de cada objeto."""
+        inicio = f"{self.prefixo}/" if self.prefixo else ""
+        paginador = self._cliente.get_paginator("list_objects_v2")
+        for pagina in paginador.paginate(Bucket=self.bucket, Prefix=inicio):
+            for obj in pagina.get("Contents", []):
+                yield obj["Key"][len(inicio):], obj.get("Size", 0), obj["LastModified"].timestamp()
+
+    def listar(self):
+        """Chaves do bucket (relativas ao prefixo)."""
+        for chave, _tamanho, _modificado in self.listar_objetos():
+            yield chave
+
+    def _indice(self):
+        agora = time.monotonic()
+        with self._lock:
+            if self._chaves is not None and agora - self._chaves_em < self.intervalo:
+                return self._chaves
+        chaves = set(self.listar())
+        with self._lock:
+            self._chaves, self._chaves_em = chaves, agora
+            return chaves
+
+    @staticmethod
+    def _metadados(chave):
+        extra = {"ContentType": _content_type(chave)}
+        if _DERIVADO.match(os.path.basename(chave)):
+            extra["CacheControl"] = "public, max-age=31536000, immutable"
+        elif eh_objeto(os.path.basename(chave)):
+            # Anexos pessoais: só o navegador guarda, nunca cache compartilhado (CDN/proxy)
+            extra["CacheControl"] = "private, max-age=31536000, immutable"
+        return extra
+
+    def publicar(self, caminho_local, chave):
+        self._cliente.upload_file(caminho_local, self.bucket, self._chave(chave),
+                                  ExtraArgs=self._metadados(chave))
+        with self._lock:
+            if self._chaves is not None:
+                self._chaves.add(chave)
+            self._urls = {k: v for k, v in self._urls.items() if k[0] != chave}
+
+    def existe(self, chave, confirmar=False):
+        """
+        Chave no índice em memória. `confirmar`: se não estiver, pergunta ao bucket (HEAD), para
+        ver na hora o que outra instância acabou de publicar.
+        """
+        if chave in self._indice():
+            return True
+        if not confirmar:
+            return False
+        try:
+            self._cliente.head_object(Bucket=self.bucket, Key=self._chave(chave))
+        except Exception:
+            return False
+        with self._lock:
+            if self._chaves is not None:
+                self._chaves.add(chave)
+        return True
+
+    def renovar(self, chave):
+        """
+        Copia o objeto sobre ele mesmo para renovar o LastModified: a carência da coleta de
+        órfãos (coleta_arquivos) volta a contar, como o mtime em `_reaproveitar`.
+        Retorna False se o objeto não existe mais no bucket.
+        """
+        destino = self._chave(chave)
+        try:
+            self._cliente.copy_object(
+                Bucket=self.bucket, Key=destino, CopySource={"Bucket": self.bucket, "Key": destino},
+                MetadataDirective="REPLACE", **self._metadados(chave))
+        except Exception:
+            with self._lock:
+                if self._chaves is not None:
+                    self._chaves.discard(chave)
+            return False
+        return True
+
+    def chaves(self, prefixo=""):
+        """Chaves do índice que começam com `prefixo`."""
+        return [c for c in self._indice() if c.startswith(prefixo)]
+
+    def remover(self, chave):
+        self._cliente.delete_object(Bucket=self.bucket, Key=self._chave(chave))
+        with self._lock:
+            if self._chaves is not None:
+                self._chaves.discard(chave)
+
+    def url(self, chave, nome_download=None, imutavel=False, versao=None):
+        if imutavel and self.url_publica and not nome_download and _FOTO_PUBLICA.match(chave):
+            url = f"{self.url_publica}/{quote(self._chave(chave))}"
+            return f"{url}?v={quote(str(versao))}" if versao is not None else url
+        # Mesma URL assinada por metade da validade: o navegador consegue reaproveitar o cache
+        agora = time.monotonic()
+        with self._lock:
+            item = self._urls.get((chave, nome_download))
+            if item and item[0] > agora:
+                return item[1]
+        params = {"Bucket": self.bucket, "Key": self._chave(chave)}
+        if nome_download:
+            params["ResponseContentDisposition"] = f'attachment; filename="{nome_download}"'
+        url = self._cliente.generate_presigned_url("get_object", Params=params, ExpiresIn=self.expira)
+        with self._lock:
+            if len(self._urls) > 4096:
+                self._urls.clear()
+            self._urls[(chave, nome_download)] = (agora + self.expira / 2, url)
+        return url
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """
+    Backend configurado por variáveis de ambiente (um por processo):
+
+    - ARMAZENAMENTO: 'local' (padrão) ou 's3'
+    - S3_BUCKET, S3_PREFIXO, S3_ENDPOINT_URL (MinIO/compatíveis), S3_REGIAO, S3_URL_EXPIRA (segundos)
+    - S3_URL_PUBLICA: URL base pública do bucket ou da CDN (opcional; URLs estáveis para chaves imutáveis)
+    - S3_INDICE_INTERVALO: segundos entre listagens do bucket (padrão 60)
+    - credenciais pelas variáveis padrão da AWS (AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY)
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if os.environ.get("ARMAZENAMENTO", "local").lower() == "s3":
+                    _backend = ArmazenamentoS3(
+                        os.environ["S3_BUCKET"],
+                        prefixo=os.environ.get("S3_PREFIXO", ""),
+                        endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+                        regiao=os.environ.get("S3_REGIAO"),
+                        expira=os.environ.get("S3_URL_EXPIRA", "900"),
+                        url_publica=os.environ.get("S3_URL_PUBLICA"),
+                        intervalo=os.environ.get("S3_INDICE_INTERVALO", "60"),
+                    )
+                else:
+                    _backend = ArmazenamentoLocal(
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+    return _backend
+
+
+def publicar(caminho_local, chave, se_ausente=False, renovar=False):
+    """
+    Envia ao backend um arquivo já gravado em static/ (no local não faz nada).
+    `se_ausente`: só envia se a chave ainda não existir (objetos por conteúdo, modelos).
+    `renovar`: com `se_ausente`, renova o LastModified do objeto já existente (anexo reaproveitado),
+    para a coleta de órfãos não apagá-lo antes de a linha que aponta para ele ser gravada.
+    """
+    b = backend()
+    if not b.remoto:
+        return
+    if se_ausente and b.existe(chave) and (not renovar or b.renovar(chave)):
+        return
+    b.publicar(caminho_local, chave)
+
+
+def remover(chave):
+    """Remove a cópia do backend remoto (a local é responsabilidade de quem chama)."""
+    b = backend()
+    if b.remoto:
+        b.remover(chave)
+
+
+def existe_remoto(chave, confirmar=False):
+    """
+    True se o backend é remoto e já tem a chave (índice em memória, sem chamada por página).
+    `confirmar`: na falta da chave no índice, consulta o bucket (uma chamada de rede).
+    """
+    b = backend()
+    return b.remoto and b.existe(chave, confirmar=confirmar)
+
+
+def chaves_remotas(prefixo=""):
+    """Chaves do backend remoto que começam com `prefixo` (vazio no backend local)."""
+    b = backend()
+    return b.chaves(prefixo) if b.remoto else []
+
+
+def url(chave, nome_download=None, imutavel=False, versao=None):
+    """
+    URL direta no backend remoto, ou None quando os arquivos são servidos em /static.
+    Só use para chaves que o backend tem (ver `existe_remoto`).
+    """
+    b = backend()
+    if not b.remoto:
+        return None
+    return b.url(chave, nome_download, imutavel=imutavel, versao=versao)
+
+
+def sincronizar(raiz, subpastas=("", "uploads", "uploads/derivados")):
+    """
+    Envia ao backend remoto os arquivos de `raiz` (static/) que ele ainda não tem: anexos e
+    fotos gravados antes de ARMAZENAMENTO=s3, derivados e documentos gerados.
+    Retorna (enviados, já existentes). Temporários e arquivos ocultos (.fp, .sha256) ficam de fora.
+    """
+    b = backend()
+    if not b.remoto:
+        raise RuntimeError("Sincronização requer ARMAZENAMENTO=s3")
+    enviados = existentes = 0
+    for subpasta in subpastas:
+        pasta = os.path.join(raiz, subpasta)
+        try:
+            with os.scandir(pasta) as it:
+                entradas = [e for e in it if e.is_file()]
+        except OSError:
+            continue
+        for entrada in entradas:
+            if entrada.name.startswith(".") or entrada.name.endswith(".tmp"):
+                continue
+            chave = f"{subpasta}/{entrada.name}" if subpasta else entrada.name
+            if b.existe(chave):
+                existentes += 1
+                continue
+            b.publicar(entrada.path, chave)
+            enviados += 1
+    return enviados, existentes
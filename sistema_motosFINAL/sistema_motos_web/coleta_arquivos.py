@@ -0,0 +1,190 @@
+# Coleta de arquivos órfãos em static/ e static/uploads
+#
+# Documentos trocados na edição, motos excluídas e PDFs gerados para motos/vendas que não existem
+# mais deixam arquivos no disco para sempre. A coleta monta o conjunto de referências a partir das
+# colunas de `motos`/`vendas` e dos padrões de nome dos arquivos gerados, informa quantos bytes
+# podem ser liberados e apaga o que não é referenciado há mais que a carência.
+#
+# Em static/ só entram arquivos com nome de documento gerado (o resto são arquivos do site);
+# em static/uploads entra tudo. Com armazenamento remoto (S3) a lista vem do bucket, que é
+# compartilhado por todas as instâncias, e a carência conta a partir do LastModified do objeto;
+# do disco local entram só os arquivos que não estão no bucket (temporários, .fp).
+import os
+import re
+import threading
+import time
+
+import armazenamento
+import database
+
+CARENCIA_HORAS = float(os.environ.get("GC_ARQUIVOS_CARENCIA_HORAS", "24"))
+_LOCK_COLETA = "sistema_motos_coleta_arquivos"
+
+_GERADO_MOTO = re.compile(r"^(?:garantia|procuracao|recibo|exibicao)_moto_(\d+)\.(?:pdf|html)$")
+_GERADO_VENDA = re.compile(r"^recibo_venda_(\d+)\.(?:pdf|html)$")
+_FOTO = re.compile(r"^foto_moto_(\d+)\.[a-z0-9]+$")
+_DERIVADO = re.compile(r"^foto_moto_(\d+)_v(\d+)_[a-z]+\.[a-z0-9]+$")
+
+
+def _status_gerado(nome, motos, vendas):
+    """True/False para nomes de documentos gerados (referenciado ou não); None para outros arquivos."""
+    m = _GERADO_MOTO.match(nome)
+    if m:
+        return int(m.group(1)) in motos
+    m = _GERADO_VENDA.match(nome)
+    if m:
+        return int(m.group(1)) in vendas
+    return None
+
+
+def _classificar_static(nome, existe, motos, vendas):
+    """True se o arquivo da raiz de static/ pode ser apagado (`existe(nome)`: o arquivo ainda existe)."""
+    if nome.endswith(".tmp"):
+        return True
+    if nome.startswith(".") and nome.endswith(".fp"):
+        # Impressão digital do cache de documentos: órfã junto com o documento
+        base = nome[1:-len(".fp")]
+        status = _status_gerado(base, motos, vendas)
+        return status is False or (status and not existe(base))
+    return _status_gerado(nome, motos, vendas) is False
+
+
+def _classificar_upload(nome, fotos, anexos):
+    if nome.startswith(".upload.") and nome.endswith(".tmp"):
+        return True
+    m = _FOTO.match(nome)
+    if m and fotos.get(int(m.group(1)), (None,))[0] == nome:
+        return False
+    return nome not in anexos
+
+
+def _classificar_derivado(nome, fotos):
+    m = _DERIVADO.match(nome)
+    if not m:
+        return True
+    foto = fotos.get(int(m.group(1)))
+    return foto is None or str(foto[1] or 0) != m.group(2)
+
+
+_SUBPASTAS = ("", "uploads", "uploads/derivados")
+
+
+def _arquivos_locais(raiz):
+    """{caminho relativo a static/: (bytes, mtime)} dos arquivos das pastas coletadas."""
+    arquivos = {}
+    for subpasta in _SUBPASTAS:
+        try:
+            with os.scandir(os.path.join(raiz, subpasta)) as it:
+                entradas = [e for e in it if e.is_file()]
+        except OSError:
+            continue
+        for entrada in entradas:
+            info = entrada.stat()
+            rel = f"{subpasta}/{entrada.name}" if subpasta else entrada.name
+            arquivos[rel] = (info.st_size, info.st_mtime)
+    return arquivos
+
+
+def _arquivos_remotos(backend):
+    """Como `_arquivos_locais`, a partir da listagem do bucket (mtime = LastModified)."""
+    return {
+        chave: (tamanho, modificado)
+        for chave, tamanho, modificado in backend.listar_objetos()
+        if os.path.dirname(chave) in _SUBPASTAS
+    }
+
+
+def analisar(raiz=None, carencia_horas=None):
+    """
+    Lista os arquivos não referenciados.
+
+    Retorna um dicionário com `candidatos` [(caminho relativo a static/, bytes)] já fora da
+    carência, `bytes` (total que pode ser liberado) e `em_carencia` (órfãos recentes ainda mantidos).
+    """
+    raiz = raiz or database._STATIC_ABS
+    carencia = (CARENCIA_HORAS if carencia_horas is None else carencia_horas) * 3600
+    limite = time.time() - carencia
+    motos, fotos, vendas, anexos = database.referencias_arquivos()
+    arquivos = _arquivos_locais(raiz)
+    backend = armazenamento.backend()
+    if backend.remoto:
+        # O bucket manda: a cópia local pode faltar (outro nó, disco recriado) ou ter mtime só deste nó
+        arquivos.update(_arquivos_remotos(backend))
+    classificar = {
+        "": lambda nome: _classificar_static(nome, lambda base: base in arquivos, motos, vendas),
+        "uploads": lambda nome: _classificar_upload(nome, fotos, anexos),
+        "uploads/derivados": lambda nome: _classificar_derivado(nome, fotos),
+    }
+    candidatos, em_carencia = [], 0
+    for rel, (tamanho, modificado) in sorted(arquivos.items()):
+        if not classificar[os.path.dirname(rel)](os.path.basename(rel)):
+            continue
+        if modificado > limite:
+            em_carencia += 1
+            continue
+        candidatos.append((rel, tamanho))
+    return {
+        "candidatos": candidatos,
+        "bytes": sum(tamanho for _rel, tamanho in candidatos),
+        "em_carencia": em_carencia,
+    }
+
+
+def coletar(raiz=None, carencia_horas=None, apagar=False, indice=None):
+    """
+    Executa a análise e, com `apagar=True`, remove os candidatos (atualizando o índice de
+    arquivos, se informado). Retorna o relatório de `analisar` com `apagados`/`bytes_liberados`.
+    """
+    raiz = raiz or database._STATIC_ABS
+    relatorio = analisar(raiz, carencia_horas)
+    remoto = armazenamento.backend().remoto
+    apagados, liberados = 0, 0
+    if apagar:
+        for rel, tamanho in relatorio["candidatos"]:
+            try:
+                armazenamento.remover(rel)
+            except Exception as e:
+                print(f"Aviso: não foi possível apagar {rel} do armazenamento remoto: {e}")
+                continue
+            try:
+                os.remove(os.path.join(raiz, rel))
+            except FileNotFoundError as e:
+                # No remoto, o objeto pode existir só no bucket (cópia local em outro nó)
+                if not remoto:
+                    print(f"Aviso: não foi possível apagar {rel}: {e}")
+                    continue
+            except OSError as e:
+                print(f"Aviso: não foi possível apagar {rel}: {e}")
+                continue
+            apagados += 1
+            liberados += tamanho
+            if indice is not None:
+                indice.remover(rel)
+    relatorio.update(apagados=apagados, bytes_liberados=liberados)
+    return relatorio
+
+
+def iniciar_agendamento(intervalo_horas, indice=None):
+    """
+    Roda a coleta (apagando) a cada `intervalo_horas` em uma thread de fundo. Um lock nomeado
+    no MySQL garante que só um processo do gunicorn faz a coleta em cada rodada.
+    """
+    def _rodada():
+        return coletar(apagar=True, indice=indice)
+
+    def _loop():
+        while True:
+            time.sleep(intervalo_horas * 3600)
+            try:
+                executou, relatorio = database.executar_com_lock(_LOCK_COLETA, _rodada)
+                if executou and relatorio["apagados"]:
+                    print(
+                        f"Coleta de arquivos: {relatorio['apagados']} arquivo(s) apagado(s), "
+                        f"{relatorio['bytes_liberados']} bytes liberados."
+                    )
+            except Exception as e:
+                print(f"Aviso: falha na coleta de arquivos órfãos: {e}")
+
+    t = threading.Thread(target=_loop, name="coleta-arquivos", daemon=True)
+    t.start()
+    return t
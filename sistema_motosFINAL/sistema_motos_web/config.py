@@ -9,3 +9,14 @@ MYSQL_CONFIG = {
     'charset': os.environ.get('MYSQL_CHARSET', 'utf8mb4'),
     'autocommit': True,
 }
+
+# Pool de conexões (por processo do gunicorn). Com 4 threads por worker, 4 conexões bastam.
+MYSQL_POOL_CONFIG = {
+    'size': int(os.environ.get('MYSQL_POOL_SIZE', '4')),
+    # Segundos que uma requisição aguarda por uma conexão livre antes de falhar
+    'timeout': float(os.environ.get('MYSQL_POOL_TIMEOUT', '10')),
+    # Conexões ociosas há mais que isso são reabertas (abaixo do wait_timeout do servidor)
+    'recycle': float(os.environ.get('MYSQL_POOL_RECYCLE', '280')),
+    # Conexões ociosas há mais que isso recebem ping no checkout (0 = sempre)
+    'ping_after': float(os.environ.get('MYSQL_POOL_PING_AFTER', '0')),
+}
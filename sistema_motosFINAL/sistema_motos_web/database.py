@@ -1,12 +1,88 @@
+import functools
+import shutil
 import mysql.connector
 import os
+import string
+import threading
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
-from config import MYSQL_CONFIG
+import armazenamento
+from config import MYSQL_CONFIG, MYSQL_POOL_CONFIG
+from db_pool import ConnectionPool, PooledConnection
+try:
+    from flask import g, has_app_context
+except Exception:
+    # Uso fora do Flask (scripts/CLI): sem conexão por requisição
+    g = None
+    def has_app_context():
+        return False
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Cursores bufferizados: resultados não lidos não travam a conexão compartilhada
+                _pool = ConnectionPool(dict(MYSQL_CONFIG, buffered=True), **MYSQL_POOL_CONFIG)
+    return _pool
 
 # Helper function to get database connection
 def get_db_connection():
-    return mysql.connector.connect(**MYSQL_CONFIG)
+    """
+    Retorna uma conexão do pool.
+
+    Dentro de uma requisição Flask a mesma conexão é reaproveitada por todas as chamadas
+    (guardada em `g`) e só volta ao pool no teardown; `conn.close()` nesse caso não faz nada.
+    Fora de requisições, `conn.close()` devolve a conexão ao pool.
+    """
+    if g is not None and has_app_context():
+        conn = g.get("_db_conn")
+        if conn is None:
+            conn = PooledConnection(_get_pool(), _get_pool().acquire(), escopo_requisicao=True)
+            g._db_conn = conn
+        return conn
+    return PooledConnection(_get_pool(), _get_pool().acquire())
+
+def liberar_conexao_requisicao(exc=None):
+    """Devolve ao pool a conexão emprestada para a requisição atual (usar no teardown do app)."""
+    if g is None or not has_app_context():
+        return
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        conn.devolver()
+
+def iterar_consulta(sql, params=(), lote=1000):
+    """
+    Produz as linhas de `sql` sem carregar o resultado inteiro em memória.
+
+    Usa uma conexão própria do pool (não a da requisição) com cursor sem buffer, lendo
+    `lote` linhas por vez do servidor. Se o consumidor parar no meio (ex.: download
+    cancelado), a conexão é descartada em vez de voltar ao pool com resultado pendente.
+    """
+    conn = PooledConnection(_get_pool(), _get_pool().acquire())
+    completo = False
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(sql, params)
+        while True:
+            linhas = cursor.fetchmany(lote)
+            if not linhas:
+                break
+            yield from linhas
+        cursor.close()
+        completo = True
+    finally:
+        if completo:
+            conn.close()
+        else:
+            conn.descartar()
+
+def estatisticas_pool() -> dict:
+    """Contadores do pool deste processo (checkouts, esperas, timeouts, conexões abertas...)."""
+    return _get_pool().stats()
 
 # Helpers de formatação seguros
 def br_moeda_safe(valor):
@@ -24,97 +100,158 @@ def br_km_safe(valor):
         return f"{int(float(valor)):,.0f}".replace(",", ".")
     except Exception:
         return "0"
-def migrar_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    try:
-        # Verificar se a coluna 'email' existe em 'usuarios'
-        cursor.execute("SHOW COLUMNS FROM usuarios LIKE 'email'")
-        if not cursor.fetchone():
-            print("Aplicando migração: Adicionando coluna 'email' à tabela 'usuarios'.")
-            cursor.execute("ALTER TABLE usuarios ADD COLUMN email VARCHAR(255)")
-            conn.commit()
+def normalizar_placa(placa):
+    """Normaliza a placa como o SQL legado: UPPER e sem hífens/espaços (None permanece None).
 
-        # Verificar e adicionar colunas ausentes na tabela 'motos'
-        cursor.execute("SHOW COLUMNS FROM motos")
-        colunas_motos = [col[0] for col in cursor.fetchall()]
-        colunas_necessarias = [
-            ("renavam", "VARCHAR(255)"),
-            ("doc_moto", "VARCHAR(255)"),
-            ("documento_fornecedor", "VARCHAR(255)"),
-            ("comprovante_residencia", "VARCHAR(255)"),
-            ("data_cadastro", "DATE"),
-            ("hora_cadastro", "TIME"),
-            ("nome_cliente", "VARCHAR(255)"),
-            ("cpf_cliente", "VARCHAR(255)"),
-            ("rua_cliente", "TEXT"),
-            ("cep_cliente", "VARCHAR(255)"),
-            ("celular_cliente", "VARCHAR(255)"),
-            ("referencia", "VARCHAR(255)"),
-            ("celular_referencia", "VARCHAR(255)"),
-            ("debitos", "TEXT"),
-            ("observacoes", "TEXT"),
-            ("chassi", "VARCHAR(255)"),
-        ]
-        for nome_coluna, tipo_coluna in colunas_necessarias:
-            if nome_coluna not in colunas_motos:
-                print(f"Aplicando migração: Adicionando coluna '{nome_coluna}' à tabela 'motos'.")
-                cursor.execute(f"ALTER TABLE motos ADD COLUMN {nome_coluna} {tipo_coluna}")
-                conn.commit()
+    Deve produzir o mesmo valor que REPLACE(REPLACE(UPPER(placa), '-', ''), ' ', '') no MySQL,
+    pois é gravado na coluna indexada `motos.placa_norm`.
+    """
+    if placa is None:
+        return None
+    return str(placa).upper().replace("-", "").replace(" ", "")
 
-        # Renomear coluna antiga 'laudo' para 'documento_fornecedor' se existir e a nova não existir
-        if 'laudo' in colunas_motos and 'documento_fornecedor' not in colunas_motos:
-            try:
-                print("Aplicando migração: Renomeando coluna 'laudo' para 'documento_fornecedor' em 'motos'.")
-                cursor.execute("ALTER TABLE motos CHANGE COLUMN laudo documento_fornecedor VARCHAR(255)")
-                conn.commit()
-            except Exception as e:
-                print(f"Falha ao renomear coluna laudo->documento_fornecedor: {e}")
+_FORMATOS_DATA_LEGADOS = (
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y",
+    "%d-%m-%Y", "%Y/%m/%d",
+)
+
+def parse_data_legada(valor):
+    """Converte as datas gravadas como texto (YYYY-MM-DD[ HH:MM], DD/MM/YYYY...) em datetime.
 
-        # Verificar existência da tabela 'vendas' e criar/alterar conforme necessário
+    Retorna None quando o valor é vazio ou não está em nenhum formato conhecido.
+    """
+    import datetime
+    if valor is None:
+        return None
+    if isinstance(valor, datetime.datetime):
+        return valor
+    if isinstance(valor, datetime.date):
+        return datetime.datetime(valor.year, valor.month, valor.day)
+    texto = str(valor).strip()
+    if not texto:
+        return None
+    for fmt in _FORMATOS_DATA_LEGADOS:
         try:
-            cursor.execute("SHOW COLUMNS FROM vendas")
-            colunas_vendas = [col[0] for col in cursor.fetchall()]
-        except Exception:
-            # Tabela não existe, criar com todos os campos
-            cursor.execute("""
-                CREATE TABLE vendas (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    moto_id INT NOT NULL,
-                    vendedor VARCHAR(255) NOT NULL,
-                    data VARCHAR(50) NOT NULL,
-                    preco_final DECIMAL(10,2) NULL,
-                    cnh_path VARCHAR(255) NULL,
-                    garantia_path VARCHAR(255) NULL,
-                    endereco_path VARCHAR(255) NULL,
-                    CONSTRAINT fk_vendas_motos FOREIGN KEY (moto_id) REFERENCES motos(id)
-                )
-            """)
+            return datetime.datetime.strptime(texto, fmt)
+        except ValueError:
+            continue
+    return None
+
+def intervalo_mes(periodo_ym: str):
+    """'YYYY-MM' -> (primeiro dia do mês, primeiro dia do mês seguinte) para filtros por faixa."""
+    import datetime
+    ano, mes = (int(p) for p in periodo_ym.split("-")[:2])
+    inicio = datetime.date(ano, mes, 1)
+    fim = datetime.date(ano + 1, 1, 1) if mes == 12 else datetime.date(ano, mes + 1, 1)
+    return inicio, fim
+
+def _migrar_datas_tipadas(conn, cursor):
+    """Cria colunas DATE/DATETIME indexadas ao lado das datas em texto e preenche a partir delas.
+
+    As colunas de texto continuam sendo gravadas (exibição/edição nas telas); os filtros usam
+    as colunas tipadas, que permitem busca por faixa usando índice.
+    """
+    tabelas = [
+        # (tabela, coluna texto, coluna tipada, tipo, índice)
+        ("vendas", "data", "data_dt", "DATETIME", "idx_vendas_data_dt"),
+        ("receitas", "adicionado_em", "adicionado_em_dt", "DATE", "idx_receitas_adicionado_em_dt"),
+        ("gastos", "retirado_em", "retirado_em_dt", "DATE", "idx_gastos_retirado_em_dt"),
+    ]
+    for tabela, col_txt, col_dt, tipo, indice in tabelas:
+        cursor.execute(f"SHOW COLUMNS FROM {tabela} LIKE '{col_dt}'")
+        if not cursor.fetchone():
+            print(f"Aplicando migração: Adicionando coluna '{col_dt}' à tabela '{tabela}'.")
+            cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {col_dt} {tipo} NULL")
             conn.commit()
-            colunas_vendas = ["id","moto_id","vendedor","data","preco_final","cnh_path","garantia_path","endereco_path"]
-
-        # Adicionar colunas novas em 'vendas' se faltarem
-        for nome_coluna, tipo_coluna in [
-            ("preco_final", "DECIMAL(10,2)"),
-            ("cnh_path", "VARCHAR(255)"),
-            ("garantia_path", "VARCHAR(255)"),
-            ("endereco_path", "VARCHAR(255)")
-        ]:
-            if nome_coluna not in colunas_vendas:
-                print(f"Aplicando migração: Adicionando coluna '{nome_coluna}' à tabela 'vendas'.")
-                cursor.execute(f"ALTER TABLE vendas ADD COLUMN {nome_coluna} {tipo_coluna} NULL")
-                conn.commit()
+        cursor.execute(f"SHOW INDEX FROM {tabela} WHERE Key_name = '{indice}'")
+        if not cursor.fetchall():
+            print(f"Aplicando migração: Criando índice '{indice}' em '{tabela}'.")
+            cursor.execute(f"CREATE INDEX {indice} ON {tabela} ({col_dt})")
+            conn.commit()
+        # Backfill em Python: STR_TO_DATE falha em modo estrito com formatos misturados
+        cursor.execute(
+            f"SELECT id, {col_txt} FROM {tabela} WHERE {col_dt} IS NULL AND {col_txt} IS NOT NULL AND {col_txt} <> ''"
+        )
+        pendentes = []
+        for item_id, texto in cursor.fetchall():
+            dt = parse_data_legada(texto)
+            if dt is not None:
+                pendentes.append((dt if tipo == "DATETIME" else dt.date(), item_id))
+            else:
+                print(f"Aviso: data não reconhecida em {tabela}.{col_txt} (id {item_id}): {texto!r}")
+        if pendentes:
+            print(f"Aplicando migração: preenchendo {tabela}.{col_dt} em {len(pendentes)} registro(s).")
+            cursor.executemany(f"UPDATE {tabela} SET {col_dt} = %s WHERE id = %s", pendentes)
+            conn.commit()
+
+# Busca unificada: índice FULLTEXT com parser ngram (o MySQL mantém o índice a cada INSERT/UPDATE/DELETE)
+INDICE_BUSCA = "ft_motos_busca"
+COLUNAS_BUSCA = "marca, modelo, placa_norm, renavam, chassi, nome_cliente, cpf_cliente"
+_indice_busca_ok = None
+
+def _migrar_indice_busca(conn, cursor):
+    global _indice_busca_ok
+    cursor.execute(f"SHOW INDEX FROM motos WHERE Key_name = '{INDICE_BUSCA}'")
+    if cursor.fetchall():
+        _indice_busca_ok = True
+        return
+    try:
+        print(f"Aplicando migração: Criando índice FULLTEXT '{INDICE_BUSCA}' em 'motos'.")
+        cursor.execute(f"CREATE FULLTEXT INDEX {INDICE_BUSCA} ON motos ({COLUNAS_BUSCA}) WITH PARSER ngram")
+        conn.commit()
+        _indice_busca_ok = True
     except Exception as e:
-        print(f"Erro na migração: {e}")
-    finally:
-        conn.close()
+        # Servidor sem parser ngram: a busca continua funcionando com LIKE
+        print(f"Aviso: índice de busca não criado ({e}); usando busca por LIKE.")
+        _indice_busca_ok = False
+
+def indice_busca_disponivel() -> bool:
+    """Indica se o índice FULLTEXT da busca existe (verificado uma vez por processo)."""
+    global _indice_busca_ok
+    if _indice_busca_ok is None:
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(f"SHOW INDEX FROM motos WHERE Key_name = '{INDICE_BUSCA}'")
+            _indice_busca_ok = bool(cursor.fetchall())
+            conn.close()
+        except Exception:
+            return False
+    return _indice_busca_ok
+
+def termos_busca(q: str) -> list:
+    """
+    Quebra o texto da busca em termos comparáveis aos dados indexados.
 
+    Cada termo é uma tupla de variantes (basta casar uma): só letras/dígitos em maiúsculas
+    (igual a placa_norm), então 'abc-1234' encontra a placa 'ABC 1234'; e, se o termo tem
+    pontuação, também como foi digitado, porque CPF, renavam e chassi são gravados como
+    vieram do formulário ('123.456.789-00'). Termos com menos de 2 caracteres são ignorados
+    (tamanho mínimo do ngram).
+    """
+    import re
+    termos = []
+    for bruto in str(q or "").split():
+        termo = re.sub(r"[^0-9A-Za-zÀ-ÿ]", "", bruto).upper()
+        if len(termo) < 2:
+            continue
+        bruto = bruto.replace('"', "")  # aspas encerrariam a frase da busca booleana
+        termos.append((termo, bruto) if bruto.upper() != termo else (termo,))
+    return termos
+
+def _busca_boolean(termos) -> str:
+    # Todos os termos obrigatórios; cada variante como frase para casar n-gramas consecutivos (substring)
+    return " ".join("+(" + " ".join(f'"{v}"' for v in variantes) + ")" for variantes in termos)
 
 def iniciar_db():
     conn = get_db_connection()
     cursor = conn.cursor()
+    _criar_tabelas_base(conn, cursor)
+    conn.close()
 
+def _criar_tabelas_base(conn, cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS usuarios (
             id INT AUTO_INCREMENT PRIMARY KEY,
@@ -217,7 +354,374 @@ def iniciar_db():
     """)
 
     conn.commit()
-    conn.close()
+
+def _migrar_colunas_legadas(conn, cursor):
+    """Colunas acrescentadas ao longo do tempo em usuarios/motos/vendas (bancos criados por versões antigas)."""
+    # Verificar se a coluna 'email' existe em 'usuarios'
+    cursor.execute("SHOW COLUMNS FROM usuarios LIKE 'email'")
+    if not cursor.fetchone():
+        print("Aplicando migração: Adicionando coluna 'email' à tabela 'usuarios'.")
+        cursor.execute("ALTER TABLE usuarios ADD COLUMN email VARCHAR(255)")
+        conn.commit()
+
+    # Verificar e adicionar colunas ausentes na tabela 'motos'
+    cursor.execute("SHOW COLUMNS FROM motos")
+    colunas_motos = [col[0] for col in cursor.fetchall()]
+    colunas_necessarias = [
+        ("renavam", "VARCHAR(255)"),
+        ("doc_moto", "VARCHAR(255)"),
+        ("documento_fornecedor", "VARCHAR(255)"),
+        ("comprovante_residencia", "VARCHAR(255)"),
+        ("data_cadastro", "DATE"),
+        ("hora_cadastro", "TIME"),
+        ("nome_cliente", "VARCHAR(255)"),
+        ("cpf_cliente", "VARCHAR(255)"),
+        ("rua_cliente", "TEXT"),
+        ("cep_cliente", "VARCHAR(255)"),
+        ("celular_cliente", "VARCHAR(255)"),
+        ("referencia", "VARCHAR(255)"),
+        ("celular_referencia", "VARCHAR(255)"),
+        ("debitos", "TEXT"),
+        ("observacoes", "TEXT"),
+        ("chassi", "VARCHAR(255)"),
+    ]
+    for nome_coluna, tipo_coluna in colunas_necessarias:
+        if nome_coluna not in colunas_motos:
+            print(f"Aplicando migração: Adicionando coluna '{nome_coluna}' à tabela 'motos'.")
+            cursor.execute(f"ALTER TABLE motos ADD COLUMN {nome_coluna} {tipo_coluna}")
+            conn.commit()
+
+    # Renomear coluna antiga 'laudo' para 'documento_fornecedor' se existir e a nova não existir
+    if 'laudo' in colunas_motos and 'documento_fornecedor' not in colunas_motos:
+        try:
+            print("Aplicando migração: Renomeando coluna 'laudo' para 'documento_fornecedor' em 'motos'.")
+            cursor.execute("ALTER TABLE motos CHANGE COLUMN laudo documento_fornecedor VARCHAR(255)")
+            conn.commit()
+        except Exception as e:
+            print(f"Falha ao renomear coluna laudo->documento_fornecedor: {e}")
+
+    # Verificar existência da tabela 'vendas' e criar/alterar conforme necessário
+    try:
+        cursor.execute("SHOW COLUMNS FROM vendas")
+        colunas_vendas = [col[0] for col in cursor.fetchall()]
+    except Exception:
+        # Tabela não existe, criar com todos os campos
+        cursor.execute("""
+            CREATE TABLE vendas (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                moto_id INT NOT NULL,
+                vendedor VARCHAR(255) NOT NULL,
+                data VARCHAR(50) NOT NULL,
+                preco_final DECIMAL(10,2) NULL,
+                cnh_path VARCHAR(255) NULL,
+                garantia_path VARCHAR(255) NULL,
+                endereco_path VARCHAR(255) NULL,
+                CONSTRAINT fk_vendas_motos FOREIGN KEY (moto_id) REFERENCES motos(id)
+            )
+        """)
+        conn.commit()
+        colunas_vendas = ["id","moto_id","vendedor","data","preco_final","cnh_path","garantia_path","endereco_path"]
+
+    # Adicionar colunas novas em 'vendas' se faltarem
+    for nome_coluna, tipo_coluna in [
+        ("preco_final", "DECIMAL(10,2)"),
+        ("cnh_path", "VARCHAR(255)"),
+        ("garantia_path", "VARCHAR(255)"),
+        ("endereco_path", "VARCHAR(255)")
+    ]:
+        if nome_coluna not in colunas_vendas:
+            print(f"Aplicando migração: Adicionando coluna '{nome_coluna}' à tabela 'vendas'.")
+            cursor.execute(f"ALTER TABLE vendas ADD COLUMN {nome_coluna} {tipo_coluna} NULL")
+            conn.commit()
+
+def _migrar_placa_norm(conn, cursor):
+    # Placa normalizada (mantida na escrita) + índice composto para deduplicação/unicidade
+    cursor.execute("SHOW COLUMNS FROM motos LIKE 'placa_norm'")
+    if not cursor.fetchone():
+        print("Aplicando migração: Adicionando coluna 'placa_norm' à tabela 'motos'.")
+        cursor.execute("ALTER TABLE motos ADD COLUMN placa_norm VARCHAR(255) NULL")
+        conn.commit()
+    # Backfill: linhas antigas (ou gravadas por versões anteriores) sem placa_norm
+    cursor.execute(
+        """
+        UPDATE motos SET placa_norm = REPLACE(REPLACE(UPPER(placa), '-', ''), ' ', '')
+        WHERE placa IS NOT NULL AND placa_norm IS NULL
+        """
+    )
+    if cursor.rowcount:
+        print(f"Aplicando migração: placa_norm preenchida em {cursor.rowcount} moto(s).")
+    conn.commit()
+    cursor.execute("SHOW INDEX FROM motos WHERE Key_name = 'idx_motos_placa_norm_status'")
+    if not cursor.fetchall():
+        print("Aplicando migração: Criando índice (placa_norm, status, id) em 'motos'.")
+        cursor.execute("CREATE INDEX idx_motos_placa_norm_status ON motos (placa_norm, status, id)")
+        conn.commit()
+
+def _migrar_ultima_venda(conn, cursor):
+    # Ponteiro para a venda mais recente de cada moto (evita MAX(id) ... GROUP BY nas listagens)
+    cursor.execute("SHOW COLUMNS FROM motos LIKE 'ultima_venda_id'")
+    if not cursor.fetchone():
+        print("Aplicando migração: Adicionando coluna 'ultima_venda_id' à tabela 'motos'.")
+        cursor.execute("ALTER TABLE motos ADD COLUMN ultima_venda_id INT NULL")
+        conn.commit()
+    cursor.execute(
+        """
+        UPDATE motos m
+        JOIN (SELECT moto_id, MAX(id) AS max_id FROM vendas GROUP BY moto_id) ult ON ult.moto_id = m.id
+        SET m.ultima_venda_id = ult.max_id
+        WHERE m.ultima_venda_id IS NULL OR m.ultima_venda_id <> ult.max_id
+        """
+    )
+    if cursor.rowcount:
+        print(f"Aplicando migração: ultima_venda_id ajustado em {cursor.rowcount} moto(s).")
+    conn.commit()
+
+def _migrar_documentos_jobs(conn, cursor):
+    # Fila de geração de documentos em segundo plano (ver doc_jobs.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documentos_jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            tipo VARCHAR(50) NOT NULL,
+            moto_id INT NOT NULL,
+            venda_id INT NULL,
+            status VARCHAR(20) NOT NULL,
+            tentativas INT NOT NULL DEFAULT 0,
+            arquivo VARCHAR(255) NULL,
+            erro TEXT NULL,
+            criado_em DATETIME NOT NULL,
+            atualizado_em DATETIME NOT NULL,
+            INDEX idx_documentos_jobs_status (status, id)
+        )
+    """)
+    conn.commit()
+
+FOTO_EXTENSOES = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+def _migrar_foto_moto(conn, cursor):
+    # Nome do arquivo da foto (em static/uploads) + versão para o sufixo ?v= das URLs
+    cursor.execute("SHOW COLUMNS FROM motos LIKE 'foto'")
+    if not cursor.fetchone():
+        print("Aplicando migração: Adicionando colunas 'foto' e 'foto_versao' à tabela 'motos'.")
+        cursor.execute("ALTER TABLE motos ADD COLUMN foto VARCHAR(255) NULL")
+        cursor.execute("ALTER TABLE motos ADD COLUMN foto_versao INT NOT NULL DEFAULT 0")
+        conn.commit()
+    # Backfill: fotos gravadas como foto_moto_{id}{ext} antes da coluna existir.
+    # Com mais de uma extensão para a mesma moto vale a gravada por último.
+    fotos = {}
+    pasta = os.path.join(_STATIC_ABS, "uploads")
+    try:
+        with os.scandir(pasta) as it:
+            for entrada in it:
+                nome, ext = os.path.splitext(entrada.name)
+                if not entrada.is_file() or not nome.startswith("foto_moto_") or ext.lower() not in FOTO_EXTENSOES:
+                    continue
+                try:
+                    moto_id = int(nome[len("foto_moto_"):])
+                except ValueError:
+                    continue
+                mtime = entrada.stat().st_mtime
+                if moto_id not in fotos or mtime > fotos[moto_id][1]:
+                    fotos[moto_id] = (entrada.name, mtime)
+    except OSError as e:
+        print(f"Aviso: não foi possível listar {pasta} para o backfill das fotos: {e}")
+    if fotos:
+        cursor.executemany(
+            "UPDATE motos SET foto = %s, foto_versao = 1 WHERE id = %s AND foto IS NULL",
+            [(nome, moto_id) for moto_id, (nome, _mtime) in fotos.items()],
+        )
+        print(f"Aplicando migração: foto registrada em {cursor.rowcount} moto(s).")
+        conn.commit()
+
+def _migrar_uploads_otimizados(conn, cursor):
+    # Tamanhos antes/depois da otimização dos documentos digitalizados (ver digitalizacao.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS uploads_otimizados (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            arquivo VARCHAR(255) NOT NULL,
+            campo VARCHAR(100) NULL,
+            tamanho_original BIGINT NOT NULL,
+            tamanho_final BIGINT NOT NULL,
+            criado_em DATETIME NOT NULL
+        )
+    """)
+    conn.commit()
+
+# Colunas que guardam nomes de anexos em static/uploads
+COLUNAS_ANEXOS = (
+    ("motos", "doc_moto"),
+    ("motos", "documento_fornecedor"),
+    ("motos", "comprovante_residencia"),
+    ("vendas", "cnh_path"),
+    ("vendas", "garantia_path"),
+    ("vendas", "endereco_path"),
+)
+
+def _migrar_uploads_por_conteudo(conn, cursor):
+    # Anexos antigos (nomes com UUID/timestamp) passam a {sha256}{ext}; cópias idênticas viram um objeto só.
+    # Primeiro cria os objetos (link/cópia), depois atualiza as colunas e só então apaga os originais,
+    # então uma interrupção no meio nunca deixa uma linha apontando para arquivo inexistente.
+    pasta = os.path.join(_STATIC_ABS, "uploads")
+    objetos = {}  # nome antigo -> nome por conteúdo
+    atualizacoes = []
+    for tabela, coluna in COLUNAS_ANEXOS:
+        cursor.execute(f"SELECT id, {coluna} FROM {tabela} WHERE {coluna} IS NOT NULL AND {coluna} <> ''")
+        for row_id, valor in cursor.fetchall():
+            antigo = os.path.basename(str(valor).replace("\\", "/"))
+            if armazenamento.eh_objeto(antigo):
+                continue
+            if antigo not in objetos:
+                origem = os.path.join(pasta, antigo)
+                if not os.path.isfile(origem):
+                    continue
+                novo = armazenamento.nome_objeto(armazenamento.hash_arquivo(origem), os.path.splitext(antigo)[1])
+                destino = os.path.join(pasta, novo)
+                if not os.path.exists(destino):
+                    try:
+                        os.link(origem, destino)
+                    except OSError:
+                        shutil.copy2(origem, destino)
+                objetos[antigo] = novo
+            atualizacoes.append((tabela, coluna, objetos[antigo], row_id))
+    for tabela, coluna, novo, row_id in atualizacoes:
+        cursor.execute(f"UPDATE {tabela} SET {coluna} = %s WHERE id = %s", (novo, row_id))
+    conn.commit()
+    for antigo in objetos:
+        try:
+            os.remove(os.path.join(pasta, antigo))
+        except OSError as e:
+            print(f"Aviso: não foi possível remover {antigo}: {e}")
+    if atualizacoes:
+        print(
+            f"Aplicando migração: {len(atualizacoes)} referência(s) em {len(objetos)} arquivo(s) "
+            f"apontam para {len(set(objetos.values()))} objeto(s) por conteúdo."
+        )
+
+# Tabelas com contador de alterações (cache das exportações e dos indicadores: exportacao.py, kpis.py)
+TABELAS_VERSIONADAS = ("motos", "vendas", "receitas", "gastos")
+
+def _migrar_versoes_tabelas(conn, cursor):
+    # Um contador por tabela, incrementado na mesma transação de cada escrita
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS versoes_tabelas (
+            tabela VARCHAR(64) PRIMARY KEY,
+            versao BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.executemany(
+        "INSERT IGNORE INTO versoes_tabelas (tabela, versao) VALUES (%s, 0)",
+        [(tabela,) for tabela in TABELAS_VERSIONADAS],
+    )
+    conn.commit()
+
+def _migrar_alteracoes(conn, cursor):
+    # Log só de inserção das escritas em motos/vendas (feed /api/changes e exportação incremental)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alteracoes (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            tabela VARCHAR(64) NOT NULL,
+            registro_id INT NOT NULL,
+            operacao VARCHAR(10) NOT NULL,
+            criado_em DATETIME NOT NULL,
+            INDEX idx_alteracoes_tabela (tabela, id)
+        )
+    """)
+    conn.commit()
+
+def _migrar_dados_padrao(conn, cursor):
+    # Usuários admin/vendedor (só em banco vazio) e categorias financeiras padrão
+    ensure_usuarios_basicos()
+    inicializar_categorias_padrao()
+
+# Migrações versionadas: (versão, descrição, função(conn, cursor)).
+# Sempre acrescentar no final com a próxima versão; cada passo deve ser idempotente
+# (bancos antigos, sem schema_version, passam por todos uma única vez).
+MIGRACOES = (
+    (1, "tabelas base", _criar_tabelas_base),
+    (2, "colunas legadas em usuarios/motos/vendas", _migrar_colunas_legadas),
+    (3, "placa normalizada e índice de deduplicação", _migrar_placa_norm),
+    (4, "datas tipadas e indexadas", _migrar_datas_tipadas),
+    (5, "ponteiro para a última venda", _migrar_ultima_venda),
+    (6, "índice FULLTEXT da busca", _migrar_indice_busca),
+    (7, "usuários e categorias padrão", _migrar_dados_padrao),
+    (8, "fila de geração de documentos", _migrar_documentos_jobs),
+    (9, "foto da moto registrada no banco", _migrar_foto_moto),
+    (10, "tamanhos dos documentos otimizados", _migrar_uploads_otimizados),
+    (11, "anexos armazenados por conteúdo (sha256)", _migrar_uploads_por_conteudo),
+    (12, "contador de alterações por tabela", _migrar_versoes_tabelas),
+    (13, "log de alterações de motos e vendas", _migrar_alteracoes),
+    (14, "contador de alterações de receitas e gastos", _migrar_versoes_tabelas),
+)
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+_LOCK_MIGRACOES = "sistema_motos_migracoes"
+
+def versao_esquema_atual() -> int:
+    """Maior versão registrada em schema_version (0 se a tabela ainda não existe). Uma única consulta."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(versao) FROM schema_version")
+        row = cursor.fetchone()
+        return int(row[0] or 0) if row else 0
+    except mysql.connector.Error:
+        return 0
+    finally:
+        conn.close()
+
+def aplicar_migracoes() -> int:
+    """
+    Aplica, em ordem, as migrações ainda não registradas em schema_version e retorna a versão final.
+
+    Deve rodar uma vez por deploy (`flask --app app migrar` ou o hook `on_starting` do gunicorn).
+    Um lock nomeado do MySQL impede que dois processos migrem ao mesmo tempo; quem chega
+    depois só encontra as versões já registradas. Em caso de erro a versão que falhou não é
+    registrada e a exceção é propagada.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 120)", (_LOCK_MIGRACOES,))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Não foi possível obter o lock de migrações (outro processo migrando?)")
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    versao INT PRIMARY KEY,
+                    descricao VARCHAR(255) NOT NULL,
+                    aplicada_em DATETIME NOT NULL
+                )
+            """)
+            cursor.execute("SELECT versao FROM schema_version")
+            aplicadas = {row[0] for row in cursor.fetchall()}
+            for versao, descricao, passo in MIGRACOES:
+                if versao in aplicadas:
+                    continue
+                print(f"Migração {versao}: {descricao}")
+                passo(conn, cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (%s, %s, NOW())",
+                    (versao, descricao),
+                )
+                conn.commit()
+                aplicadas.add(versao)
+            return max(aplicadas) if aplicadas else 0
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_MIGRACOES,))
+            cursor.fetchone()
+    finally:
+        conn.close()
+
+def migrar_db():
+    """Compatibilidade: aplica as migrações pendentes sem interromper quem chama."""
+    try:
+        return aplicar_migracoes()
+    except Exception as e:
+        print(f"Erro na migração: {e}")
+
+def fechar_pool():
+    """Fecha as conexões ociosas do pool (ex.: no master do gunicorn antes do fork dos workers)."""
+    if _pool is not None:
+        _pool.close_all()
+
 
 # Autenticação
 def verificar_login(nome, senha):
@@ -255,6 +759,12 @@ def excluir_usuario(usuario_id):
         conn.close()
         return False
 
+def _ultima_venda_id(cursor, moto_id):
+    """ID da venda mais recente da moto, lido do ponteiro motos.ultima_venda_id (busca por PK)."""
+    cursor.execute("SELECT ultima_venda_id FROM motos WHERE id = %s", (moto_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
 def atualizar_preco_venda_ultima(moto_id: int, preco_final: float) -> bool:
     """Atualiza o campo 'preco_final' da venda mais recente para a moto.
     Retorna True se atualizou, False se não encontrou venda.
@@ -262,18 +772,21 @@ def atualizar_preco_venda_ultima(moto_id: int, preco_final: float) -> bool:
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM vendas WHERE moto_id = %s ORDER BY id DESC LIMIT 1", (moto_id,))
-        row = cursor.fetchone()
-        if not row:
+        conn.start_transaction()
+        venda_id = _ultima_venda_id(cursor, moto_id)
+        if not venda_id:
+            conn.rollback()
             conn.close()
             return False
-        venda_id = row[0]
         cursor.execute("UPDATE vendas SET preco_final = %s WHERE id = %s", (preco_final, venda_id))
+        _registrar_alteracao(cursor, ("vendas", venda_id, "update"))
         conn.commit()
         conn.close()
+        invalidar_documentos_moto(moto_id)
         return True
     except Exception:
         try:
+            conn.rollback()
             conn.close()
         except Exception:
             pass
@@ -283,15 +796,21 @@ def atualizar_garantia_venda(moto_id: int, garantia_path: str) -> bool:
     """Atualiza o campo garantia_path da venda mais recente (maior id) para a moto informada."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    # Encontrar a última venda desta moto
-    cursor.execute("SELECT id FROM vendas WHERE moto_id = %s ORDER BY id DESC LIMIT 1", (moto_id,))
-    row = cursor.fetchone()
-    if not row:
+    conn.start_transaction()
+    try:
+        # Encontrar a última venda desta moto
+        venda_id = _ultima_venda_id(cursor, moto_id)
+        if not venda_id:
+            conn.rollback()
+            conn.close()
+            return False
+        cursor.execute("UPDATE vendas SET garantia_path = %s WHERE id = %s", (garantia_path, venda_id))
+        _registrar_alteracao(cursor, ("vendas", venda_id, "update"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
         conn.close()
-        return False
-    venda_id = row[0]
-    cursor.execute("UPDATE vendas SET garantia_path = %s WHERE id = %s", (garantia_path, venda_id))
-    conn.commit()
+        raise
     conn.close()
     return True
     cursor.execute("DELETE FROM usuarios WHERE id = %s", (usuario_id,))
@@ -355,6 +874,269 @@ def ensure_usuarios_basicos():
     finally:
         conn.close()
 
+# Cache de documentos: cada PDF gerado em static/ tem ao lado um `.NOME.pdf.fp` com o fingerprint
+# dos dados usados na geração; enquanto os dados não mudam, o PDF existente é reaproveitado.
+DOCUMENTOS_VERSAO = 1  # incrementar ao mudar o layout de garantia/procuração/recibos
+_STATIC_ABS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Recibos são gerados em memória; "1" mantém também uma cópia em static/ no cache de documentos
+PERSISTIR_RECIBOS = os.environ.get("PERSISTIR_RECIBOS", "0") == "1"
+
+def _fingerprint_documento(tipo, *dados) -> str:
+    import hashlib
+    import json
+    bruto = json.dumps([DOCUMENTOS_VERSAO, tipo, dados], default=str, ensure_ascii=False)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+def _caminho_fingerprint(caminho):
+    pasta, nome = os.path.split(caminho)
+    return os.path.join(pasta, f".{nome}.fp")
+
+def fingerprint_documento(caminho):
+    """Fingerprint gravado para o PDF (usado como ETag nos downloads); None se não houver."""
+    try:
+        with open(_caminho_fingerprint(caminho), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def _documento_em_cache(caminho, fp) -> bool:
+    return fingerprint_documento(caminho) == fp and os.path.exists(caminho)
+
+def _caminho_temporario(caminho):
+    return f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def _publicar_documento(tmp, caminho, fp):
+    # Troca atômica: quem está baixando o PDF antigo nunca lê um arquivo pela metade
+    os.replace(tmp, caminho)
+    # Backend remoto (S3): a cópia servida aos usuários sobe antes do fingerprint ser gravado
+    armazenamento.publicar(caminho, os.path.relpath(caminho, _STATIC_ABS).replace(os.sep, "/"))
+    tmp_fp = _caminho_temporario(_caminho_fingerprint(caminho))
+    with open(tmp_fp, "w", encoding="utf-8") as f:
+        f.write(fp)
+    os.replace(tmp_fp, _caminho_fingerprint(caminho))
+
+def invalidar_documentos_moto(moto_id):
+    """
+    Descarta o cache de garantia/procuração/recibos da moto e das suas vendas.
+
+    Só os fingerprints são removidos (os PDFs continuam acessíveis pelos links já exibidos);
+    o próximo download gera o documento de novo.
+    """
+    nomes = [f"garantia_moto_{moto_id}.pdf", f"procuracao_moto_{moto_id}.pdf", f"recibo_moto_{moto_id}.pdf"]
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM vendas WHERE moto_id = %s", (moto_id,))
+        vendas = cursor.fetchall()
+        conn.close()
+        nomes += [f"recibo_venda_{v[0]}.pdf" for v in vendas]
+    except Exception as e:
+        print(f"Aviso: não foi possível listar vendas da moto {moto_id} para invalidar documentos: {e}")
+    for nome in nomes:
+        try:
+            os.remove(_caminho_fingerprint(os.path.join(_STATIC_ABS, nome)))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Aviso: falha ao invalidar documento {nome}: {e}")
+
+# Jobs de geração de documentos em segundo plano
+def criar_job_documento(tipo, moto_id, venda_id=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO documentos_jobs (tipo, moto_id, venda_id, status, criado_em, atualizado_em)
+        VALUES (%s, %s, %s, 'pendente', NOW(), NOW())
+        """,
+        (tipo, moto_id, venda_id)
+    )
+    conn.commit()
+    job_id = cursor.lastrowid
+    conn.close()
+    return job_id
+
+def atualizar_job_documento(job_id, status, tentativas=None, arquivo=None, erro=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE documentos_jobs
+            SET status = %s, tentativas = COALESCE(%s, tentativas), arquivo = COALESCE(%s, arquivo),
+                erro = %s, atualizado_em = NOW()
+            WHERE id = %s
+            """,
+            (status, tentativas, arquivo, erro, job_id)
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"Aviso: falha ao atualizar job de documento {job_id}: {e}")
+    finally:
+        conn.close()
+
+def reivindicar_jobs_documentos_parados(segundos):
+    """
+    Jobs 'pendente' sem atualização há mais de `segundos` (o processo que os agendou parou ou
+    reiniciou). O `atualizado_em` de cada um é renovado antes de retornar, então outra
+    verificação concorrente não pega o mesmo job.
+    Retorna [(id, tipo, moto_id, venda_id, tentativas), ...].
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, tipo, moto_id, venda_id, tentativas FROM documentos_jobs
+        WHERE status = 'pendente' AND atualizado_em < NOW() - INTERVAL %s SECOND
+        ORDER BY id
+        """,
+        (int(segundos),)
+    )
+    jobs = []
+    for job in cursor.fetchall():
+        cursor.execute(
+            """
+            UPDATE documentos_jobs SET atualizado_em = NOW()
+            WHERE id = %s AND status = 'pendente' AND atualizado_em < NOW() - INTERVAL %s SECOND
+            """,
+            (job[0], int(segundos))
+        )
+        if cursor.rowcount:
+            jobs.append(job)
+    conn.commit()
+    conn.close()
+    return jobs
+
+def buscar_job_documento(job_id):
+    """(id, tipo, moto_id, venda_id, status, tentativas, arquivo, erro, criado_em, atualizado_em) ou None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, tipo, moto_id, venda_id, status, tentativas, arquivo, erro, criado_em, atualizado_em
+        FROM documentos_jobs WHERE id = %s
+        """,
+        (job_id,)
+    )
+    job = cursor.fetchone()
+    conn.close()
+    return job
+
+def listar_jobs_documentos(limite=100):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, tipo, moto_id, venda_id, status, tentativas, arquivo, erro, criado_em, atualizado_em
+        FROM documentos_jobs ORDER BY id DESC LIMIT %s
+        """,
+        (int(limite),)
+    )
+    jobs = cursor.fetchall()
+    conn.close()
+    return jobs
+
+def registrar_upload_otimizado(arquivo, campo, tamanho_original, tamanho_final):
+    """Guarda os tamanhos original/gravado de um documento otimizado (falhas só geram aviso)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO uploads_otimizados (arquivo, campo, tamanho_original, tamanho_final, criado_em)
+            VALUES (%s, %s, %s, %s, NOW())
+            """,
+            (arquivo, campo, int(tamanho_original), int(tamanho_final))
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"Aviso: falha ao registrar tamanhos do upload {arquivo}: {e}")
+    finally:
+        conn.close()
+
+def resumo_uploads_otimizados(limite=50):
+    """Totais (quantidade, bytes originais, bytes gravados) e os últimos `limite` registros."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(tamanho_original), 0), COALESCE(SUM(tamanho_final), 0) FROM uploads_otimizados")
+    totais = cursor.fetchone()
+    cursor.execute(
+        """
+        SELECT arquivo, campo, tamanho_original, tamanho_final, criado_em
+        FROM uploads_otimizados ORDER BY id DESC LIMIT %s
+        """,
+        (int(limite),)
+    )
+    recentes = cursor.fetchall()
+    conn.close()
+    return totais, recentes
+
+# Textos fixos de garantia/procuração: quebrados em linhas uma vez por processo (_quebrar_linhas
+# memoriza o resultado); por documento só os blocos de veículo/comprador são medidos.
+@functools.lru_cache(maxsize=512)
+def _quebrar_linhas(texto, largura_max, fonte="Helvetica", tamanho=12):
+    """
+    Quebra `texto` em linhas de no máximo `largura_max` pontos.
+
+    Mede cada palavra uma vez e soma as larguras (as fontes padrão do PDF não têm kerning),
+    em vez de medir o prefixo inteiro a cada palavra.
+    """
+    from reportlab.pdfbase import pdfmetrics
+    espaco = pdfmetrics.stringWidth(" ", fonte, tamanho)
+    linhas, atual, largura_atual = [], "", 0.0
+    for p in str(texto).split():
+        w = pdfmetrics.stringWidth(p, fonte, tamanho)
+        if atual and largura_atual + espaco + w <= largura_max:
+            atual += " " + p
+            largura_atual += espaco + w
+        else:
+            if atual:
+                linhas.append(atual)
+            atual, largura_atual = p, w
+    if atual:
+        linhas.append(atual)
+    return tuple(linhas)
+
+_GARANTIA_PARAGRAFOS = (
+    "Declaramos que o veículo abaixo descrito foi vistoriado em nossa Oficina ou oficina terceirizada e encontra-se em condições normais de uso, dirigibilidade e segurança. Quando o veículo estiver na garantia do fabricante este deverá acompanhá-lo diretamente ao concessionário autorizado ou, se preferir por nosso intermédio, concedemos ao comprador do veículo usado garantia que terá início na data da entrega do veículo e término após decorrido 03 (três) meses ou aos 3.000 km (3 mil quilômetros) percorridos, prevalecendo o que ocorrer primeiro.",
+    "1- Garantia de Motor e Câmbio: a) A nossa obrigação, nos termos desta garantia, é recondicionarmos os conjuntos de motor e câmbio, caso apresentem problemas; b) Os reparos objeto da garantia serão efetuados sem qualquer despesa para o comprador, desde que os serviços sejam feitos por esta empresa ou por ela autorizados quando houver necessidade de serem executados por terceiros; c) Este certificado deve ser apresentado nos casos de solicitação de reparos, dentro do prazo de garantia;",
+    "2- A Garantia será automaticamente cancelada nos casos abaixo: a) Se o veículo for reparado por terceiros não autorizados por nós ou, caso haja tal autorização, os serviços não tenham sido aprovados por esta; b) Se as peças e componentes originais do veículo forem substituídas em oficina não autorizada pela vendedora; c) Se o veículo for submetido a abuso, sobrecarga, competições de qualquer natureza, uso inadequado, manutenção negligente (falta de manutenção preventiva); d) Se o veículo tiver, direta ou indiretamente, sofrido acidente que comprometa o defeito reclamado; e) Se o defeito reclamado for decorrente de mau uso (inclusive utilização de combustível inadequado); f) Se a troca de óleo e filtro não tiver sido efetuada de acordo com a recomendação do fabricante;",
+    "3- Ficam excluídos desta garantia os itens abaixo relacionados: a) Os serviços de manutenção preventiva, regulagem de motor e faróis ou outros, tais como limpeza de bicos injetores, reaperto, alinhamento e balanceamento, etc.; b) Lâmpadas; c) Sistema de embreagem (disco, colar, platô); d) Sistema de freios (pastilhas, discos, lonas, cilindro mestre e reparos); e) Suspensão e seus respectivos componentes; f) Sistema de alimentação de combustível; g) Sistema elétrico; h) Alarmes originais e instalados; i) Sistema de som; j) Pneus, velas, filtros, correias e demais peças de reposição periódica; k) O comprador deverá efetuar as revisões periodicamente em intervalos a cada 10.000 km ou de acordo com manual do proprietário emitido pelo fabricante; l) O presente não cobre a prestação de serviços de guincho e similares; m) A garantia diz respeito ao veículo identificado abaixo e é válida somente quando assinada por representantes legais da loja.",
+    "CONDIÇÕES GERAIS: O adquirente identificado declara, para fins de direito, em caráter irrevogável e irretratável, estar ciente e de acordo com o conteúdo deste documento; após testar o veículo abaixo descrito, comprova que o mesmo se encontra em perfeito estado de conservação e desempenho.",
+    "MODIFICAÇÕES NA ELÉTRICA: A garantia do veículo será inválida caso sejam realizadas instalações de rastreadores ou alarmes, quaisquer outros tipos de dispositivos eletrônicos que não tenham autorização prévia da concessionária. Qualquer modificação não autorizada que comprometa o funcionamento original do veículo poderá resultar na perda da garantia.",
+)
+_GARANTIA_RODAPE = (
+    "E, por estarem assim justas e contratadas, as partes assinam e rubricam o presente contrato, "
+    "em duas vias de igual teor, para que produza seus regulares efeitos de direito."
+)
+_PROCURACAO_OUTORGADO = (
+    "Nomeia e constitui-se bastante procurado HENRIQUE NASCIMENTO BITENCOURT",
+    "CPF 396.894.918-81  Residente RODOVIA SALVADOR DE LEONE 2030"
+    "CEP 06853-000",
+    "a quem concedo os mais amplos, gerais e iluminados poderes a fim",
+    "de que possa defender os direitos e interesses do (a) OUTORGANTE perante as",
+    "repartições públicas em geral. Federais, Estaduais, Municipais, Autarquias,",
+    "Oficiais de Registro Civil ou tabelionatos de notas, SPTrans, despachante,",
+    "companhias de seguro, notadamente repartições de transito em geral, DETRAN/",
+    "CONTRAN/ CIRETRAN/ DENATRAN, DTP e demais órgãos autorizados de",
+    "transito em qualquer cidade do território nacional, podendo solicitar 2º via de",
+    "CRV e CRLV , assinar /endossar transferências ( DUT – Documento único de",
+    "transferência ) , autorizar e acompanhar vistorias, efetuar pagamentos, receber",
+    "pagamentos, receber os valores referente a venda do veículo seja a vista ou",
+    "financiada, formular requerimentos, interpor recursos, reclamar, desistir,",
+    "solicitar, cópias de processos, firmar declaração de venda , além de ter acesso a",
+    "documentos de qualquer natureza, referente exclusivamente ao VEICULO",
+    "descrito abaixo.",
+)
+_PROCURACAO_CLAUSULAS = (
+    "Declaro que qualquer débito existente antes da venda, como multas, são de",
+    "minha inteira responsabilidade.",
+    "Caso venha cair débitos e eu não regularize os mesmos, autorizo expressamente",
+    "que meu nome seja negativado em órgãos de proteção ao crédito (SPC,",
+    "SERASA, etc.), conforme já acordado neste documento.",
+)
+_PROCURACAO_OBS = "Nos termos da Portaria Detran/SP nº 1680, cap II, art 8, Parágrafo VI."
+
 def gerar_pdf_garantia(moto_id, venda_id=None):
     """
     Gera o PDF de garantia preenchido para a moto informada, salvando em static/garantia_moto_{moto_id}.pdf
@@ -363,7 +1145,6 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
     import datetime
     from reportlab.lib.pagesizes import A4
     from reportlab.pdfgen import canvas
-    from reportlab.pdfbase import pdfmetrics
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT marca, modelo, ano, cor, placa, renavam, km, nome_cliente, cpf_cliente, rua_cliente, cep_cliente, data_cadastro FROM motos WHERE id = %s", (moto_id,))
@@ -375,7 +1156,10 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
         r = cursor.fetchone()
         data_venda_str = r[0] if r else None
     else:
-        cursor.execute("SELECT data FROM vendas WHERE moto_id = %s ORDER BY id DESC LIMIT 1", (moto_id,))
+        cursor.execute(
+            "SELECT v.data FROM motos m JOIN vendas v ON v.id = m.ultima_venda_id WHERE m.id = %s",
+            (moto_id,)
+        )
         r = cursor.fetchone()
         data_venda_str = r[0] if r else None
     conn.close()
@@ -395,6 +1179,9 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
     static_abs = os.path.join(base_dir, "static")
     os.makedirs(static_abs, exist_ok=True)
     nome_arquivo = os.path.join(static_abs, f"garantia_moto_{moto_id}.pdf")
+    fp = _fingerprint_documento("garantia", row, data_venda_str or datetime.date.today())
+    if _documento_em_cache(nome_arquivo, fp):
+        return nome_arquivo
     # Helpers
     def mes_extenso_pt(m):
         meses = [
@@ -417,23 +1204,8 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
                 continue
         return None
 
-    def wrap_text(texto, max_width, font_name="Helvetica", font_size=12):
-        palavras = texto.split()
-        linhas, atual = [], ""
-        for p in palavras:
-            teste = (atual + (" " if atual else "") + p)
-            w = pdfmetrics.stringWidth(teste, font_name, font_size)
-            if w <= max_width:
-                atual = teste
-            else:
-                if atual:
-                    linhas.append(atual)
-                atual = p
-        if atual:
-            linhas.append(atual)
-        return linhas
-
-    c = canvas.Canvas(nome_arquivo, pagesize=A4)
+    tmp = _caminho_temporario(nome_arquivo)
+    c = canvas.Canvas(tmp, pagesize=A4)
     largura, altura = A4
     margem_esq = 50
     margem_dir = 50
@@ -449,17 +1221,9 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
     y -= 24
 
     c.setFont("Helvetica", 11)
-    paragrafos = [
-        "Declaramos que o veículo abaixo descrito foi vistoriado em nossa Oficina ou oficina terceirizada e encontra-se em condições normais de uso, dirigibilidade e segurança. Quando o veículo estiver na garantia do fabricante este deverá acompanhá-lo diretamente ao concessionário autorizado ou, se preferir por nosso intermédio, concedemos ao comprador do veículo usado garantia que terá início na data da entrega do veículo e término após decorrido 03 (três) meses ou aos 3.000 km (3 mil quilômetros) percorridos, prevalecendo o que ocorrer primeiro.",
-        "1- Garantia de Motor e Câmbio: a) A nossa obrigação, nos termos desta garantia, é recondicionarmos os conjuntos de motor e câmbio, caso apresentem problemas; b) Os reparos objeto da garantia serão efetuados sem qualquer despesa para o comprador, desde que os serviços sejam feitos por esta empresa ou por ela autorizados quando houver necessidade de serem executados por terceiros; c) Este certificado deve ser apresentado nos casos de solicitação de reparos, dentro do prazo de garantia;",
-        "2- A Garantia será automaticamente cancelada nos casos abaixo: a) Se o veículo for reparado por terceiros não autorizados por nós ou, caso haja tal autorização, os serviços não tenham sido aprovados por esta; b) Se as peças e componentes originais do veículo forem substituídas em oficina não autorizada pela vendedora; c) Se o veículo for submetido a abuso, sobrecarga, competições de qualquer natureza, uso inadequado, manutenção negligente (falta de manutenção preventiva); d) Se o veículo tiver, direta ou indiretamente, sofrido acidente que comprometa o defeito reclamado; e) Se o defeito reclamado for decorrente de mau uso (inclusive utilização de combustível inadequado); f) Se a troca de óleo e filtro não tiver sido efetuada de acordo com a recomendação do fabricante;",
-        "3- Ficam excluídos desta garantia os itens abaixo relacionados: a) Os serviços de manutenção preventiva, regulagem de motor e faróis ou outros, tais como limpeza de bicos injetores, reaperto, alinhamento e balanceamento, etc.; b) Lâmpadas; c) Sistema de embreagem (disco, colar, platô); d) Sistema de freios (pastilhas, discos, lonas, cilindro mestre e reparos); e) Suspensão e seus respectivos componentes; f) Sistema de alimentação de combustível; g) Sistema elétrico; h) Alarmes originais e instalados; i) Sistema de som; j) Pneus, velas, filtros, correias e demais peças de reposição periódica; k) O comprador deverá efetuar as revisões periodicamente em intervalos a cada 10.000 km ou de acordo com manual do proprietário emitido pelo fabricante; l) O presente não cobre a prestação de serviços de guincho e similares; m) A garantia diz respeito ao veículo identificado abaixo e é válida somente quando assinada por representantes legais da loja.",
-        "CONDIÇÕES GERAIS: O adquirente identificado declara, para fins de direito, em caráter irrevogável e irretratável, estar ciente e de acordo com o conteúdo deste documento; após testar o veículo abaixo descrito, comprova que o mesmo se encontra em perfeito estado de conservação e desempenho.",
-        "MODIFICAÇÕES NA ELÉTRICA: A garantia do veículo será inválida caso sejam realizadas instalações de rastreadores ou alarmes, quaisquer outros tipos de dispositivos eletrônicos que não tenham autorização prévia da concessionária. Qualquer modificação não autorizada que comprometa o funcionamento original do veículo poderá resultar na perda da garantia.",
-    ]
 
-    for p in paragrafos:
-        linhas = wrap_text(p, largura_util)
+    for p in _GARANTIA_PARAGRAFOS:
+        linhas = _quebrar_linhas(p, largura_util)
         for ln in linhas:
             # Se não houver espaço suficiente antes de desenhar a linha, quebra de página
             if y < 120:
@@ -495,7 +1259,7 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
     ]
     c.setFont("Helvetica", 11)
     for ln in dados:
-        linhas = wrap_text(ln, largura_util)
+        linhas = _quebrar_linhas(ln, largura_util)
         for l in linhas:
             if y < 120:
                 c.showPage()
@@ -507,12 +1271,7 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
     # Rodapé com local e data por extenso
     data_compra = parse_data(data_venda_str) or datetime.date.today()
     cidade = "Itapecerica da Serra, SP"
-    # Texto longo do rodapé: quebrar em linhas e paginar
-    rodape_texto = (
-        "E, por estarem assim justas e contratadas, as partes assinam e rubricam o presente contrato, "
-        "em duas vias de igual teor, para que produza seus regulares efeitos de direito."
-    )
-    for l in wrap_text(rodape_texto, largura_util):
+    for l in _quebrar_linhas(_GARANTIA_RODAPE, largura_util):
         if y < 120:
             c.showPage()
             c.setFont("Helvetica", 11)
@@ -540,6 +1299,7 @@ def gerar_pdf_garantia(moto_id, venda_id=None):
     y -= 14
     c.drawString(margem_esq + 260, y, f"CNPJ {vendedor_cnpj}")
     c.save()
+    _publicar_documento(tmp, nome_arquivo, fp)
 
     # Retornar o caminho do arquivo gerado, se existir
     try:
@@ -558,7 +1318,6 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
     import datetime
     from reportlab.lib.pagesizes import A4
     from reportlab.pdfgen import canvas
-    from reportlab.pdfbase import pdfmetrics
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -590,25 +1349,12 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
     static_abs = os.path.join(base_dir, "static")
     os.makedirs(static_abs, exist_ok=True)
     nome_arquivo = os.path.join(static_abs, f"procuracao_moto_{moto_id}.pdf")
+    fp = _fingerprint_documento("procuracao", row)
+    if _documento_em_cache(nome_arquivo, fp):
+        return nome_arquivo
 
-    # Helpers simples
-    def wrap_text(texto, max_width, font_name="Helvetica", font_size=11):
-        palavras = str(texto).split()
-        linhas, atual = [], ""
-        for p in palavras:
-            teste = (atual + (" " if atual else "") + p)
-            w = pdfmetrics.stringWidth(teste, font_name, font_size)
-            if w <= max_width:
-                atual = teste
-            else:
-                if atual:
-                    linhas.append(atual)
-                atual = p
-        if atual:
-            linhas.append(atual)
-        return linhas
-
-    c = canvas.Canvas(nome_arquivo, pagesize=A4)
+    tmp = _caminho_temporario(nome_arquivo)
+    c = canvas.Canvas(tmp, pagesize=A4)
     largura, altura = A4
     margem_esq = 50
     margem_dir = 50
@@ -630,33 +1376,14 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
         f"CEP: {cep_cliente or ''}",
     ]
     for ln in bloco_topo:
-        for l in wrap_text(ln, largura_util):
+        for l in _quebrar_linhas(ln, largura_util, "Helvetica", 11):
             c.drawString(margem_esq, y, l)
             y -= 16
 
     y -= 6
     # Linha do OUTORGADO (procurador fixo conforme modelo legal)
-    bloco_outorgado = [
-        "Nomeia e constitui-se bastante procurado HENRIQUE NASCIMENTO BITENCOURT",
-        "CPF 396.894.918-81  Residente RODOVIA SALVADOR DE LEONE 2030"
-        "CEP 06853-000",
-        "a quem concedo os mais amplos, gerais e iluminados poderes a fim",
-        "de que possa defender os direitos e interesses do (a) OUTORGANTE perante as",
-        "repartições públicas em geral. Federais, Estaduais, Municipais, Autarquias,",
-        "Oficiais de Registro Civil ou tabelionatos de notas, SPTrans, despachante,",
-        "companhias de seguro, notadamente repartições de transito em geral, DETRAN/",
-        "CONTRAN/ CIRETRAN/ DENATRAN, DTP e demais órgãos autorizados de",
-        "transito em qualquer cidade do território nacional, podendo solicitar 2º via de",
-        "CRV e CRLV , assinar /endossar transferências ( DUT – Documento único de",
-        "transferência ) , autorizar e acompanhar vistorias, efetuar pagamentos, receber",
-        "pagamentos, receber os valores referente a venda do veículo seja a vista ou",
-        "financiada, formular requerimentos, interpor recursos, reclamar, desistir,",
-        "solicitar, cópias de processos, firmar declaração de venda , além de ter acesso a",
-        "documentos de qualquer natureza, referente exclusivamente ao VEICULO",
-        "descrito abaixo.",
-    ]
-    for ln in bloco_outorgado:
-        for l in wrap_text(ln, largura_util):
+    for ln in _PROCURACAO_OUTORGADO:
+        for l in _quebrar_linhas(ln, largura_util, "Helvetica", 11):
             c.drawString(margem_esq, y, l)
             y -= 16
 
@@ -665,15 +1392,8 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
     c.drawString(margem_esq, y, "Cláusula de Responsabilidade por Débitos Anteriores")
     y -= 18
     c.setFont("Helvetica", 11)
-    clausulas = [
-        "Declaro que qualquer débito existente antes da venda, como multas, são de",
-        "minha inteira responsabilidade.",
-        "Caso venha cair débitos e eu não regularize os mesmos, autorizo expressamente",
-        "que meu nome seja negativado em órgãos de proteção ao crédito (SPC,",
-        "SERASA, etc.), conforme já acordado neste documento.",
-    ]
-    for ln in clausulas:
-        for l in wrap_text(ln, largura_util):
+    for ln in _PROCURACAO_CLAUSULAS:
+        for l in _quebrar_linhas(ln, largura_util, "Helvetica", 11):
             c.drawString(margem_esq, y, l)
             y -= 16
 
@@ -709,8 +1429,7 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
     c.drawString(margem_esq + 120, y, f"{chassi or ''}")
     y -= 24
 
-    obs = "Nos termos da Portaria Detran/SP nº 1680, cap II, art 8, Parágrafo VI."
-    for l in wrap_text(obs, largura_util):
+    for l in _quebrar_linhas(_PROCURACAO_OBS, largura_util, "Helvetica", 11):
         c.drawString(margem_esq, y, l)
         y -= 16
 
@@ -720,6 +1439,7 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
     c.drawString(margem_esq, y, "Assinar e reconhecer firma por autenticidade")
 
     c.save()
+    _publicar_documento(tmp, nome_arquivo, fp)
     if os.path.exists(nome_arquivo):
         return nome_arquivo
     else:
@@ -727,29 +1447,53 @@ def gerar_pdf_procuracao(moto_id, venda_id=None):
         return None
 
 # Motos
-def cadastrar_moto(dados):
+def cadastrar_moto(dados, salvar_foto=None):
+    """
+    Insere a moto e retorna o ID.
+
+    `salvar_foto(moto_id)` (opcional) grava a foto em static/uploads e retorna o nome do
+    arquivo (ou None); roda antes do commit, então a moto e a coluna `foto` entram juntas.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO motos (
-            marca, modelo, ano, cor, km, preco, placa, combustivel, status,
-            renavam, chassi, doc_moto, documento_fornecedor, comprovante_residencia, data_cadastro, hora_cadastro,
-            nome_cliente, cpf_cliente, rua_cliente, cep_cliente, celular_cliente, referencia, celular_referencia, debitos, observacoes
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
-        dados["marca"], dados["modelo"], dados["ano"], dados["cor"],
-        dados["km"], dados["preco"], dados["placa"], dados["combustivel"], dados["status"],
-        dados.get("renavam"), dados.get("chassi"), dados.get("doc_moto"), dados.get("documento_fornecedor"),
-        dados.get("comprovante_residencia"), dados.get("data_cadastro"),
-        dados.get("hora_cadastro"), dados.get("nome_cliente"),
-        dados.get("cpf_cliente"), dados.get("rua_cliente"), dados.get("cep_cliente"),
-        dados.get("celular_cliente"), dados.get("referencia"),
-        dados.get("celular_referencia"), dados.get("debitos"),
-        dados.get("observacoes")
-    ))
-    moto_id = cursor.lastrowid
-    conn.commit()
+    # Moto, foto e registro no log na mesma transação
+    conn.start_transaction()
+    try:
+        cursor.execute("""
+            INSERT INTO motos (
+                marca, modelo, ano, cor, km, preco, placa, combustivel, status,
+                renavam, chassi, doc_moto, documento_fornecedor, comprovante_residencia, data_cadastro, hora_cadastro,
+                nome_cliente, cpf_cliente, rua_cliente, cep_cliente, celular_cliente, referencia, celular_referencia, debitos, observacoes,
+                placa_norm
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            dados["marca"], dados["modelo"], dados["ano"], dados["cor"],
+            dados["km"], dados["preco"], dados["placa"], dados["combustivel"], dados["status"],
+            dados.get("renavam"), dados.get("chassi"), dados.get("doc_moto"), dados.get("documento_fornecedor"),
+            dados.get("comprovante_residencia"), dados.get("data_cadastro"),
+            dados.get("hora_cadastro"), dados.get("nome_cliente"),
+            dados.get("cpf_cliente"), dados.get("rua_cliente"), dados.get("cep_cliente"),
+            dados.get("celular_cliente"), dados.get("referencia"),
+            dados.get("celular_referencia"), dados.get("debitos"),
+            dados.get("observacoes"),
+            normalizar_placa(dados["placa"])
+        ))
+        moto_id = cursor.lastrowid
+        if salvar_foto is not None:
+            try:
+                foto = salvar_foto(moto_id)
+            except Exception as e:
+                print(f"Aviso: falha ao salvar foto da moto {moto_id}: {e}")
+                foto = None
+            if foto:
+                cursor.execute("UPDATE motos SET foto = %s, foto_versao = 1 WHERE id = %s", (foto, moto_id))
+        _registrar_alteracao(cursor, ("motos", moto_id, "insert"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
     return moto_id
 
@@ -774,9 +1518,18 @@ def atualizar_campos_comprador(moto_id: int, nome: str = None, cpf: str = None,
     if sets:
         query = "UPDATE motos SET " + ", ".join(sets) + " WHERE id = %s"
         params.append(moto_id)
-        cursor.execute(query, params)
-        conn.commit()
+        conn.start_transaction()
+        try:
+            cursor.execute(query, params)
+            _registrar_alteracao(cursor, ("motos", moto_id, "update"))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
     conn.close()
+    if sets:
+        invalidar_documentos_moto(moto_id)
 
 def listar_motos():
     conn = get_db_connection()
@@ -791,17 +1544,107 @@ def listar_motos():
         FROM motos
         """
     )
-    motos = cursor.fetchall()
-    conn.close()
-    return motos
+    motos = cursor.fetchall()
+    conn.close()
+    return motos
+
+def get_motos_basico():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, marca, modelo, ano, cor, preco FROM motos ORDER BY id DESC")
+    motos = cursor.fetchall()
+    conn.close()
+    return motos
+
+def buscar_foto_moto(moto_id):
+    """(foto, foto_versao) da moto, ou None se ela não existir."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT foto, foto_versao FROM motos WHERE id = %s", (moto_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def listar_fotos_motos():
+    """(id, foto, foto_versao) de todas as motos com foto registrada."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, foto, foto_versao FROM motos WHERE foto IS NOT NULL ORDER BY id")
+    fotos = cursor.fetchall()
+    conn.close()
+    return fotos
+
+def referencias_arquivos():
+    """
+    Tudo o que os arquivos de static/ podem referenciar (usado por coleta_arquivos.py):
+    (ids de motos, {moto_id: (foto, foto_versao)}, ids de vendas, nomes dos anexos).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, foto, foto_versao FROM motos")
+    motos = cursor.fetchall()
+    cursor.execute("SELECT id FROM vendas")
+    vendas = {row[0] for row in cursor.fetchall()}
+    anexos = set()
+    for tabela, coluna in COLUNAS_ANEXOS:
+        cursor.execute(f"SELECT DISTINCT {coluna} FROM {tabela} WHERE {coluna} IS NOT NULL AND {coluna} <> ''")
+        anexos.update(os.path.basename(str(row[0]).replace("\\", "/")) for row in cursor.fetchall())
+    conn.close()
+    return {row[0] for row in motos}, {row[0]: (row[1], row[2]) for row in motos if row[1]}, vendas, anexos
+
+def executar_com_lock(nome, funcao, espera=0):
+    """
+    Executa `funcao()` segurando o lock nomeado `nome` do MySQL, esperando até `espera` segundos.
+    Retorna (True, resultado), ou (False, None) se outro processo ficou com o lock o tempo todo.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (nome, espera))
+        row = cursor.fetchone()
+        if not row or row[0] != 1:
+            return False, None
+        try:
+            return True, funcao()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (nome,))
+            cursor.fetchone()
+    finally:
+        conn.close()
+
+def _registrar_alteracao(cursor, *alteracoes):
+    """
+    Registra as `alteracoes` — tuplas (tabela, id do registro, 'insert'/'update'/'delete') — no log
+    `alteracoes` e incrementa o contador das tabelas envolvidas. Chamar antes do commit da
+    escrita, dentro de `conn.start_transaction()`: a conexão está em autocommit, e sem a
+    transação explícita uma falha aqui deixaria a escrita gravada sem log nem contador.
+    Só motos/vendas (COLUNAS_ALTERACOES) entram no log.
+    """
+    cursor.executemany(
+        "INSERT INTO alteracoes (tabela, registro_id, operacao, criado_em) VALUES (%s, %s, %s, NOW())",
+        list(alteracoes),
+    )
+    _incrementar_versoes(cursor, *{tabela for tabela, _id, _op in alteracoes})
 
-def get_motos_basico():
+def _incrementar_versoes(cursor, *tabelas):
+    """
+    Incrementa o contador de alterações das `tabelas` (cache de exportações e indicadores),
+    sem entrada no log. Usado direto por receitas/gastos, que não fazem parte do feed
+    /api/changes. Mesma regra de transação de `_registrar_alteracao`.
+    """
+    tabelas = sorted(set(tabelas))
+    marcadores = ", ".join(["%s"] * len(tabelas))
+    cursor.execute(f"UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela IN ({marcadores})", tabelas)
+
+def versoes_tabelas(*tabelas):
+    """Versão atual de cada uma das `tabelas`, na ordem pedida (0 para tabela sem contador)."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, marca, modelo, ano, cor, preco FROM motos ORDER BY id DESC")
-    motos = cursor.fetchall()
+    marcadores = ", ".join(["%s"] * len(tabelas))
+    cursor.execute(f"SELECT tabela, versao FROM versoes_tabelas WHERE tabela IN ({marcadores})", tabelas)
+    versoes = dict(cursor.fetchall())
     conn.close()
-    return motos
+    return tuple(int(versoes.get(tabela) or 0) for tabela in tabelas)
 
 def buscar_moto(id):
     conn = get_db_connection()
@@ -812,7 +1655,8 @@ def buscar_moto(id):
         SELECT id, marca, modelo, ano, cor, km, preco, placa, combustivel, status,
                renavam, chassi, doc_moto, documento_fornecedor, comprovante_residencia,
                data_cadastro, hora_cadastro, nome_cliente, cpf_cliente, rua_cliente,
-               cep_cliente, celular_cliente, referencia, celular_referencia, debitos, observacoes
+               cep_cliente, celular_cliente, referencia, celular_referencia, debitos, observacoes,
+               foto, foto_versao
         FROM motos
         WHERE id = %s
         """,
@@ -833,24 +1677,16 @@ def existe_moto_com_placa(placa: str, excluir_id: int | None = None) -> bool:
             return False
         conn = get_db_connection()
         cursor = conn.cursor()
+        # Busca pelo índice de placa_norm (normalização feita no Python, igual à da escrita)
         if excluir_id is None:
             cursor.execute(
-                """
-                SELECT id FROM motos
-                WHERE REPLACE(REPLACE(UPPER(placa), '-', ''), ' ', '') = REPLACE(REPLACE(UPPER(%s), '-', ''), ' ', '')
-                LIMIT 1
-                """,
-                (placa,)
+                "SELECT id FROM motos WHERE placa_norm = %s LIMIT 1",
+                (normalizar_placa(placa),)
             )
         else:
             cursor.execute(
-                """
-                SELECT id FROM motos
-                WHERE REPLACE(REPLACE(UPPER(placa), '-', ''), ' ', '') = REPLACE(REPLACE(UPPER(%s), '-', ''), ' ', '')
-                  AND id <> %s
-                LIMIT 1
-                """,
-                (placa, excluir_id)
+                "SELECT id FROM motos WHERE placa_norm = %s AND id <> %s LIMIT 1",
+                (normalizar_placa(placa), excluir_id)
             )
         row = cursor.fetchone()
         conn.close()
@@ -865,105 +1701,124 @@ def existe_moto_com_placa(placa: str, excluir_id: int | None = None) -> bool:
 def atualizar_moto(id, dados):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE motos SET
-          marca = %s,
-          modelo = %s,
-          ano = %s,
-          cor = %s,
-          km = %s,
-          preco = %s,
-          placa = %s,
-          combustivel = %s,
-          status = %s,
-          renavam = %s,
-          chassi = %s,
-          doc_moto = COALESCE(%s, doc_moto),
-          documento_fornecedor = COALESCE(%s, documento_fornecedor),
-          comprovante_residencia = COALESCE(%s, comprovante_residencia),
-          data_cadastro = %s,
-          hora_cadastro = %s,
-          nome_cliente = %s,
-          cpf_cliente = %s,
-          rua_cliente = %s,
-          cep_cliente = %s,
-          celular_cliente = %s,
-          referencia = %s,
-          celular_referencia = %s,
-          debitos = %s,
-          observacoes = %s
-        WHERE id = %s
-    """, (
-        dados["marca"], dados["modelo"], dados["ano"], dados["cor"],
-        dados["km"], dados["preco"], dados["placa"], dados["combustivel"],
-        dados["status"],
-        dados.get("renavam"),
-        dados.get("chassi"),
-        dados.get("doc_moto"),
-        dados.get("documento_fornecedor"),
-        dados.get("comprovante_residencia"),
-        dados.get("data_cadastro"),
-        dados.get("hora_cadastro"),
-        dados.get("nome_cliente"),
-        dados.get("cpf_cliente"),
-        dados.get("rua_cliente"),
-        dados.get("cep_cliente"),
-        dados.get("celular_cliente"),
-        dados.get("referencia"),
-        dados.get("celular_referencia"),
-        dados.get("debitos"),
-        dados.get("observacoes"),
-        id
-    ))
-    conn.commit()
+    conn.start_transaction()
+    try:
+        cursor.execute("""
+            UPDATE motos SET
+              marca = %s,
+              modelo = %s,
+              ano = %s,
+              cor = %s,
+              km = %s,
+              preco = %s,
+              placa = %s,
+              placa_norm = %s,
+              combustivel = %s,
+              status = %s,
+              renavam = %s,
+              chassi = %s,
+              doc_moto = COALESCE(%s, doc_moto),
+              documento_fornecedor = COALESCE(%s, documento_fornecedor),
+              comprovante_residencia = COALESCE(%s, comprovante_residencia),
+              data_cadastro = %s,
+              hora_cadastro = %s,
+              nome_cliente = %s,
+              cpf_cliente = %s,
+              rua_cliente = %s,
+              cep_cliente = %s,
+              celular_cliente = %s,
+              referencia = %s,
+              celular_referencia = %s,
+              debitos = %s,
+              observacoes = %s,
+              foto = COALESCE(%s, foto),
+              foto_versao = foto_versao + IF(%s IS NULL, 0, 1)
+            WHERE id = %s
+        """, (
+            dados["marca"], dados["modelo"], dados["ano"], dados["cor"],
+            dados["km"], dados["preco"], dados["placa"], normalizar_placa(dados["placa"]),
+            dados["combustivel"], dados["status"],
+            dados.get("renavam"),
+            dados.get("chassi"),
+            dados.get("doc_moto"),
+            dados.get("documento_fornecedor"),
+            dados.get("comprovante_residencia"),
+            dados.get("data_cadastro"),
+            dados.get("hora_cadastro"),
+            dados.get("nome_cliente"),
+            dados.get("cpf_cliente"),
+            dados.get("rua_cliente"),
+            dados.get("cep_cliente"),
+            dados.get("celular_cliente"),
+            dados.get("referencia"),
+            dados.get("celular_referencia"),
+            dados.get("debitos"),
+            dados.get("observacoes"),
+            dados.get("foto"),
+            dados.get("foto"),
+            id
+        ))
+        _registrar_alteracao(cursor, ("motos", id, "update"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
+    invalidar_documentos_moto(id)
     
-def filtrar_motos_completo(filtros):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Selecionar colunas em ordem explícita e estável para manter índices usados nas templates
-    query = (
-        "SELECT id, marca, modelo, ano, cor, km, preco, placa, combustivel, status, "
-        "renavam, chassi, doc_moto, documento_fornecedor, comprovante_residencia, "
-        "data_cadastro, hora_cadastro, nome_cliente, cpf_cliente, rua_cliente, "
-        "cep_cliente, celular_cliente, referencia, celular_referencia, debitos, observacoes "
-        "FROM motos WHERE 1=1"
-    )
+_COLUNAS_MOTOS = (
+    "motos.id, marca, modelo, ano, cor, km, preco, placa, combustivel, status, "
+    "renavam, chassi, doc_moto, documento_fornecedor, comprovante_residencia, "
+    "data_cadastro, hora_cadastro, nome_cliente, cpf_cliente, rua_cliente, "
+    "cep_cliente, celular_cliente, referencia, celular_referencia, debitos, observacoes"
+)
+
+def _where_filtros_motos(filtros):
+    """Monta (FROM ..., WHERE ..., params) compartilhados pela listagem, contagem e agregados."""
+    if filtros.get("incluir_venda") or filtros.get("periodo_venda"):
+        from_sql = " FROM motos LEFT JOIN vendas uv ON uv.id = motos.ultima_venda_id"
+    else:
+        from_sql = " FROM motos"
+    query = " WHERE 1=1"
     params = []
 
-    if filtros["marca_modelo"]:
+    if filtros.get("ids"):
+        ids = [int(i) for i in filtros["ids"]]
+        query += " AND motos.id IN (" + ", ".join(["%s"] * len(ids)) + ")"
+        params += ids
+    if filtros.get("marca_modelo"):
         query += " AND (marca LIKE %s OR modelo LIKE %s)"
         valor = f"%{filtros['marca_modelo']}%"
         params += [valor, valor]
-    if filtros["placa"]:
+    if filtros.get("placa"):
         query += " AND placa LIKE %s"
         params.append(f"%{filtros['placa']}%")
     if filtros.get("renavam"):
         query += " AND renavam LIKE %s"
         params.append(f"%{filtros['renavam']}%")
-    if filtros["combustivel"]:
+    if filtros.get("combustivel"):
         query += " AND combustivel = %s"
         params.append(filtros["combustivel"])
-    if filtros["ano_min"]:
+    if filtros.get("ano_min"):
         query += " AND ano >= %s"
         params.append(int(filtros["ano_min"]))
-    if filtros["ano_max"]:
+    if filtros.get("ano_max"):
         query += " AND ano <= %s"
         params.append(int(filtros["ano_max"]))
-    if filtros["km_min"]:
+    if filtros.get("km_min"):
         query += " AND km >= %s"
         params.append(float(filtros["km_min"]))
-    if filtros["km_max"]:
+    if filtros.get("km_max"):
         query += " AND km <= %s"
         params.append(float(filtros["km_max"]))
-    if filtros["preco_min"]:
+    if filtros.get("preco_min"):
         query += " AND preco >= %s"
         params.append(float(filtros["preco_min"]))
-    if filtros["preco_max"]:
+    if filtros.get("preco_max"):
         query += " AND preco <= %s"
         params.append(float(filtros["preco_max"]))
-    if filtros["status"]:
+    if filtros.get("status"):
         st = str(filtros["status"]).strip().lower()
         # Tratar acentuação para 'disponível' vs 'disponivel'
         if st in ("disponível", "disponivel"):
@@ -976,41 +1831,175 @@ def filtrar_motos_completo(filtros):
         # Quando não há status específico, mas queremos apenas itens em estoque (disponíveis + consignado)
         query += " AND status IN ('disponível','disponivel','consignado')"
 
+    # Busca unificada "q" (marca, modelo, placa, renavam, chassi, nome/CPF do comprador)
+    termos = termos_busca(filtros.get("q"))
+    if termos:
+        if indice_busca_disponivel():
+            query += f" AND MATCH({COLUNAS_BUSCA}) AGAINST (%s IN BOOLEAN MODE)"
+            params.append(_busca_boolean(termos))
+        else:
+            for variantes in termos:
+                query += " AND (" + " OR ".join(
+                    ["marca LIKE %s OR modelo LIKE %s OR placa_norm LIKE %s OR renavam LIKE %s"
+                     " OR chassi LIKE %s OR nome_cliente LIKE %s OR cpf_cliente LIKE %s"] * len(variantes)
+                ) + ")"
+                for termo in variantes:
+                    params += [f"%{termo}%"] * 7
+
+    # Mês de cadastro (YYYY-MM), apenas itens não vendidos
+    if filtros.get("periodo_cadastro"):
+        inicio, fim = intervalo_mes(filtros["periodo_cadastro"])
+        query += " AND (status IS NULL OR status <> 'vendida') AND data_cadastro >= %s AND data_cadastro < %s"
+        params += [inicio, fim]
+    # Mês da última venda (YYYY-MM), pela data tipada da venda
+    if filtros.get("periodo_venda"):
+        inicio, fim = intervalo_mes(filtros["periodo_venda"])
+        query += " AND uv.data_dt >= %s AND uv.data_dt < %s"
+        params += [inicio, fim]
+
     # Deduplicar por placa (opcional): mantém apenas o registro mais recente (maior id) por placa
     if filtros.get("dedup_por_status"):
         # Deduplica por placa dentro do mesmo status, mas não remove registros com placa vazia/nula
         # Normaliza placa removendo hífens e espaços e aplicando UPPER
+        # Usa a coluna indexada placa_norm (subconsulta resolvida pelo índice (placa_norm, status, id))
         query += (
             " AND ("
-            "   REPLACE(REPLACE(UPPER(COALESCE(placa,'')), '-', ''), ' ', '') = ''"
-            "   OR id = ("
+            "   COALESCE(placa_norm, '') = ''"
+            "   OR motos.id = ("
             "       SELECT MAX(m2.id) FROM motos m2"
-            "       WHERE REPLACE(REPLACE(UPPER(COALESCE(m2.placa,'')), '-', ''), ' ', '') = REPLACE(REPLACE(UPPER(COALESCE(motos.placa,'')), '-', ''), ' ', '')"
+            "       WHERE m2.placa_norm = motos.placa_norm"
             "         AND m2.status = motos.status"
             "   )"
             " )"
         )
     elif filtros.get("dedup_placa"):
-        # Normaliza placa removendo hífens e espaços e usando UPPER para evitar duplicidades por formatação
+        # placa_norm já vem normalizada (UPPER, sem hífens/espaços); NULL continua sem casar, como antes
         query += (
-            " AND id = ("
+            " AND motos.id = ("
             "   SELECT MAX(m2.id) FROM motos m2"
-            "   WHERE REPLACE(REPLACE(UPPER(m2.placa), '-', ''), ' ', '') = REPLACE(REPLACE(UPPER(motos.placa), '-', ''), ' ', '')"
+            "   WHERE m2.placa_norm = motos.placa_norm"
             " )"
         )
+    return from_sql, query, params
+
+def filtrar_motos_completo(filtros, apos_id=None, antes_id=None, limite=None, deslocamento=0):
+    """
+    Lista motos conforme os filtros, em ordem crescente de ID.
+
+    Paginação por chave (keyset): `apos_id` traz os registros com id > apos_id e `antes_id`
+    os registros imediatamente anteriores a antes_id; `limite` limita a quantidade.
+    Sem esses parâmetros retorna todos os registros, como antes.
+    `deslocamento` (com `limite`) pula registros: usado na busca por relevância, que não
+    segue a ordem de ID.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # Selecionar colunas em ordem explícita e estável para manter índices usados nas templates
+    query = "SELECT " + _COLUNAS_MOTOS
+    if filtros.get("incluir_venda"):
+        # Dados da última venda via ponteiro motos.ultima_venda_id (índices 26..30 da linha):
+        # 26:preco_final, 27:data, 28:cnh_path, 29:garantia_path, 30:endereco_path
+        query += ", uv.preco_final, uv.data, uv.cnh_path, uv.garantia_path, uv.endereco_path"
+    if filtros.get("incluir_foto"):
+        # Sempre as duas últimas colunas: foto (nome em static/uploads) e foto_versao
+        query += ", motos.foto, motos.foto_versao"
+    from_sql, where_sql, params = _where_filtros_motos(filtros)
+    query += from_sql + where_sql
+
+    if apos_id is not None:
+        query += " AND motos.id > %s"
+        params.append(int(apos_id))
+    if antes_id is not None:
+        query += " AND motos.id < %s"
+        params.append(int(antes_id))
 
     # Ordenar por ID crescente para facilitar leitura e evitar confusão visual
-    query += " ORDER BY id ASC"
+    # (voltando uma página: busca decrescente a partir de antes_id e inverte abaixo)
+    decrescente = antes_id is not None and apos_id is None
+    termos = termos_busca(filtros.get("q"))
+    if termos and indice_busca_disponivel():
+        # Busca: mais relevantes primeiro (sem paginação por chave)
+        decrescente = False
+        query += f" ORDER BY MATCH({COLUNAS_BUSCA}) AGAINST (%s IN BOOLEAN MODE) DESC, motos.id ASC"
+        params.append(_busca_boolean(termos))
+    elif decrescente:
+        query += " ORDER BY motos.id DESC"
+    else:
+        query += " ORDER BY motos.id ASC"
+    if limite:
+        query += " LIMIT %s"
+        params.append(int(limite))
+        if deslocamento:
+            query += " OFFSET %s"
+            params.append(int(deslocamento))
     cursor.execute(query, params)
     resultado = cursor.fetchall()
     conn.close()
+    if decrescente:
+        resultado.reverse()
     return resultado
 
+_contagem_cache = {}
+_contagem_lock = threading.Lock()
+CONTAGEM_TTL = 60  # segundos
+
+def contar_motos(filtros) -> int:
+    """
+    Total de motos para os filtros (sem paginação), com cache em memória por alguns segundos.
+
+    O total só é exibido como informação; um pequeno atraso após cadastros/vendas é aceitável
+    e evita repetir o COUNT a cada troca de página.
+    """
+    import time
+    chave = tuple(sorted((k, str(v)) for k, v in filtros.items() if v not in (None, "", False)))
+    agora = time.monotonic()
+    with _contagem_lock:
+        item = _contagem_cache.get(chave)
+        if item and agora - item[0] < CONTAGEM_TTL:
+            return item[1]
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    from_sql, where_sql, params = _where_filtros_motos(filtros)
+    cursor.execute("SELECT COUNT(*)" + from_sql + where_sql, params)
+    total = cursor.fetchone()[0] or 0
+    conn.close()
+    with _contagem_lock:
+        if len(_contagem_cache) > 256:
+            _contagem_cache.clear()
+        _contagem_cache[chave] = (agora, total)
+    return total
+
+def lucros_por_mes(filtros) -> dict:
+    """
+    Lucro (preço da última venda - preço cadastrado) agrupado pelo mês da venda, para os filtros.
+    Retorna { 'YYYY-MM': total_lucro_float } ordenado por mês.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    from_sql, where_sql, params = _where_filtros_motos(dict(filtros, incluir_venda=True))
+    cursor.execute(
+        "SELECT DATE_FORMAT(uv.data_dt, '%Y-%m') AS ym, SUM(uv.preco_final - COALESCE(motos.preco, 0))"
+        + from_sql + where_sql
+        + " AND uv.preco_final IS NOT NULL AND uv.data_dt IS NOT NULL GROUP BY ym ORDER BY ym",
+        params
+    )
+    dados = cursor.fetchall()
+    conn.close()
+    return {ym: float(total or 0) for ym, total in dados}
+
 def excluir_moto(id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM motos WHERE id = %s", (id,))
-    conn.commit()
+    conn.start_transaction()
+    try:
+        cursor.execute("DELETE FROM motos WHERE id = %s", (id,))
+        _registrar_alteracao(cursor, ("motos", id, "delete"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
 
 # Dashboard
@@ -1026,11 +2015,11 @@ def get_stats_estoque():
         FROM motos m
         WHERE m.status IN ('disponível','disponivel','consignado')
           AND (
-              REPLACE(REPLACE(UPPER(COALESCE(m.placa,'')), '-', ''), ' ', '') = ''
+              COALESCE(m.placa_norm, '') = ''
               OR m.id = (
                     SELECT MAX(m2.id) FROM motos m2
-                    WHERE m2.status = m.status
-                      AND REPLACE(REPLACE(UPPER(COALESCE(m2.placa,'')), '-', ''), ' ', '') = REPLACE(REPLACE(UPPER(COALESCE(m.placa,'')), '-', ''), ' ', '')
+                    WHERE m2.placa_norm = m.placa_norm
+                      AND m2.status = m.status
               )
           )
         """
@@ -1040,38 +2029,70 @@ def get_stats_estoque():
     # Retorna (quantidade, soma) ou (0, 0) se não houver motos
     return dados if dados and dados[0] is not None else (0, 0)
 
-def get_stats_vendas_mes():
+def get_stats_vendas_mes(periodo_ym=None):
+    import datetime
+    inicio, fim = intervalo_mes(periodo_ym or datetime.date.today().strftime("%Y-%m"))
     conn = get_db_connection()
     cursor = conn.cursor()
-    # DATE_FORMAT para MySQL
+    # Faixa sobre a coluna tipada/indexada data_dt (mês corrente)
     cursor.execute("""
         SELECT COUNT(v.id), SUM(m.preco)
         FROM vendas v
         JOIN motos m ON v.moto_id = m.id
-        WHERE DATE_FORMAT(STR_TO_DATE(v.data, '%Y-%m-%d'), '%Y-%m') = DATE_FORMAT(NOW(), '%Y-%m')
-    """)
+        WHERE v.data_dt >= %s AND v.data_dt < %s
+    """, (inicio, fim))
     dados = cursor.fetchone()
     conn.close()
     return dados if dados and dados[0] is not None else (0, 0)
 
+def get_stats_financeiro_mes(periodo_ym=None):
+    """(total de receitas, total de gastos) do mês, pelas colunas de data tipadas/indexadas."""
+    import datetime
+    inicio, fim = intervalo_mes(periodo_ym or datetime.date.today().strftime("%Y-%m"))
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT
+            (SELECT COALESCE(SUM(valor), 0) FROM receitas WHERE adicionado_em_dt >= %s AND adicionado_em_dt < %s),
+            (SELECT COALESCE(SUM(valor), 0) FROM gastos WHERE retirado_em_dt >= %s AND retirado_em_dt < %s)
+    """, (inicio, fim, inicio, fim))
+    dados = cursor.fetchone()
+    conn.close()
+    return dados if dados else (0, 0)
+
 # Vendas
 def registrar_venda(moto_id, vendedor, data, preco_final=None, cnh_path=None, garantia_path=None, endereco_path=None):
     conn = get_db_connection()
     cursor = conn.cursor()
-    # Permitir venda quando a moto estiver 'disponível' (com e sem acento) ou 'consignado'
-    cursor.execute("SELECT id FROM motos WHERE id = %s AND status IN ('disponível','disponivel','consignado')", (moto_id,))
-    if cursor.fetchone():
+    # Venda, status e ponteiro ultima_venda_id na mesma transação (FOR UPDATE evita venda dupla)
+    conn.start_transaction()
+    try:
+        # Permitir venda quando a moto estiver 'disponível' (com e sem acento) ou 'consignado'
+        cursor.execute(
+            "SELECT id FROM motos WHERE id = %s AND status IN ('disponível','disponivel','consignado') FOR UPDATE",
+            (moto_id,)
+        )
+        if not cursor.fetchone():
+            conn.rollback()
+            conn.close()
+            return False
         cursor.execute("""
-            INSERT INTO vendas (moto_id, vendedor, data, preco_final, cnh_path, garantia_path, endereco_path)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (moto_id, vendedor, data, preco_final, cnh_path, garantia_path, endereco_path))
+            INSERT INTO vendas (moto_id, vendedor, data, data_dt, preco_final, cnh_path, garantia_path, endereco_path)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (moto_id, vendedor, data, parse_data_legada(data), preco_final, cnh_path, garantia_path, endereco_path))
         venda_id = cursor.lastrowid  # Pega o ID da venda recém-criada
-        cursor.execute("UPDATE motos SET status = 'vendida' WHERE id = %s", (moto_id,))
+        cursor.execute(
+            "UPDATE motos SET status = 'vendida', ultima_venda_id = %s WHERE id = %s",
+            (venda_id, moto_id)
+        )
+        _registrar_alteracao(cursor, ("vendas", venda_id, "insert"), ("motos", moto_id, "update"))
         conn.commit()
+    except Exception:
+        conn.rollback()
         conn.close()
-        return venda_id  # Retorna o ID da venda ao invés de True
+        raise
     conn.close()
-    return False
+    return venda_id  # Retorna o ID da venda ao invés de True
 
 def atualizar_venda_campos(venda_id, preco_final=None, cnh_path=None, garantia_path=None, endereco_path=None):
     """Atualiza campos opcionais da venda (preço final e anexos)."""
@@ -1096,9 +2117,24 @@ def atualizar_venda_campos(venda_id, preco_final=None, cnh_path=None, garantia_p
     if sets:
         query = "UPDATE vendas SET " + ", ".join(sets) + " WHERE id = %s"
         params.append(venda_id)
-        cursor.execute(query, params)
-        conn.commit()
+        conn.start_transaction()
+        try:
+            cursor.execute(query, params)
+            _registrar_alteracao(cursor, ("vendas", venda_id, "update"))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+    moto_id = None
+    if preco_final is not None:
+        # O preço final aparece nos recibos: descartar os documentos em cache da moto
+        cursor.execute("SELECT moto_id FROM vendas WHERE id = %s", (venda_id,))
+        r = cursor.fetchone()
+        moto_id = r[0] if r else None
     conn.close()
+    if moto_id is not None:
+        invalidar_documentos_moto(moto_id)
 
 def atualizar_data_venda_ultima(moto_id: int, data_venda: str) -> bool:
     """
@@ -1109,25 +2145,157 @@ def atualizar_data_venda_ultima(moto_id: int, data_venda: str) -> bool:
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM vendas WHERE moto_id = %s ORDER BY id DESC LIMIT 1", (moto_id,))
-        row = cursor.fetchone()
-        if not row:
+        conn.start_transaction()
+        venda_id = _ultima_venda_id(cursor, moto_id)
+        if not venda_id:
+            conn.rollback()
             conn.close()
             return False
-        venda_id = row[0]
-        cursor.execute("UPDATE vendas SET data = %s WHERE id = %s", (data_venda, venda_id))
+        cursor.execute(
+            "UPDATE vendas SET data = %s, data_dt = %s WHERE id = %s",
+            (data_venda, parse_data_legada(data_venda), venda_id)
+        )
+        _registrar_alteracao(cursor, ("vendas", venda_id, "update"))
         conn.commit()
         conn.close()
+        invalidar_documentos_moto(moto_id)
         return True
     except Exception:
         # Em caso de erro, garantir fechamento e retornar False
         try:
+            conn.rollback()
             conn.close()
         except Exception:
             pass
         return False
 
 # Relatório
+# Exportações (ver exportacao.py): colunas de `motos` que podem ser escolhidas, na ordem da
+# tabela, com o título mostrado no seletor. O cabeçalho da planilha usa a chave (nome da coluna).
+COLUNAS_EXPORTACAO_MOTOS = (
+    ("id", "ID"),
+    ("marca", "Marca"),
+    ("modelo", "Modelo"),
+    ("ano", "Ano"),
+    ("cor", "Cor"),
+    ("km", "KM"),
+    ("preco", "Preço"),
+    ("placa", "Placa"),
+    ("combustivel", "Combustível"),
+    ("status", "Status"),
+    ("renavam", "Renavam"),
+    ("chassi", "Chassi"),
+    ("doc_moto", "Documento da moto"),
+    ("documento_fornecedor", "Documento do fornecedor"),
+    ("comprovante_residencia", "Comprovante de residência"),
+    ("data_cadastro", "Data de cadastro"),
+    ("hora_cadastro", "Hora de cadastro"),
+    ("nome_cliente", "Nome do cliente"),
+    ("cpf_cliente", "CPF do cliente"),
+    ("rua_cliente", "Endereço do cliente"),
+    ("cep_cliente", "CEP do cliente"),
+    ("celular_cliente", "Celular do cliente"),
+    ("referencia", "Referência"),
+    ("celular_referencia", "Celular da referência"),
+    ("debitos", "Débitos"),
+    ("observacoes", "Observações"),
+)
+COLUNAS_EXPORTACAO_MOTOS_PADRAO = ("id", "marca", "modelo", "ano", "cor", "km", "preco", "placa", "combustivel", "status")
+
+def iterar_exportacao_motos(colunas, lote=1000):
+    """Linhas de `motos` (mais recentes primeiro) só com as `colunas` pedidas, lidas em lotes."""
+    validas = {chave for chave, _titulo in COLUNAS_EXPORTACAO_MOTOS}
+    colunas = [c for c in colunas if c in validas] or list(COLUNAS_EXPORTACAO_MOTOS_PADRAO)
+    return iterar_consulta(f"SELECT {', '.join(colunas)} FROM motos ORDER BY id DESC", lote=lote)
+
+CABECALHO_VENDAS_POR_VENDEDOR = ("vendedor", "total_vendas", "receita_total")
+
+_SQL_VENDAS_POR_VENDEDOR = """
+    SELECT v.vendedor,
+           COUNT(m.id) AS total_vendas,
+           COALESCE(SUM(COALESCE(v.preco_final, m.preco)), 0) AS receita_total
+    FROM vendas v
+    INNER JOIN motos m ON v.moto_id = m.id
+    GROUP BY v.vendedor
+    ORDER BY total_vendas DESC
+"""
+
+def iterar_vendas_por_vendedor():
+    """Total de vendas e receita por vendedor (mesma consulta da tela Vendas por Vendedor)."""
+    return iterar_consulta(_SQL_VENDAS_POR_VENDEDOR)
+
+def totais_por_vendedor():
+    """Lista (vendedor, total_vendas, receita_total) de todo o período, mais vendas primeiro."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(_SQL_VENDAS_POR_VENDEDOR)
+    totais = cursor.fetchall()
+    conn.close()
+    return totais
+
+# Alterações (log `alteracoes`): o cursor é o id da última alteração já lida. Só entram
+# alterações com alguns segundos, para que uma transação ainda aberta com id menor não seja
+# pulada por quem avança o cursor (as escritas de motos/vendas duram bem menos que isso).
+ALTERACOES_ATRASO = 5  # segundos
+COLUNAS_ALTERACOES = {
+    "motos": tuple(chave for chave, _titulo in COLUNAS_EXPORTACAO_MOTOS if chave != "id"),
+    "vendas": ("moto_id", "vendedor", "data", "data_dt", "preco_final", "cnh_path", "garantia_path", "endereco_path"),
+}
+
+def listar_alteracoes(desde=0, limite=1000, tabela=None):
+    """Alterações com id > `desde`, em ordem: (id, tabela, registro_id, operacao, criado_em)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    sql = (
+        "SELECT id, tabela, registro_id, operacao, criado_em FROM alteracoes "
+        "WHERE id > %s AND criado_em <= NOW() - INTERVAL %s SECOND"
+    )
+    params = [desde, ALTERACOES_ATRASO]
+    if tabela:
+        sql += " AND tabela = %s"
+        params.append(tabela)
+    cursor.execute(sql + " ORDER BY id LIMIT %s", params + [limite])
+    linhas = cursor.fetchall()
+    conn.close()
+    return linhas
+
+def cursor_alteracoes():
+    """Id da alteração mais recente que já pode ser lida (0 se o log está vazio)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT MAX(id) FROM alteracoes WHERE criado_em <= NOW() - INTERVAL %s SECOND",
+        (ALTERACOES_ATRASO,),
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return int(row[0] or 0) if row else 0
+
+def cabecalho_alteracoes(tabela):
+    return ("alteracao", "operacao", "id") + COLUNAS_ALTERACOES[tabela]
+
+def iterar_alteracoes_tabela(tabela, desde, ate, lote=1000):
+    """
+    Registros de `tabela` alterados entre os cursores (`desde`, `ate`], um por registro, com a
+    última operação e o estado atual da linha (colunas vazias para registros excluídos).
+    """
+    colunas = ", ".join(f"t.{c}" for c in COLUNAS_ALTERACOES[tabela])
+    return iterar_consulta(
+        f"""
+        SELECT u.ultimo, a.operacao, u.registro_id, {colunas}
+        FROM (
+            SELECT registro_id, MAX(id) AS ultimo FROM alteracoes
+            WHERE tabela = %s AND id > %s AND id <= %s
+            GROUP BY registro_id
+        ) u
+        JOIN alteracoes a ON a.id = u.ultimo
+        LEFT JOIN {tabela} t ON t.id = u.registro_id
+        ORDER BY u.ultimo
+        """,
+        (tabela, desde, ate),
+        lote=lote,
+    )
+
 def gerar_relatorio():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -1150,17 +2318,6 @@ def gerar_relatorio():
             m[5] or 0, m[6] or 0, m[7] or "", m[8] or "", status
         ))
 
-    # Contar vendas por vendedor apenas para motos existentes (exclui motos deletadas)
-    cursor.execute(
-        """
-        SELECT v.vendedor, COUNT(m.id)
-        FROM vendas v
-        INNER JOIN motos m ON v.moto_id = m.id
-        GROUP BY v.vendedor
-        """
-    )
-    vendas = cursor.fetchall()
-
     conn.close()
     total_geral = total_disponivel + total_vendida
     resumo = {
@@ -1169,7 +2326,8 @@ def gerar_relatorio():
         "total_geral": total_geral
     }
 
-    return estoque, vendas, resumo
+    # Vendas por vendedor: indicador em cache (kpis.vendas_por_vendedor)
+    return estoque, resumo
 
 # Recibo
 def detalhes_venda(moto_id):
@@ -1180,10 +2338,8 @@ def detalhes_venda(moto_id):
                m.placa, m.preco, m.km,
                v.vendedor, v.data, v.preco_final, v.id
         FROM motos m
-        JOIN vendas v ON m.id = v.moto_id
+        JOIN vendas v ON v.id = m.ultima_venda_id
         WHERE m.id = %s
-        ORDER BY v.id DESC
-        LIMIT 1
     """, (moto_id,))
     dados = cursor.fetchone()
     conn.close()
@@ -1204,93 +2360,86 @@ def detalhes_venda_por_id(venda_id):
     conn.close()
     return dados
 
-def gerar_pdf_recibo(moto_id):
-    import os
+def _gerar_documento_memoria(nome_arquivo, fp, desenhar, persistir=None):
+    """
+    Renderiza um documento curto (recibos) direto em memória e retorna os bytes do PDF.
+
+    `desenhar(c)` recebe o canvas. Só com `persistir` (padrão: PERSISTIR_RECIBOS) o cache
+    de documentos guarda/reaproveita uma cópia em static/; sem ele nada é gravado em disco.
+    """
+    import io
+    if persistir is None:
+        persistir = PERSISTIR_RECIBOS
+    caminho = os.path.join(_STATIC_ABS, nome_arquivo)
+    if persistir and _documento_em_cache(caminho, fp):
+        with open(caminho, "rb") as f:
+            return f.read()
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    desenhar(c)
+    c.save()
+    conteudo = buffer.getvalue()
+    if persistir:
+        tmp = _caminho_temporario(caminho)
+        with open(tmp, "wb") as f:
+            f.write(conteudo)
+        _publicar_documento(tmp, caminho, fp)
+    return conteudo
+
+def gerar_pdf_recibo(moto_id, persistir=None):
+    """
+    Recibo da última venda da moto, gerado em memória.
+
+    Retorna (conteúdo, mimetype, fingerprint) ou None se não houver venda.
+    """
     try:
         dados = detalhes_venda(moto_id)
         if not dados:
             print(f"Erro: Dados da venda não encontrados para moto_id {moto_id}")
             return None
+        fp = _fingerprint_documento("recibo_moto", dados)
+
+        def desenhar(c):
+            c.setFont("Helvetica", 12)
+            largura, altura = A4
+            y = altura - 100
+
+            c.drawString(50, altura - 50, "Recibo de Compra e Venda de Moto")
+
+            preco_final = dados[10] if len(dados) > 10 and dados[10] is not None else dados[6]
+            texto = [
+                f"Moto: {dados[1]} {dados[2]} ({dados[3]})",
+                f"Cor: {dados[4]}",
+                f"Placa: {dados[5]}",
+                f"KM: {br_km_safe(dados[7])}",
+                f"Identificador: {dados[0]} (Venda #{dados[11]})",
+                f"Preço Final: {br_moeda_safe(preco_final)}",
+                f"Vendedor: {dados[8]}",
+                f"Data da Venda: {dados[9]}",
+                "",
+                "Declaro para os devidos fins que a motocicleta descrita acima foi negociada entre as partes.",
+                "",
+                "__________________________        __________________________",
+                "Assinatura do Vendedor           Assinatura do Comprador"
+            ]
+
+            for linha in texto:
+                c.drawString(50, y, linha)
+                y -= 20
+
+        conteudo = _gerar_documento_memoria(f"recibo_moto_{moto_id}.pdf", fp, desenhar, persistir)
+        return conteudo, "application/pdf", fp
 
-        # Garantir que a pasta static existe
-        os.makedirs("static", exist_ok=True)
-        
-        nome_arquivo = os.path.join("static", f"recibo_moto_{moto_id}.pdf")
-        print(f"Tentando criar PDF em: {os.path.abspath(nome_arquivo)}")
-        
-        c = canvas.Canvas(nome_arquivo, pagesize=A4)
-        c.setFont("Helvetica", 12)
-        largura, altura = A4
-        y = altura - 100
-
-        c.drawString(50, altura - 50, "Recibo de Compra e Venda de Moto")
-
-        preco_final = dados[10] if len(dados) > 10 and dados[10] is not None else dados[6]
-        texto = [
-            f"Moto: {dados[1]} {dados[2]} ({dados[3]})",
-            f"Cor: {dados[4]}",
-            f"Placa: {dados[5]}",
-            f"KM: {br_km_safe(dados[7])}",
-            f"Identificador: {dados[0]} (Venda #{dados[11]})",
-            f"Preço Final: {br_moeda_safe(preco_final)}",
-            f"Vendedor: {dados[8]}",
-            f"Data da Venda: {dados[9]}",
-            "",
-            "Declaro para os devidos fins que a motocicleta descrita acima foi negociada entre as partes.",
-            "",
-            "__________________________        __________________________",
-            "Assinatura do Vendedor           Assinatura do Comprador"
-        ]
-
-        for linha in texto:
-            c.drawString(50, y, linha)
-            y -= 20
-
-        c.save()
-        
-        # Verificar se o arquivo foi criado
-        if os.path.exists(nome_arquivo):
-            print(f"PDF criado com sucesso: {nome_arquivo}")
-            return nome_arquivo
-        else:
-            print(f"Erro: PDF não foi criado em {nome_arquivo}")
-            return None
-            
     except Exception as e:
         print(f"Erro ao gerar PDF do recibo: {e}")
         return None
 
-def gerar_html_recibo_por_venda_id(venda_id):
-    """
-    Gera um HTML do recibo de venda usando o ID da venda
-    """
-    import os
-    try:
-        # Buscar detalhes da venda
-        detalhes = detalhes_venda_por_id(venda_id)
-        if not detalhes:
-            print(f"Venda com ID {venda_id} não encontrada")
-            return None
-        
-        # Garantir que a pasta static existe
-        os.makedirs("static", exist_ok=True)
-        
-        # Gerar nome do arquivo usando ID da venda
-        nome_arquivo = os.path.join("static", f"recibo_venda_{venda_id}.html")
-        print(f"Gerando HTML em: {os.path.abspath(nome_arquivo)}")
-        
-        # Formatação brasileira
-        preco_final = detalhes[11] if len(detalhes) > 11 and detalhes[11] is not None else detalhes[6]
-        preco_formatado = br_moeda_safe(preco_final)
-        km_formatado = br_km_safe(detalhes[7])
-        
-        # Criar o HTML usando concatenação de strings para evitar problemas com f-strings
-        html_content = '''<!DOCTYPE html>
+_RECIBO_HTML = string.Template('''<!DOCTYPE html>
 <html lang="pt-BR">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Recibo de Venda - ''' + str(detalhes[10]) + '''</title>
+    <title>Recibo de Venda - $venda_id</title>
     <style>
         body {
             font-family: Arial, sans-serif;
@@ -1374,15 +2523,15 @@ def gerar_html_recibo_por_venda_id(venda_id):
             <h2>📋 Informações da Venda</h2>
             <div class="info-row">
                 <span class="label">ID da Venda:</span>
-                <span class="value">''' + str(detalhes[10]) + '''</span>
+                <span class="value">$venda_id</span>
             </div>
             <div class="info-row">
                 <span class="label">Data:</span>
-                <span class="value">''' + str(detalhes[9]) + '''</span>
+                <span class="value">$data</span>
             </div>
             <div class="info-row">
                 <span class="label">Vendedor:</span>
-                <span class="value">''' + str(detalhes[8]) + '''</span>
+                <span class="value">$vendedor</span>
             </div>
         </div>
         
@@ -1390,32 +2539,32 @@ def gerar_html_recibo_por_venda_id(venda_id):
             <h2>🏍️ Motocicleta</h2>
             <div class="info-row">
                 <span class="label">Marca:</span>
-                <span class="value">''' + str(detalhes[1]) + '''</span>
+                <span class="value">$marca</span>
             </div>
             <div class="info-row">
                 <span class="label">Modelo:</span>
-                <span class="value">''' + str(detalhes[2]) + '''</span>
+                <span class="value">$modelo</span>
             </div>
             <div class="info-row">
                 <span class="label">Ano:</span>
-                <span class="value">''' + str(detalhes[3]) + '''</span>
+                <span class="value">$ano</span>
             </div>
             <div class="info-row">
                 <span class="label">Cor:</span>
-                <span class="value">''' + str(detalhes[4]) + '''</span>
+                <span class="value">$cor</span>
             </div>
             <div class="info-row">
                 <span class="label">Quilometragem:</span>
-                <span class="value">''' + km_formatado + '''</span>
+                <span class="value">$km</span>
             </div>
         </div>
         
         <div class="preco">
-            💰 VALOR TOTAL: ''' + preco_formatado + '''
+            💰 VALOR TOTAL: $preco
         </div>
         
         <div class="footer">
-            <p>Recibo gerado automaticamente em ''' + str(detalhes[8]) + '''</p>
+            <p>Recibo gerado automaticamente em $data</p>
             <p>Sistema Motos Web - Gestão de Vendas</p>
         </div>
     </div>
@@ -1428,109 +2577,107 @@ def gerar_html_recibo_por_venda_id(venda_id):
         };
     </script>
 </body>
-</html>'''
-        
-        # Salvar o HTML
-        with open(nome_arquivo, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        # Verificar se o arquivo foi criado
-        if os.path.exists(nome_arquivo):
-            print(f"HTML gerado com sucesso: {nome_arquivo}")
-            return nome_arquivo
-        else:
-            print(f"Erro: HTML não foi criado em {nome_arquivo}")
+</html>''')
+
+def gerar_html_recibo_por_venda_id(venda_id):
+    """
+    Gera o HTML do recibo de venda usando o ID da venda (em memória).
+
+    Retorna (conteúdo, mimetype, None) ou None se a venda não existir.
+    """
+    from html import escape
+    try:
+        # Buscar detalhes da venda
+        detalhes = detalhes_venda_por_id(venda_id)
+        if not detalhes:
+            print(f"Venda com ID {venda_id} não encontrada")
             return None
-            
+
+        # Formatação brasileira
+        preco_final = detalhes[11] if len(detalhes) > 11 and detalhes[11] is not None else detalhes[6]
+        html_content = _RECIBO_HTML.substitute(
+            venda_id=escape(str(detalhes[10])),
+            data=escape(str(detalhes[9])),
+            vendedor=escape(str(detalhes[8])),
+            marca=escape(str(detalhes[1])),
+            modelo=escape(str(detalhes[2])),
+            ano=escape(str(detalhes[3])),
+            cor=escape(str(detalhes[4])),
+            km=br_km_safe(detalhes[7]),
+            preco=br_moeda_safe(preco_final),
+        )
+        # O Flask acrescenta '; charset=utf-8' aos tipos text/*
+        return html_content.encode("utf-8"), "text/html", None
+
     except Exception as e:
         print(f"Erro ao gerar HTML do recibo: {e}")
         import traceback
         traceback.print_exc()
         return None
 
-def gerar_pdf_recibo_por_venda_id(venda_id):
+def gerar_pdf_recibo_por_venda_id(venda_id, persistir=None):
     """
-    Tenta gerar PDF, mas se falhar, gera HTML como alternativa
+    Recibo da venda em PDF, gerado em memória; se o PDF falhar, gera HTML como alternativa.
+
+    Retorna (conteúdo, mimetype, fingerprint ou None) ou None se a venda não existir.
     """
     try:
-        import os
-        # Tentar gerar PDF primeiro
-        from reportlab.lib.pagesizes import A4
-        from reportlab.pdfgen import canvas
-        
         # Buscar detalhes da venda
         detalhes = detalhes_venda_por_id(venda_id)
         if not detalhes:
             print(f"Venda com ID {venda_id} não encontrada")
             return None
-        
-        # Garantir que a pasta static existe
-        os.makedirs("static", exist_ok=True)
-        
-        # Gerar nome do arquivo usando ID da venda
-        nome_arquivo = os.path.join("static", f"recibo_venda_{venda_id}.pdf")
-        print(f"Gerando PDF em: {os.path.abspath(nome_arquivo)}")
-        
-        # Criar o PDF
-        c = canvas.Canvas(nome_arquivo, pagesize=A4)
-        
-        # Título
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(50, 800, "RECIBO DE VENDA - SISTEMA MOTOS")
-        
-        # Linha separadora
-        c.line(50, 790, 550, 790)
-        
-        # Informações da venda
-        c.setFont("Helvetica", 12)
-        y = 760
-        
-        c.drawString(50, y, f"Venda ID: {detalhes[9]}")
-        y -= 20
-        c.drawString(50, y, f"Data: {detalhes[8]}")
-        y -= 20
-        c.drawString(50, y, f"Vendedor: {detalhes[7]}")
-        y -= 30
-        
-        # Informações da moto
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y, "MOTOCICLETA:")
-        y -= 20
-        c.setFont("Helvetica", 12)
-        c.drawString(50, y, f"Marca: {detalhes[1]}")
-        y -= 20
-        c.drawString(50, y, f"Modelo: {detalhes[2]}")
-        y -= 20
-        c.drawString(50, y, f"Ano: {detalhes[3]}")
-        y -= 20
-        c.drawString(50, y, f"Cor: {detalhes[4]}")
-        y -= 20
-        c.drawString(50, y, f"KM: {detalhes[5]:,}".replace(",", "."))
-        y -= 20
-        
-        # Preço em destaque
-        c.setFont("Helvetica-Bold", 14)
-        preco_formatado = br_moeda_safe(detalhes[6])
-        c.drawString(50, y, f"PREÇO: {preco_formatado}")
-        
-        # Rodapé
-        c.setFont("Helvetica", 10)
-        c.drawString(50, 50, "Sistema Motos Web - Recibo gerado automaticamente")
-        
-        # Salvar o PDF
-        c.save()
-        
-        # Verificar se o arquivo foi criado
-        if os.path.exists(nome_arquivo):
-            print(f"PDF gerado com sucesso: {nome_arquivo}")
-            return nome_arquivo
-        else:
-            print(f"Erro: PDF não foi criado em {nome_arquivo}")
-            return None
-            
-    except ImportError as e:
-        print(f"ReportLab não disponível, gerando HTML: {e}")
-        return gerar_html_recibo_por_venda_id(venda_id)
+        fp = _fingerprint_documento("recibo_venda", detalhes)
+        # detalhes: 0 moto_id, 1 marca, 2 modelo, 3 ano, 4 cor, 5 placa, 6 preço, 7 km,
+        #           8 vendedor, 9 data, 10 venda_id, 11 preço final
+
+        def desenhar(c):
+            # Título
+            c.setFont("Helvetica-Bold", 16)
+            c.drawString(50, 800, "RECIBO DE VENDA - SISTEMA MOTOS")
+
+            # Linha separadora
+            c.line(50, 790, 550, 790)
+
+            # Informações da venda
+            c.setFont("Helvetica", 12)
+            y = 760
+
+            c.drawString(50, y, f"Venda ID: {detalhes[10]}")
+            y -= 20
+            c.drawString(50, y, f"Data: {detalhes[9]}")
+            y -= 20
+            c.drawString(50, y, f"Vendedor: {detalhes[8]}")
+            y -= 30
+
+            # Informações da moto
+            c.setFont("Helvetica-Bold", 14)
+            c.drawString(50, y, "MOTOCICLETA:")
+            y -= 20
+            c.setFont("Helvetica", 12)
+            c.drawString(50, y, f"Marca: {detalhes[1]}")
+            y -= 20
+            c.drawString(50, y, f"Modelo: {detalhes[2]}")
+            y -= 20
+            c.drawString(50, y, f"Ano: {detalhes[3]}")
+            y -= 20
+            c.drawString(50, y, f"Cor: {detalhes[4]}")
+            y -= 20
+            c.drawString(50, y, f"KM: {br_km_safe(detalhes[7])}")
+            y -= 20
+
+            # Preço em destaque
+            c.setFont("Helvetica-Bold", 14)
+            preco_final = detalhes[11] if detalhes[11] is not None else detalhes[6]
+            c.drawString(50, y, f"PREÇO: {br_moeda_safe(preco_final)}")
+
+            # Rodapé
+            c.setFont("Helvetica", 10)
+            c.drawString(50, 50, "Sistema Motos Web - Recibo gerado automaticamente")
+
+        conteudo = _gerar_documento_memoria(f"recibo_venda_{venda_id}.pdf", fp, desenhar, persistir)
+        return conteudo, "application/pdf", fp
+
     except Exception as e:
         print(f"Erro ao gerar PDF, tentando HTML: {e}")
         return gerar_html_recibo_por_venda_id(venda_id)
@@ -1577,16 +2724,38 @@ def inserir_receita_financeira(categoria, data, valor):
     """Insere nova receita"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO receitas (categoria, adicionado_em, valor) VALUES (%s, %s, %s)", (categoria, data, valor))
-    conn.commit()
+    dt = parse_data_legada(data)
+    conn.start_transaction()
+    try:
+        cursor.execute(
+            "INSERT INTO receitas (categoria, adicionado_em, adicionado_em_dt, valor) VALUES (%s, %s, %s, %s)",
+            (categoria, data, dt.date() if dt else None, valor)
+        )
+        _incrementar_versoes(cursor, "receitas")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
 
 def inserir_gasto_financeiro(categoria, data, valor):
     """Insere novo gasto"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT INTO gastos (categoria, retirado_em, valor) VALUES (%s, %s, %s)", (categoria, data, valor))
-    conn.commit()
+    dt = parse_data_legada(data)
+    conn.start_transaction()
+    try:
+        cursor.execute(
+            "INSERT INTO gastos (categoria, retirado_em, retirado_em_dt, valor) VALUES (%s, %s, %s, %s)",
+            (categoria, data, dt.date() if dt else None, valor)
+        )
+        _incrementar_versoes(cursor, "gastos")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
 
 def ver_receitas_financeiras():
@@ -1600,15 +2769,19 @@ def ver_receitas_financeiras():
 
 def ver_receitas_financeiras_filtrado(periodo_ym: str):
     """Retorna receitas filtradas por mês (periodo_ym = 'YYYY-MM')."""
+    try:
+        inicio, fim = intervalo_mes(periodo_ym)
+    except ValueError:
+        return []
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
         SELECT * FROM receitas
-        WHERE DATE_FORMAT(STR_TO_DATE(adicionado_em, '%d/%m/%Y'), '%Y-%m') = %s
+        WHERE adicionado_em_dt >= %s AND adicionado_em_dt < %s
         ORDER BY id DESC
         """,
-        (periodo_ym,)
+        (inicio, fim)
     )
     receitas = cursor.fetchall()
     conn.close()
@@ -1625,15 +2798,19 @@ def ver_gastos_financeiros():
 
 def ver_gastos_financeiros_filtrado(periodo_ym: str):
     """Retorna gastos filtrados por mês (periodo_ym = 'YYYY-MM')."""
+    try:
+        inicio, fim = intervalo_mes(periodo_ym)
+    except ValueError:
+        return []
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
         SELECT * FROM gastos
-        WHERE DATE_FORMAT(STR_TO_DATE(retirado_em, '%d/%m/%Y'), '%Y-%m') = %s
+        WHERE retirado_em_dt >= %s AND retirado_em_dt < %s
         ORDER BY id DESC
         """,
-        (periodo_ym,)
+        (inicio, fim)
     )
     gastos = cursor.fetchall()
     conn.close()
@@ -1653,13 +2830,23 @@ def atualizar_receita_financeira(id_receita, data=None, valor=None, categoria=No
     if data:
         sets.append("adicionado_em = %s")
         params.append(data)
+        dt = parse_data_legada(data)
+        sets.append("adicionado_em_dt = %s")
+        params.append(dt.date() if dt else None)
     if valor is not None:
         sets.append("valor = %s")
         params.append(valor)
     query = "UPDATE receitas SET " + ", ".join(sets) + " WHERE id = %s"
     params.append(id_receita)
-    cursor.execute(query, params)
-    conn.commit()
+    conn.start_transaction()
+    try:
+        cursor.execute(query, params)
+        _incrementar_versoes(cursor, "receitas")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
     return True
 
@@ -1677,13 +2864,23 @@ def atualizar_gasto_financeiro(id_gasto, categoria=None, data=None, valor=None):
     if data:
         sets.append("retirado_em = %s")
         params.append(data)
+        dt = parse_data_legada(data)
+        sets.append("retirado_em_dt = %s")
+        params.append(dt.date() if dt else None)
     if valor is not None:
         sets.append("valor = %s")
         params.append(valor)
     query = "UPDATE gastos SET " + ", ".join(sets) + " WHERE id = %s"
     params.append(id_gasto)
-    cursor.execute(query, params)
-    conn.commit()
+    conn.start_transaction()
+    try:
+        cursor.execute(query, params)
+        _incrementar_versoes(cursor, "gastos")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
     return True
 
@@ -1691,16 +2888,30 @@ def deletar_receita_financeira(id_receita):
     """Deleta receita por ID"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM receitas WHERE id = %s", (id_receita,))
-    conn.commit()
+    conn.start_transaction()
+    try:
+        cursor.execute("DELETE FROM receitas WHERE id = %s", (id_receita,))
+        _incrementar_versoes(cursor, "receitas")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
 
 def deletar_gasto_financeiro(id_gasto):
     """Deleta gasto por ID"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM gastos WHERE id = %s", (id_gasto,))
-    conn.commit()
+    conn.start_transaction()
+    try:
+        cursor.execute("DELETE FROM gastos WHERE id = %s", (id_gasto,))
+        _incrementar_versoes(cursor, "gastos")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
     conn.close()
 
 def calcular_valores_financeiros():
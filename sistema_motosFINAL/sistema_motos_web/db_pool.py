@@ -0,0 +1,203 @@
+# Pool de conexões MySQL com health check no checkout e reciclagem de conexões ociosas
+import collections
+import os
+import threading
+import time
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+
+class PoolTimeoutError(PoolError):
+    """Nenhuma conexão ficou livre dentro do tempo de espera configurado."""
+
+
+class ConnectionPool:
+    """
+    Pool simples e thread-safe de conexões mysql.connector.
+
+    - `size`: número máximo de conexões abertas por processo
+    - `timeout`: segundos que um checkout espera por uma conexão livre
+    - `recycle`: conexões ociosas há mais de N segundos são fechadas e reabertas
+    - `ping_after`: conexões ociosas há mais de N segundos recebem um ping antes de serem entregues
+    """
+
+    def __init__(self, config: dict, size: int = 4, timeout: float = 10.0,
+                 recycle: float = 280.0, ping_after: float = 0.0):
+        self._config = dict(config)
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self.recycle = float(recycle)
+        self.ping_after = float(ping_after)
+        self._idle = collections.deque()  # (conexao, instante_da_devolucao)
+        self._abertas = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+            "wait_time_total": 0.0,
+        }
+
+    def _conectar(self):
+        conn = mysql.connector.connect(**self._config)
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _fechar_silencioso(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _verificar_fork(self):
+        # Após um fork (ex.: gunicorn --preload) as conexões herdadas não podem ser compartilhadas
+        if os.getpid() != self._pid:
+            self._idle.clear()
+            self._abertas = 0
+            self._pid = os.getpid()
+
+    def acquire(self):
+        """Retorna uma conexão saudável do pool, abrindo uma nova se houver vaga."""
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        conn, devolvida_em = None, None
+        with self._cond:
+            self._verificar_fork()
+            esperou = False
+            while True:
+                if self._idle:
+                    # LIFO: reaproveita a conexão mais quente
+                    conn, devolvida_em = self._idle.pop()
+                    break
+                if self._abertas < self.size:
+                    self._abertas += 1
+                    break
+                if not esperou:
+                    self._stats["waits"] += 1
+                    esperou = True
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"Tempo esgotado ({self.timeout:.1f}s) aguardando conexão livre no pool (tamanho {self.size})"
+                    )
+                self._cond.wait(restante)
+            self._stats["checkouts"] += 1
+            if esperou:
+                self._stats["wait_time_total"] += time.monotonic() - inicio
+
+        # Validação/abertura fora do lock para não bloquear as outras threads
+        try:
+            if conn is None:
+                return self._conectar()
+            ociosa = time.monotonic() - devolvida_em
+            if self.recycle and ociosa > self.recycle:
+                self._fechar_silencioso(conn)
+                with self._cond:
+                    self._stats["recycled"] += 1
+                return self._conectar()
+            if ociosa >= self.ping_after:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._fechar_silencioso(conn)
+                    with self._cond:
+                        self._stats["health_check_failures"] += 1
+                    return self._conectar()
+            return conn
+        except Exception:
+            # Falha ao abrir: libera a vaga reservada
+            with self._cond:
+                self._abertas -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, descartar: bool = False):
+        """Devolve a conexão ao pool (ou a descarta se estiver quebrada)."""
+        if not descartar:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                descartar = True
+        with self._cond:
+            if os.getpid() != self._pid:
+                return
+            if descartar:
+                self._fechar_silencioso(conn)
+                self._abertas -= 1
+                self._stats["discarded"] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            dados = dict(self._stats)
+            dados.update({
+                "size": self.size,
+                "open": self._abertas,
+                "idle": len(self._idle),
+                "in_use": self._abertas - len(self._idle),
+            })
+        return dados
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._fechar_silencioso(conn)
+                self._abertas -= 1
+            self._cond.notify_all()
+
+
+class PooledConnection:
+    """
+    Envelope da conexão emprestada do pool.
+
+    Delegamos tudo para a conexão real; apenas `close()` muda de comportamento:
+    devolve a conexão ao pool, ou não faz nada quando a conexão pertence à requisição
+    Flask atual (nesse caso quem devolve é o teardown da requisição).
+    """
+
+    def __init__(self, pool: ConnectionPool, raw, escopo_requisicao: bool = False):
+        self._pool = pool
+        self._raw = raw
+        self._escopo_requisicao = escopo_requisicao
+        self._devolvida = False
+
+    def __getattr__(self, nome):
+        return getattr(self._raw, nome)
+
+    def close(self):
+        if self._escopo_requisicao:
+            return
+        self.devolver()
+
+    def devolver(self):
+        if self._devolvida:
+            return
+        self._devolvida = True
+        self._pool.release(self._raw)
+
+    def descartar(self):
+        """Fecha a conexão em vez de devolvê-la (ex.: resultado sem buffer lido pela metade)."""
+        if self._devolvida:
+            return
+        self._devolvida = True
+        self._pool.release(self._raw, descartar=True)
+
+    def __del__(self):
+        # Rede de segurança para funções que esquecem conn.close() fora de uma requisição
+        try:
+            if not self._devolvida:
+                self.devolver()
+        except Exception:
+            pass
@@ -0,0 +1,74 @@
+# Otimização de documentos digitalizados (CNH, comprovantes, documentos de fornecedor, garantias)
+#
+# Fotos de papel tiradas no celular chegam com 5–10 MB; para leitura basta bem menos. Na gravação
+# do upload as imagens são reduzidas a uma resolução legível, recomprimidas em JPEG sem EXIF
+# (localização/aparelho) e, opcionalmente, embrulhadas em um PDF de uma página.
+# Outros formatos (PDF, DOC...) são gravados como vieram. O nome final é o hash do conteúdo
+# gravado (ver armazenamento.py).
+import io
+import os
+
+import armazenamento
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+OTIMIZAR = os.environ.get("OTIMIZAR_DOCUMENTOS", "1") == "1"
+GERAR_PDF = os.environ.get("DOCUMENTOS_EM_PDF", "0") == "1"
+# Maior lado em pixels: ~200 dpi de uma folha A5/CNH, o suficiente para ler letras miúdas
+LADO_MAX = int(os.environ.get("DOCUMENTOS_LADO_MAX", "2000"))
+QUALIDADE = int(os.environ.get("DOCUMENTOS_QUALIDADE", "72"))
+
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.heic')
+
+
+def _otimizar_imagem(dados):
+    """Retorna (bytes, extensão) da imagem otimizada, ou None se não for uma imagem legível."""
+    try:
+        with Image.open(io.BytesIO(dados)) as arquivo:
+            arquivo.draft("RGB", (LADO_MAX, LADO_MAX))
+            img = ImageOps.exif_transpose(arquivo)
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                fundo = Image.new("RGB", img.size, (255, 255, 255))
+                fundo.paste(img, mask=img.getchannel("A"))
+                img = fundo
+            else:
+                img = img.convert("RGB")
+    except Exception:
+        return None
+    img.thumbnail((LADO_MAX, LADO_MAX), Image.LANCZOS)
+    saida = io.BytesIO()
+    # Sem exif=...: o Pillow não copia metadados do original
+    if GERAR_PDF:
+        img.save(saida, "PDF", resolution=200.0, quality=QUALIDADE)
+        return saida.getvalue(), ".pdf"
+    img.save(saida, "JPEG", quality=QUALIDADE, optimize=True, progressive=True)
+    return saida.getvalue(), ".jpg"
+
+
+def gravar(file_storage, pasta, ext):
+    """
+    Grava o upload em `pasta` no armazenamento por conteúdo e retorna
+    (nome_do_arquivo, tamanho_original, tamanho_gravado, otimizado).
+
+    Imagens passam pela otimização (quando habilitada) e podem mudar de extensão (.jpg/.pdf);
+    os demais arquivos são copiados em blocos, sem carregar tudo em memória.
+    """
+    ext = (ext or "").lower()
+    if not (OTIMIZAR and Image is not None and ext in EXTENSOES_IMAGEM):
+        nome, tamanho, _novo = armazenamento.gravar_stream(file_storage.stream, pasta, ext)
+        return nome, tamanho, tamanho, False
+    dados = file_storage.read()
+    original = len(dados)
+    otimizado = _otimizar_imagem(dados)
+    # Recompressão que não ganha nada: fica o original (exceto JPEG com EXIF, que é removido)
+    if otimizado and len(otimizado[0]) >= original and b"Exif" not in dados[:64 * 1024]:
+        otimizado = None
+    if otimizado:
+        dados, ext = otimizado
+    nome, tamanho, _novo = armazenamento.gravar_bytes(dados, pasta, ext)
+    return nome, original, tamanho, otimizado is not None
@@ -0,0 +1,218 @@
+# Fila local de geração de documentos (garantia/procuração) em um pool de processos
+#
+# A requisição só registra o job em `documentos_jobs` e devolve um link pendente; o PDF é
+# renderizado em outro processo (o reportlab não segura as threads do gunicorn) e o status
+# fica no banco, visível para qualquer worker que receba o polling.
+#
+# O pool e os timers de nova tentativa vivem na memória do worker: se ele reinicia, o job fica
+# 'pendente' no banco. Uma verificação periódica (iniciar_recuperacao) reagenda os pendentes
+# parados há mais de DOC_JOBS_TIMEOUT segundos, ou marca erro se já esgotaram as tentativas.
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import database
+
+TIPOS_DOCUMENTO = ("garantia", "procuracao")
+MAX_TENTATIVAS = int(os.environ.get("DOC_JOBS_TENTATIVAS", "3"))
+PROCESSOS = int(os.environ.get("DOC_JOBS_PROCESSOS", "2"))
+TIMEOUT_PENDENTE = int(os.environ.get("DOC_JOBS_TIMEOUT", "300"))  # segundos sem atualização
+INTERVALO_VERIFICACAO = float(os.environ.get("DOC_JOBS_VERIFICACAO", "60"))  # segundos
+_LOCK_RECUPERACAO = "sistema_motos_doc_jobs_recuperacao"
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _renderizar(tipo, moto_id, venda_id):
+    """Executa no processo filho: gera o PDF e retorna o nome do arquivo em static/."""
+    import database as db
+    if tipo == "garantia":
+        caminho = db.gerar_pdf_garantia(moto_id, venda_id=venda_id)
+    elif tipo == "procuracao":
+        caminho = db.gerar_pdf_procuracao(moto_id, venda_id=venda_id)
+    else:
+        raise ValueError(f"Tipo de documento desconhecido: {tipo}")
+    if not caminho:
+        raise RuntimeError(f"{tipo} não gerada para a moto {moto_id}")
+    return os.path.basename(caminho)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Cada worker do gunicorn tem seu próprio pool (não reaproveitar o herdado no fork)
+        if _executor is None or _executor_pid != os.getpid():
+            # spawn: fazer fork de um worker com várias threads pode herdar locks travados
+            _executor = ProcessPoolExecutor(max_workers=max(1, PROCESSOS),
+                                            mp_context=multiprocessing.get_context("spawn"))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _descartar_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _submeter(job_id, tipo, moto_id, venda_id, tentativa):
+    try:
+        futuro = _get_executor().submit(_renderizar, tipo, moto_id, venda_id)
+    except BrokenProcessPool:
+        _descartar_executor()
+        futuro = _get_executor().submit(_renderizar, tipo, moto_id, venda_id)
+    futuro.add_done_callback(lambda f: _concluir(f, job_id, tipo, moto_id, venda_id, tentativa))
+
+
+def _concluir(futuro, job_id, tipo, moto_id, venda_id, tentativa):
+    """Callback (thread do executor): grava o resultado ou agenda nova tentativa."""
+    try:
+        arquivo = futuro.result()
+        database.atualizar_job_documento(job_id, "pronto", tentativas=tentativa, arquivo=arquivo)
+        return
+    except Exception as e:
+        erro = str(e) or e.__class__.__name__
+        if isinstance(e, BrokenProcessPool):
+            _descartar_executor()
+    if tentativa < MAX_TENTATIVAS:
+        print(f"Aviso: job de documento {job_id} falhou (tentativa {tentativa}): {erro}; tentando de novo.")
+        database.atualizar_job_documento(job_id, "pendente", tentativas=tentativa, erro=erro)
+        # Espera crescente entre tentativas (2s, 4s, ...)
+        t = threading.Timer(2 ** tentativa, _submeter, args=(job_id, tipo, moto_id, venda_id, tentativa + 1))
+        t.daemon = True
+        t.start()
+    else:
+        print(f"Erro: job de documento {job_id} ({tipo} da moto {moto_id}) falhou: {erro}")
+        database.atualizar_job_documento(job_id, "erro", tentativas=tentativa, erro=erro)
+
+
+def enfileirar(tipo, moto_id, venda_id=None):
+    """Registra e agenda a geração do documento; retorna o id do job."""
+    if tipo not in TIPOS_DOCUMENTO:
+        raise ValueError(f"Tipo de documento desconhecido: {tipo}")
+    job_id = database.criar_job_documento(tipo, moto_id, venda_id)
+    try:
+        _submeter(job_id, tipo, moto_id, venda_id, 1)
+    except Exception as e:
+        print(f"Erro ao agendar job de documento {job_id}: {e}")
+        database.atualizar_job_documento(job_id, "erro", erro=str(e))
+    return job_id
+
+
+def recuperar_pendentes(timeout=None):
+    """
+    Reagenda os jobs 'pendente' parados há mais de `timeout` segundos (padrão DOC_JOBS_TIMEOUT);
+    os que já usaram todas as tentativas passam a 'erro'. Retorna (reagendados, com_erro).
+    """
+    reagendados = com_erro = 0
+    for job_id, tipo, moto_id, venda_id, tentativas in \
+            database.reivindicar_jobs_documentos_parados(timeout or TIMEOUT_PENDENTE):
+        tentativa = (tentativas or 0) + 1
+        if tentativa > MAX_TENTATIVAS:
+            database.atualizar_job_documento(job_id, "erro", erro="interrompido: o processo que gerava o documento parou")
+            com_erro += 1
+            continue
+        try:
+            _submeter(job_id, tipo, moto_id, venda_id, tentativa)
+            reagendados += 1
+        except Exception as e:
+            print(f"Erro ao reagendar job de documento {job_id}: {e}")
+            database.atualizar_job_documento(job_id, "erro", erro=str(e))
+            com_erro += 1
+    return reagendados, com_erro
+
+
+def iniciar_recuperacao(intervalo=None):
+    """
+    Thread de fundo: recupera os jobs parados ao subir o worker e depois a cada `intervalo`
+    segundos. Um lock nomeado no MySQL deixa só um processo do gunicorn fazer cada rodada.
+    """
+    intervalo = intervalo or INTERVALO_VERIFICACAO
+
+    def _loop():
+        while True:
+            try:
+                executou, resultado = database.executar_com_lock(_LOCK_RECUPERACAO, recuperar_pendentes)
+                if executou and any(resultado):
+                    print(f"Jobs de documento parados: {resultado[0]} reagendado(s), {resultado[1]} com erro.")
+            except Exception as e:
+                print(f"Aviso: falha ao recuperar jobs de documento pendentes: {e}")
+            time.sleep(intervalo)
+
+    t = threading.Thread(target=_loop, name="doc-jobs-recuperacao", daemon=True)
+    t.start()
+    return t
+
+
+# Geração em lote (reimpressão de fim de mês): um pool dedicado com um processo por núcleo
+def renderizar_lote(tipos, moto_ids, processos=None):
+    """
+    Gera os documentos de várias motos em paralelo.
+
+    Produz (moto_id, tipo, caminho ou None) na ordem de `moto_ids`/`tipos`, à medida que
+    ficam prontos. Documentos cujo conteúdo não mudou saem direto do cache de documentos.
+    """
+    tarefas = [(moto_id, tipo) for moto_id in moto_ids for tipo in tipos]
+    if not tarefas:
+        return
+    for tipo in tipos:
+        if tipo not in TIPOS_DOCUMENTO:
+            raise ValueError(f"Tipo de documento desconhecido: {tipo}")
+    processos = processos or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(processos, len(tarefas)),
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        futuros = [executor.submit(_renderizar, tipo, moto_id, None) for moto_id, tipo in tarefas]
+        for (moto_id, tipo), futuro in zip(tarefas, futuros):
+            try:
+                arquivo = futuro.result()
+                yield moto_id, tipo, os.path.join(database._STATIC_ABS, arquivo)
+            except Exception as e:
+                print(f"Aviso: {tipo} da moto {moto_id} não gerada no lote: {e}")
+                yield moto_id, tipo, None
+
+
+class _SaidaZip:
+    """Destino não-seekable do ZipFile: acumula só o trecho escrito desde a última leitura."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def drenar(self):
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def zip_lote(tipos, moto_ids, processos=None):
+    """
+    Gera um ZIP com os documentos das motos, em pedaços de bytes (para resposta em streaming
+    ou gravação em arquivo). Cada PDF entra no ZIP assim que fica pronto; o ZIP nunca fica
+    inteiro em memória. Falhas vão listadas em ERROS.txt no final.
+    """
+    import zipfile
+    saida = _SaidaZip()
+    erros = []
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for moto_id, tipo, caminho in renderizar_lote(tipos, moto_ids, processos):
+            if caminho:
+                zf.write(caminho, arcname=f"{tipo}_moto_{moto_id}.pdf")
+            else:
+                erros.append(f"{tipo} da moto {moto_id}")
+            yield saida.drenar()
+        if erros:
+            zf.writestr("ERROS.txt", "Documentos não gerados:\n" + "\n".join(erros) + "\n")
+    yield saida.drenar()
@@ -0,0 +1,278 @@
+# Exportações em streaming (CSV e XLSX) com cache por versão das tabelas
+#
+# As linhas chegam de um gerador (database.iterar_consulta lê o banco em lotes) e nunca ficam
+# todas em memória. O CSV é escrito bloco a bloco e o XLSX pelo openpyxl em modo write-only
+# (as linhas vão para disco conforme chegam).
+#
+# O arquivo gerado fica em static/exports com o contador de alterações das tabelas de origem no
+# nome (database.versoes_tabelas): enquanto nada muda, os cliques seguintes recebem o mesmo
+# arquivo (com ETag, 304 no navegador). O arquivo é aberto antes de a resposta sair, então a
+# troca por uma versão mais nova não derruba um download em andamento.
+#
+# XLSX: só pode ser enviado depois de completo, então um lock nomeado do MySQL garante que só
+# uma requisição (de qualquer processo) gera cada versão; as outras esperam e usam o resultado.
+# CSV: na primeira requisição de uma versão os blocos vão para o cliente enquanto são gravados
+# no cache (sem esperar o arquivo inteiro). A geração é reivindicada com um marcador criado com
+# O_EXCL ao lado do arquivo: só quem o criou lê o banco; as outras requisições esperam o arquivo
+# publicado (e, se a espera estourar, recebem o CSV direto do banco sem gravar outro cache).
+#
+# Com ARMAZENAMENTO=s3 cada versão pronta também vai para o bucket ('exports/<nome>'), com as
+# anteriores apagadas de lá: as instâncias compartilham o cache e o download sai do bucket por
+# URL pré-assinada (ver `chave_armazenamento`). O marcador do CSV vale por instância.
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+import armazenamento
+import database
+
+MIMETYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+TAMANHO_BLOCO = 64 * 1024
+PASTA_CACHE = os.path.join(database._STATIC_ABS, "exports")
+ESPERA_LOCK = 120  # segundos esperando outra requisição terminar a mesma exportação
+INTERVALO_ESPERA = 0.25  # segundos entre as conferências de quem espera o CSV em geração
+
+
+def gerar_csv(cabecalho, linhas, separador=";"):
+    """
+    Produz o CSV em blocos de bytes (UTF-8 com BOM e ';' para abrir direto no Excel em português).
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=separador)
+    buffer.write("\ufeff")
+    escritor.writerow(cabecalho)
+    for linha in linhas:
+        escritor.writerow(["" if v is None else v for v in linha])
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def gravar_xlsx(cabecalho, linhas, destino, titulo="Planilha"):
+    """Grava as linhas em `destino` (caminho ou arquivo aberto) com o openpyxl em modo write-only."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo[:31])
+    ws.append(list(cabecalho))
+    for linha in linhas:
+        ws.append(list(linha))
+    wb.save(destino)
+
+
+def xlsx_temporario(cabecalho, linhas, titulo="Planilha"):
+    """XLSX em um arquivo temporário anônimo (some do disco ao ser fechado), posicionado no início."""
+    arquivo = tempfile.TemporaryFile(suffix=".xlsx")
+    try:
+        gravar_xlsx(cabecalho, linhas, arquivo, titulo)
+    except BaseException:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
+
+
+def _identificar(nome_base, parametros, versoes, ext):
+    """(assinatura da variação, prefixo dos arquivos dela, caminho da versão atual, etag)."""
+    assinatura = hashlib.sha256(repr((parametros, database.VERSAO_ESQUEMA)).encode()).hexdigest()[:12]
+    prefixo = f"{nome_base}_{assinatura}_v"
+    versao = "-".join(str(v) for v in versoes)
+    return assinatura, prefixo, os.path.join(PASTA_CACHE, f"{prefixo}{versao}.{ext}"), f"{assinatura}-{versao}"
+
+
+def _versoes_no_nome(nome, prefixo, ext):
+    """Versões gravadas no nome ('{prefixo}3-7.{ext}' -> (3, 7)); None se não é dessa variação."""
+    if not (nome.startswith(prefixo) and nome.endswith(f".{ext}")):
+        return None
+    try:
+        return tuple(int(v) for v in nome[len(prefixo):-len(ext) - 1].split("-"))
+    except ValueError:
+        return None
+
+
+def _chave(caminho):
+    return f"exports/{os.path.basename(caminho)}"
+
+
+def chave_armazenamento(nome_base, parametros, versoes, ext):
+    """Chave da versão no backend de armazenamento ('exports/<nome>')."""
+    return _chave(_identificar(nome_base, parametros, versoes, ext)[2])
+
+
+def _remover_versoes_antigas(prefixo, ext, versoes):
+    """
+    Apaga os arquivos da variação com versões anteriores a `versoes` (nenhum contador maior),
+    no disco e no backend remoto. Uma requisição atrasada que gera uma versão velha não apaga
+    a mais nova.
+    """
+    atual = tuple(versoes)
+
+    def _antiga(nome):
+        outra = _versoes_no_nome(nome, prefixo, ext)
+        if outra is None or len(outra) != len(atual) or outra == atual:
+            return False
+        return all(o <= a for o, a in zip(outra, atual))
+
+    with os.scandir(PASTA_CACHE) as it:
+        for entrada in it:
+            if _antiga(entrada.name):
+                try:
+                    os.remove(entrada.path)
+                except OSError:
+                    continue
+    for chave in armazenamento.chaves_remotas(f"exports/{prefixo}"):
+        if _antiga(chave[len("exports/"):]):
+            try:
+                armazenamento.remover(chave)
+            except Exception as e:
+                print(f"Aviso: falha ao remover {chave} do armazenamento: {e}")
+
+
+def _publicar(caminho, prefixo, ext, versoes):
+    """Envia a versão recém-gerada ao backend remoto e apaga as anteriores."""
+    try:
+        armazenamento.publicar(caminho, _chave(caminho))
+    except Exception as e:
+        # O arquivo local continua servindo esta instância
+        print(f"Aviso: exportação {os.path.basename(caminho)} não enviada ao armazenamento: {e}")
+    _remover_versoes_antigas(prefixo, ext, versoes)
+
+
+def _abrir(caminho):
+    try:
+        return open(caminho, "rb")
+    except FileNotFoundError:
+        return None
+
+
+def em_cache(nome_base, parametros, versoes, ext, gravar):
+    """
+    Arquivo da exportação para as `versoes` atuais das tabelas, gerando-o se preciso.
+
+    `parametros` identifica a variação da exportação (colunas, formato); `gravar(destino)`
+    escreve o arquivo. Retorna (arquivo aberto para leitura, etag), ou (None, etag) se outra
+    instância publicou a versão no backend remoto enquanto esta esperava o lock. Versões
+    anteriores da mesma variação são apagadas.
+    """
+    assinatura, prefixo, caminho, etag = _identificar(nome_base, parametros, versoes, ext)
+    arquivo = _abrir(caminho)
+    if arquivo is not None:
+        return arquivo, etag
+
+    def _gerar():
+        # Quem esperou o lock encontra o arquivo pronto (aqui ou no bucket)
+        arquivo = _abrir(caminho)
+        if arquivo is None and armazenamento.existe_remoto(_chave(caminho), confirmar=True):
+            return None
+        if arquivo is None:
+            os.makedirs(PASTA_CACHE, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=PASTA_CACHE)
+            os.close(fd)
+            try:
+                gravar(tmp)
+                os.replace(tmp, caminho)
+            except BaseException:
+                os.remove(tmp)
+                raise
+            arquivo = open(caminho, "rb")
+            _publicar(caminho, prefixo, ext, versoes)
+        return arquivo
+
+    executou, arquivo = database.executar_com_lock(f"sistema_motos_exportacao_{assinatura}", _gerar,
+                                                   espera=ESPERA_LOCK)
+    if not executou:
+        # Lock preso além da espera: gera por conta própria (a troca do arquivo é atômica)
+        arquivo = _gerar()
+    return arquivo, etag
+
+
+def _reivindicar(marcador):
+    """
+    True se esta requisição ficou com a geração (criou o `marcador`). Um marcador sem
+    atualização há mais de ESPERA_LOCK segundos é de uma geração abandonada (processo que
+    morreu no meio) e é substituído.
+    """
+    for _tentativa in range(2):
+        try:
+            os.close(os.open(marcador, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(marcador) <= ESPERA_LOCK:
+                    return False
+                os.remove(marcador)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+class _GravacaoCsv:
+    """
+    Corpo da resposta de quem gera o CSV: envia os blocos e grava a mesma saída no cache.
+    O arquivo só é publicado se a geração chegar ao fim (download cancelado não deixa CSV
+    cortado). `close()`, chamado pelo servidor ao fim da resposta (mesmo cancelada antes do
+    primeiro bloco), libera o marcador.
+    """
+
+    def __init__(self, caminho, marcador, prefixo, versoes, blocos):
+        self.caminho = caminho
+        self.marcador = marcador
+        self.prefixo = prefixo
+        self.versoes = versoes
+        self.blocos = blocos
+
+    def __iter__(self):
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=PASTA_CACHE)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for bloco in self.blocos:
+                    f.write(bloco)
+                    # Marcador renovado: download longo não parece geração abandonada
+                    os.utime(self.marcador, None)
+                    yield bloco
+            os.replace(tmp, self.caminho)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        _publicar(self.caminho, self.prefixo, "csv", self.versoes)
+
+    def close(self):
+        try:
+            os.remove(self.marcador)
+        except FileNotFoundError:
+            pass
+
+
+def csv_em_cache(nome_base, parametros, versoes, cabecalho, linhas, separador=";"):
+    """
+    CSV das `versoes` atuais, gerado uma única vez por versão.
+
+    Retorna (arquivo, blocos, etag), com só um dos dois preenchido: `arquivo` é o cache pronto,
+    aberto para leitura; `blocos` é o corpo da resposta quando esta requisição gera a versão
+    (ou, se a geração de outra requisição passou de ESPERA_LOCK, o CSV direto do banco, sem
+    gravar cache). `linhas()` só é chamada quando os blocos vêm do banco.
+    """
+    _assinatura, prefixo, caminho, etag = _identificar(nome_base, parametros, versoes, "csv")
+    marcador = f"{caminho}.gerando"
+    os.makedirs(PASTA_CACHE, exist_ok=True)
+    limite = time.monotonic() + ESPERA_LOCK
+    while True:
+        arquivo = _abrir(caminho)
+        if arquivo is not None:
+            return arquivo, None, etag
+        if _reivindicar(marcador):
+            # Outra geração pode ter publicado entre a conferência e o marcador
+            arquivo = _abrir(caminho)
+            if arquivo is not None:
+                os.remove(marcador)
+                return arquivo, None, etag
+            blocos = gerar_csv(cabecalho, linhas(), separador)
+            return None, _GravacaoCsv(caminho, marcador, prefixo, versoes, blocos), etag
+        if time.monotonic() >= limite:
+            return None, gerar_csv(cabecalho, linhas(), separador), etag
+        time.sleep(INTERVALO_ESPERA)
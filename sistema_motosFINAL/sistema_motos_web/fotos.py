@@ -0,0 +1,129 @@
+# Derivados das fotos das motos: miniaturas da listagem e tamanho de detalhe, em JPEG e WebP
+#
+# O upload grava só o original; os derivados são gerados em uma thread separada (a requisição
+# não espera o Pillow) e ficam em static/uploads/derivados com a versão da foto no nome, então
+# uma foto nova nunca reaproveita miniaturas antigas em cache no navegador.
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import armazenamento
+import database
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Sem Pillow as listagens continuam usando a foto original
+    Image = None
+    ImageOps = None
+
+PASTA_UPLOADS = os.path.join(database._STATIC_ABS, "uploads")
+PASTA_DERIVADOS = os.path.join(PASTA_UPLOADS, "derivados")
+
+# (nome, (largura máx., altura máx.)): 'p'/'m' são a miniatura da listagem (48px de altura) em 1x/2x,
+# 'g' é o tamanho de detalhe aberto pelo link da foto
+TAMANHOS = (
+    ("p", (320, 48)),
+    ("m", (640, 96)),
+    ("g", (1280, 1280)),
+)
+FORMATOS = (
+    ("jpg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+    ("webp", "WEBP", {"quality": 78, "method": 4}),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def nome_derivado(moto_id, versao, tamanho, ext):
+    return f"foto_moto_{moto_id}_v{versao or 0}_{tamanho}.{ext}"
+
+
+def _abrir_rgb(caminho):
+    with Image.open(caminho) as arquivo:
+        # JPEG: decodifica já reduzido (bem mais rápido para fotos de celular de vários MB)
+        arquivo.draft("RGB", TAMANHOS[-1][1])
+        img = ImageOps.exif_transpose(arquivo)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            fundo = Image.new("RGB", img.size, (255, 255, 255))
+            fundo.paste(img, mask=img.getchannel("A"))
+            return fundo
+        return img.convert("RGB")
+
+
+def gerar_derivados(moto_id, foto, versao, refazer=False):
+    """
+    Gera os derivados da foto `foto` (nome em static/uploads) e apaga os de versões anteriores.
+
+    Retorna (gravados, removidos) com os nomes dos arquivos em static/uploads/derivados.
+    Derivados já existentes só são refeitos com `refazer=True`.
+    """
+    if Image is None:
+        return [], []
+    os.makedirs(PASTA_DERIVADOS, exist_ok=True)
+    pendentes = [
+        (tamanho, caixa, ext, formato, opcoes)
+        for tamanho, caixa in TAMANHOS
+        for ext, formato, opcoes in FORMATOS
+        if refazer or not os.path.exists(os.path.join(PASTA_DERIVADOS, nome_derivado(moto_id, versao, tamanho, ext)))
+    ]
+    gravados = []
+    if pendentes:
+        with _abrir_rgb(os.path.join(PASTA_UPLOADS, foto)) as original:
+            for tamanho, caixa, ext, formato, opcoes in pendentes:
+                nome = nome_derivado(moto_id, versao, tamanho, ext)
+                destino = os.path.join(PASTA_DERIVADOS, nome)
+                img = original.copy()
+                img.thumbnail(caixa, Image.LANCZOS)  # nunca amplia
+                tmp = database._caminho_temporario(destino)
+                img.save(tmp, formato, **opcoes)
+                os.replace(tmp, destino)
+                armazenamento.publicar(destino, f"uploads/derivados/{nome}")
+                gravados.append(nome)
+
+    removidos = []
+    prefixo, atual = f"foto_moto_{moto_id}_v", f"foto_moto_{moto_id}_v{versao or 0}_"
+    with os.scandir(PASTA_DERIVADOS) as it:
+        for entrada in it:
+            if entrada.name.startswith(prefixo) and not entrada.name.startswith(atual):
+                try:
+                    os.remove(entrada.path)
+                    removidos.append(entrada.name)
+                except OSError:
+                    continue
+                armazenamento.remover(f"uploads/derivados/{entrada.name}")
+    return gravados, removidos
+
+
+def processar_moto(moto_id, indice=None, refazer=False):
+    """Gera os derivados da foto atual da moto (lida do banco) e atualiza o índice de arquivos."""
+    dados = database.buscar_foto_moto(moto_id)
+    if not dados or not dados[0]:
+        return [], []
+    gravados, removidos = gerar_derivados(moto_id, dados[0], dados[1], refazer=refazer)
+    if indice is not None:
+        for nome in gravados:
+            indice.registrar(f"uploads/derivados/{nome}")
+        for nome in removidos:
+            indice.remover(f"uploads/derivados/{nome}")
+    return gravados, removidos
+
+
+def _executar(moto_id, indice):
+    try:
+        processar_moto(moto_id, indice)
+    except Exception as e:
+        print(f"Aviso: falha ao gerar miniaturas da foto da moto {moto_id}: {e}")
+
+
+def agendar(moto_id, indice=None):
+    """Gera os derivados em segundo plano (chamar depois do commit que gravou motos.foto)."""
+    global _executor
+    if Image is None:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fotos")
+    _executor.submit(_executar, moto_id, indice)
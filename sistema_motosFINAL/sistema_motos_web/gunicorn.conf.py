@@ -0,0 +1,17 @@
+# Configuração do gunicorn: as migrações do banco rodam uma única vez no processo master,
+# antes do fork dos workers (que só conferem a versão do esquema ao subir).
+import os
+import sys
+
+
+def on_starting(server):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import database
+    try:
+        versao = database.aplicar_migracoes()
+        server.log.info("Esquema do banco na versão %s", versao)
+    except Exception as e:
+        server.log.error("Falha ao aplicar migrações: %s", e)
+    finally:
+        # Não deixar conexões abertas no master para serem herdadas pelos workers
+        database.fechar_pool()
@@ -0,0 +1,178 @@
+# Indicadores do painel (estoque, vendas do mês, vendas por vendedor, financeiro do mês) em cache
+#
+# Cada valor é guardado junto com as versões das tabelas de que depende (database.versoes_tabelas).
+# Toda escrita em motos/vendas/receitas/gastos incrementa o contador da tabela na mesma transação,
+# então a leitura seguinte, em qualquer worker ou instância, já procura outra chave e recalcula:
+# a invalidação acontece na escrita, sem avisar os outros processos. Conferir as versões é uma
+# consulta por chave primária, bem mais barata que as agregações. O TTL limita a vida de valores
+# alterados por fora da aplicação (SQL manual).
+#
+# Cache local: LRU por processo. Com KPI_CACHE_URL=redis://... os processos também compartilham
+# os valores calculados (pacote redis opcional); o cache local continua na frente. Se o cache
+# compartilhado não pode ser criado (sem o pacote, URL inválida), fica desligado no processo;
+# depois de um erro de rede, fica KPI_CACHE_PAUSA segundos sem ser consultado, para o painel
+# não pagar o timeout a cada indicador enquanto o Redis está fora.
+import datetime
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+import database
+
+KPI_TTL = float(os.environ.get("KPI_TTL", "300"))  # segundos
+KPI_MAXIMO = 256  # entradas no cache local
+KPI_CACHE_PAUSA = float(os.environ.get("KPI_CACHE_PAUSA", "30"))  # segundos sem o compartilhado após erro
+
+
+class CacheLRU:
+    """Cache em memória do processo: no máximo `maximo` entradas, cada uma válida por `ttl` segundos."""
+
+    def __init__(self, maximo=KPI_MAXIMO, ttl=KPI_TTL):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        """(True, valor) se a chave está no cache e dentro do TTL; senão (False, None)."""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return False, None
+            if time.monotonic() - item[0] >= self.ttl:
+                del self._itens[chave]
+                return False, None
+            self._itens.move_to_end(chave)
+            return True, item[1]
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = (time.monotonic(), valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+
+class CacheRedis:
+    """Cache compartilhado entre processos/instâncias (valores em JSON, expiração pelo próprio Redis)."""
+
+    PREFIXO = "sistema_motos:kpi:"
+
+    def __init__(self, url, ttl=KPI_TTL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("KPI_CACHE_URL requer o pacote redis") from e
+        self.ttl = max(int(ttl), 1)
+        # Timeout curto: com o Redis fora do ar o painel só perde o cache compartilhado
+        self._cliente = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def obter(self, chave):
+        valor = self._cliente.get(self.PREFIXO + chave)
+        if valor is None:
+            return False, None
+        return True, json.loads(valor)
+
+    def guardar(self, chave, valor):
+        self._cliente.setex(self.PREFIXO + chave, self.ttl, json.dumps(valor))
+
+
+_local = CacheLRU()
+_compartilhado = None
+_compartilhado_desligado = False  # criação falhou: não tenta de novo neste processo
+_compartilhado_pausa_ate = 0.0  # time.monotonic() até quando não consultar após um erro
+_compartilhado_lock = threading.Lock()
+
+
+def _cache_compartilhado():
+    global _compartilhado, _compartilhado_desligado
+    url = os.environ.get("KPI_CACHE_URL")
+    if not url or _compartilhado_desligado or time.monotonic() < _compartilhado_pausa_ate:
+        return None
+    if _compartilhado is None:
+        with _compartilhado_lock:
+            if _compartilhado is None and not _compartilhado_desligado:
+                try:
+                    _compartilhado = CacheRedis(url)
+                except Exception as e:
+                    print(f"Aviso: cache compartilhado de indicadores desligado: {e}")
+                    _compartilhado_desligado = True
+    return _compartilhado
+
+
+def _falha_compartilhado(e):
+    """Erro de rede no cache compartilhado: avisa uma vez e pausa as consultas por KPI_CACHE_PAUSA."""
+    global _compartilhado_pausa_ate
+    with _compartilhado_lock:
+        if time.monotonic() < _compartilhado_pausa_ate:
+            return
+        _compartilhado_pausa_ate = time.monotonic() + KPI_CACHE_PAUSA
+    print(f"Aviso: cache compartilhado de indicadores indisponível ({e}); "
+          f"usando só o cache local por {KPI_CACHE_PAUSA:.0f}s.")
+
+
+def _normalizar(valor):
+    # Mesmo formato no cache local e no compartilhado (JSON): listas e números float
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (list, tuple)):
+        return [_normalizar(v) for v in valor]
+    return valor
+
+
+def _obter(nome, tabelas, calcular, *args):
+    versoes = database.versoes_tabelas(*tabelas)
+    chave = f"{nome}:{':'.join(str(a) for a in args)}:{'-'.join(str(v) for v in versoes)}"
+    achou, valor = _local.obter(chave)
+    if achou:
+        return valor
+    compartilhado = _cache_compartilhado()
+    if compartilhado is not None:
+        try:
+            achou, valor = compartilhado.obter(chave)
+            if achou:
+                _local.guardar(chave, valor)
+                return valor
+        except Exception as e:
+            _falha_compartilhado(e)
+            compartilhado = None
+    valor = _normalizar(calcular(*args))
+    _local.guardar(chave, valor)
+    if compartilhado is not None:
+        try:
+            compartilhado.guardar(chave, valor)
+        except Exception as e:
+            _falha_compartilhado(e)
+    return valor
+
+
+def _mes_atual():
+    return datetime.date.today().strftime("%Y-%m")
+
+
+def estoque():
+    """[quantidade, valor] das motos em estoque (disponíveis e consignadas, placas deduplicadas)."""
+    return _obter("estoque", ("motos",), database.get_stats_estoque)
+
+
+def vendas_mes(periodo_ym=None):
+    """[quantidade, valor] das vendas do mês (padrão: mês corrente)."""
+    return _obter("vendas_mes", ("motos", "vendas"), database.get_stats_vendas_mes, periodo_ym or _mes_atual())
+
+
+def financeiro_mes(periodo_ym=None):
+    """[receitas, gastos] do mês (padrão: mês corrente)."""
+    return _obter("financeiro_mes", ("receitas", "gastos"), database.get_stats_financeiro_mes,
+                  periodo_ym or _mes_atual())
+
+
+def vendas_por_vendedor():
+    """[[vendedor, total_vendas, receita_total], ...] de todo o período, mais vendas primeiro."""
+    return _obter("vendas_por_vendedor", ("motos", "vendas"), database.totais_por_vendedor)
@@ -0,0 +1,99 @@
+# Índice em memória dos arquivos de static/ e static/uploads/
+#
+# As páginas resolvem URLs de anexos/fotos consultando este índice em vez de chamar
+# os.path.exists a cada arquivo (no disco de rede do Render cada stat custa caro).
+# O índice é carregado no boot, atualizado por quem grava arquivos e reconciliado em
+# segundo plano pelo mtime das pastas (arquivos criados/removidos por outros workers).
+import os
+import threading
+import time
+
+
+class IndiceArquivos:
+    """
+    Conjunto dos caminhos relativos (ex.: 'GARANTIA.pdf', 'uploads/foto_moto_3.jpg')
+    existentes nas pastas indexadas. Cada pasta é listada sem recursão.
+    """
+
+    def __init__(self, raiz: str, subpastas=("", "uploads"), intervalo: float = 15.0):
+        self.raiz = raiz
+        self.subpastas = tuple(subpastas)
+        self.intervalo = float(intervalo)
+        self._arquivos = set()
+        self._mtimes = {}  # subpasta -> mtime da pasta na última listagem
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _rel(self, subpasta, nome):
+        return f"{subpasta}/{nome}" if subpasta else nome
+
+    def _listar(self, subpasta):
+        pasta = os.path.join(self.raiz, subpasta)
+        try:
+            mtime = os.stat(pasta).st_mtime
+            with os.scandir(pasta) as it:
+                nomes = {e.name for e in it if e.is_file()}
+        except OSError:
+            return None, set()
+        return mtime, {self._rel(subpasta, n) for n in nomes}
+
+    def carregar(self):
+        """Lista todas as pastas indexadas (boot)."""
+        for subpasta in self.subpastas:
+            self._recarregar_pasta(subpasta)
+
+    def _recarregar_pasta(self, subpasta):
+        mtime, encontrados = self._listar(subpasta)
+        prefixo = f"{subpasta}/" if subpasta else None
+        with self._lock:
+            if prefixo:
+                manter = {a for a in self._arquivos if not a.startswith(prefixo)}
+            else:
+                manter = {a for a in self._arquivos if "/" in a}
+            self._arquivos = manter | encontrados
+            self._mtimes[subpasta] = mtime
+
+    def reconciliar(self):
+        """Relista apenas as pastas cujo mtime mudou (entradas criadas/removidas)."""
+        for subpasta in self.subpastas:
+            try:
+                mtime = os.stat(os.path.join(self.raiz, subpasta)).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtimes.get(subpasta):
+                self._recarregar_pasta(subpasta)
+
+    def iniciar_reconciliacao(self):
+        """Thread em segundo plano que reconcilia o índice a cada `intervalo` segundos."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def _loop():
+            while True:
+                time.sleep(self.intervalo)
+                try:
+                    self.reconciliar()
+                except Exception as e:
+                    print(f"Aviso: falha ao reconciliar índice de arquivos: {e}")
+
+        self._thread = threading.Thread(target=_loop, name="indice-static", daemon=True)
+        self._thread.start()
+
+    def existe(self, rel: str) -> bool:
+        if not rel:
+            return False
+        rel = rel.replace("\\", "/")
+        pasta = rel.rsplit("/", 1)[0] if "/" in rel else ""
+        if pasta not in self.subpastas:
+            # Pasta não indexada (ex.: static/exports): consulta o disco
+            return os.path.isfile(os.path.join(self.raiz, rel))
+        return rel in self._arquivos
+
+    def registrar(self, rel: str):
+        """Marca um arquivo recém-gravado como existente."""
+        with self._lock:
+            self._arquivos.add(rel.replace("\\", "/"))
+
+    def remover(self, rel: str):
+        with self._lock:
+            self._arquivos.discard(rel.replace("\\", "/"))
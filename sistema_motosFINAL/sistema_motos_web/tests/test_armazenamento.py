@@ -0,0 +1,228 @@
+# Backend S3 contra um cliente falso (mesma interface usada do boto3: upload_file, copy_object,
+# delete_object, generate_presigned_url e o paginador de list_objects_v2).
+import io
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import armazenamento  # noqa: E402
+import coleta_arquivos  # noqa: E402
+import database  # noqa: E402
+
+# LastModified dos objetos criados direto no dicionário (bem fora de qualquer carência)
+_ANTIGO = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class _Paginador:
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def paginate(self, Bucket, Prefix=""):
+        objetos = self.cliente.objetos
+        chaves = sorted(k for (b, k) in objetos if b == Bucket and k.startswith(Prefix))
+        # Páginas pequenas para exercitar a paginação
+        for i in range(0, max(len(chaves), 1), 2):
+            pagina = [{
+                "Key": k,
+                "Size": len(objetos[(Bucket, k)][0]),
+                "LastModified": self.cliente.modificados.get((Bucket, k), _ANTIGO),
+            } for k in chaves[i:i + 2]]
+            yield {"Contents": pagina} if pagina else {}
+
+
+class ClienteS3Falso:
+    def __init__(self):
+        self.objetos = {}
+        self.modificados = {}
+        self.assinaturas = 0
+
+    def upload_file(self, caminho, bucket, chave, ExtraArgs=None):
+        with open(caminho, "rb") as f:
+            self.objetos[(bucket, chave)] = (f.read(), dict(ExtraArgs or {}))
+        self.modificados[(bucket, chave)] = datetime.now(timezone.utc)
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective="COPY", **extra):
+        dados, metadados = self.objetos[(CopySource["Bucket"], CopySource["Key"])]
+        self.objetos[(Bucket, Key)] = (dados, extra if MetadataDirective == "REPLACE" else metadados)
+        self.modificados[(Bucket, Key)] = datetime.now(timezone.utc)
+
+    def delete_object(self, Bucket, Key):
+        self.objetos.pop((Bucket, Key), None)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objetos:
+            raise KeyError(Key)
+        return {}
+
+    def generate_presigned_url(self, operacao, Params, ExpiresIn):
+        self.assinaturas += 1
+        return f"https://s3.falso/{Params['Bucket']}/{Params['Key']}?assinatura={self.assinaturas}"
+
+    def get_paginator(self, nome):
+        assert nome == "list_objects_v2"
+        return _Paginador(self)
+
+
+@pytest.fixture
+def cliente():
+    return ClienteS3Falso()
+
+
+def _backend(cliente, **kwargs):
+    return armazenamento.ArmazenamentoS3("motos", prefixo="app", cliente=cliente, **kwargs)
+
+
+def _arquivo(pasta, nome, conteudo=b"x"):
+    caminho = os.path.join(pasta, nome)
+    with open(caminho, "wb") as f:
+        f.write(conteudo)
+    return caminho
+
+
+def test_indice_lista_o_bucket_e_acompanha_publicar_e_remover(tmp_path, cliente):
+    for i in range(3):
+        cliente.objetos[("motos", f"app/uploads/antigo{i}.pdf")] = (b"", {})
+    cliente.objetos[("outro", "app/uploads/fora.pdf")] = (b"", {})
+    b = _backend(cliente)
+    assert b.existe("uploads/antigo2.pdf")
+    assert not b.existe("uploads/fora.pdf")
+
+    b.publicar(_arquivo(str(tmp_path), "garantia_moto_1.pdf"), "garantia_moto_1.pdf")
+    assert ("motos", "app/garantia_moto_1.pdf") in cliente.objetos
+    assert b.existe("garantia_moto_1.pdf")
+    b.remover("garantia_moto_1.pdf")
+    assert not b.existe("garantia_moto_1.pdf")
+
+
+def test_chaves_enviadas_por_outra_instancia_aparecem_na_proxima_listagem(cliente):
+    b = _backend(cliente, intervalo=3600)
+    assert not b.existe("uploads/novo.jpg")
+    cliente.objetos[("motos", "app/uploads/novo.jpg")] = (b"", {})
+    assert not b.existe("uploads/novo.jpg")  # índice ainda dentro do intervalo
+    b.intervalo = 0
+    assert b.existe("uploads/novo.jpg")
+
+
+def test_existe_confirmado_no_bucket_e_chaves_por_prefixo(cliente):
+    b = _backend(cliente, intervalo=3600)
+    assert b.chaves("exports/") == []
+    cliente.objetos[("motos", "app/exports/motos_abc_v1.xlsx")] = (b"", {})
+    assert not b.existe("exports/motos_abc_v1.xlsx")
+    assert b.existe("exports/motos_abc_v1.xlsx", confirmar=True)
+    assert not b.existe("exports/motos_abc_v2.xlsx", confirmar=True)
+    assert b.chaves("exports/motos_abc_") == ["exports/motos_abc_v1.xlsx"]
+
+
+def test_url_publica_estavel_so_para_fotos(cliente):
+    b = _backend(cliente, url_publica="https://cdn.exemplo.com/")
+    assert b.url("uploads/foto_moto_3.jpg", imutavel=True, versao=2) == \
+        "https://cdn.exemplo.com/app/uploads/foto_moto_3.jpg?v=2"
+    assert b.url("uploads/derivados/foto_moto_3_v2_p.webp", imutavel=True, versao=2) == \
+        "https://cdn.exemplo.com/app/uploads/derivados/foto_moto_3_v2_p.webp?v=2"
+    assert cliente.assinaturas == 0
+    # Anexos por conteúdo (CNH, comprovantes) continuam com URL pré-assinada
+    objeto = "uploads/" + "a" * 64 + ".pdf"
+    assert b.url(objeto, imutavel=True).startswith("https://s3.falso/")
+    assert cliente.assinaturas == 1
+
+
+def test_url_assinada_reaproveitada_ate_nova_publicacao(tmp_path, cliente):
+    b = _backend(cliente)
+    primeira = b.url("recibo_moto_1.pdf", "recibo.pdf")
+    assert b.url("recibo_moto_1.pdf", "recibo.pdf") == primeira
+    assert cliente.assinaturas == 1
+    b.publicar(_arquivo(str(tmp_path), "recibo_moto_1.pdf"), "recibo_moto_1.pdf")
+    assert b.url("recibo_moto_1.pdf", "recibo.pdf") != primeira
+
+
+def test_objetos_imutaveis_sobem_com_cache_longo(tmp_path, cliente):
+    b = _backend(cliente)
+    nome = "b" * 64 + ".jpg"
+    b.publicar(_arquivo(str(tmp_path), nome), f"uploads/{nome}")
+    b.publicar(_arquivo(str(tmp_path), "foto_moto_1.jpg"), "uploads/foto_moto_1.jpg")
+    assert cliente.objetos[("motos", f"app/uploads/{nome}")][1]["CacheControl"].startswith("private,")
+    assert "CacheControl" not in cliente.objetos[("motos", "app/uploads/foto_moto_1.jpg")][1]
+
+
+def test_sincronizar_envia_so_o_que_falta(tmp_path, cliente, monkeypatch):
+    raiz = str(tmp_path)
+    os.makedirs(os.path.join(raiz, "uploads", "derivados"))
+    _arquivo(raiz, "garantia_moto_1.pdf")
+    _arquivo(raiz, ".garantia_moto_1.pdf.fp")
+    _arquivo(os.path.join(raiz, "uploads"), "foto_moto_1.jpg")
+    _arquivo(os.path.join(raiz, "uploads"), ".upload.1.2.tmp")
+    _arquivo(os.path.join(raiz, "uploads", "derivados"), "foto_moto_1_v1_p.jpg")
+    cliente.objetos[("motos", "app/uploads/foto_moto_1.jpg")] = (b"x", {})
+    monkeypatch.setattr(armazenamento, "_backend", _backend(cliente))
+
+    assert armazenamento.sincronizar(raiz) == (2, 1)
+    assert ("motos", "app/garantia_moto_1.pdf") in cliente.objetos
+    assert ("motos", "app/uploads/derivados/foto_moto_1_v1_p.jpg") in cliente.objetos
+    assert armazenamento.sincronizar(raiz) == (0, 3)
+
+
+def test_objeto_reaproveitado_tem_mtime_renovado(tmp_path):
+    pasta = str(tmp_path)
+    nome, _tamanho, novo = armazenamento.gravar_bytes(b"documento", pasta, ".pdf")
+    assert novo
+    caminho = os.path.join(pasta, nome)
+    os.utime(caminho, (1, 1))
+    assert armazenamento.gravar_bytes(b"documento", pasta, ".pdf") == (nome, 9, False)
+    assert os.path.getmtime(caminho) > 1
+    os.utime(caminho, (1, 1))
+    assert armazenamento.gravar_stream(io.BytesIO(b"documento"), pasta, ".pdf") == (nome, 9, False)
+    assert os.path.getmtime(caminho) > 1
+    assert sorted(os.listdir(pasta)) == [nome]
+
+
+def test_anexo_reaproveitado_renova_o_objeto_do_bucket(tmp_path, cliente, monkeypatch):
+    nome = "c" * 64 + ".pdf"
+    caminho = _arquivo(str(tmp_path), nome)
+    cliente.objetos[("motos", f"app/uploads/{nome}")] = (b"x", {})
+    monkeypatch.setattr(armazenamento, "_backend", _backend(cliente))
+
+    armazenamento.publicar(caminho, f"uploads/{nome}", se_ausente=True, renovar=True)
+    assert cliente.modificados[("motos", f"app/uploads/{nome}")] > _ANTIGO
+    assert cliente.objetos[("motos", f"app/uploads/{nome}")][1]["CacheControl"].startswith("private,")
+    # Sumiu do bucket depois da listagem: envia de novo
+    del cliente.objetos[("motos", f"app/uploads/{nome}")]
+    armazenamento.publicar(caminho, f"uploads/{nome}", se_ausente=True, renovar=True)
+    assert ("motos", f"app/uploads/{nome}") in cliente.objetos
+
+
+def test_coleta_remota_usa_o_bucket_e_o_last_modified(tmp_path, cliente, monkeypatch):
+    raiz = str(tmp_path)
+    os.makedirs(os.path.join(raiz, "uploads"))
+    usado, orfao, recente = ("d" * 64 + ".pdf"), ("e" * 64 + ".pdf"), ("f" * 64 + ".pdf")
+    for chave in (f"uploads/{usado}", f"uploads/{orfao}", "garantia_moto_9.pdf", "exports/motos_v1.csv"):
+        cliente.objetos[("motos", f"app/{chave}")] = (b"12345", {})
+    cliente.objetos[("motos", f"app/uploads/{recente}")] = (b"1", {})
+    cliente.modificados[("motos", f"app/uploads/{recente}")] = datetime.now(timezone.utc)
+    # Cópia local com mtime recente não protege o objeto: quem manda é o LastModified
+    _arquivo(os.path.join(raiz, "uploads"), orfao)
+    _arquivo(os.path.join(raiz, "uploads"), ".upload.1.2.tmp")
+    os.utime(os.path.join(raiz, "uploads", ".upload.1.2.tmp"), (1, 1))
+    monkeypatch.setattr(armazenamento, "_backend", _backend(cliente))
+    monkeypatch.setattr(database, "referencias_arquivos", lambda: ({1}, {}, set(), {usado}))
+
+    relatorio = coleta_arquivos.coletar(raiz, carencia_horas=1, apagar=True)
+    assert sorted(rel for rel, _ in relatorio["candidatos"]) == \
+        ["garantia_moto_9.pdf", "uploads/.upload.1.2.tmp", f"uploads/{orfao}"]
+    assert relatorio["em_carencia"] == 1
+    assert relatorio["apagados"] == 3 and relatorio["bytes_liberados"] == 11
+    assert sorted(k for _b, k in cliente.objetos) == \
+        ["app/exports/motos_v1.csv", f"app/uploads/{usado}", f"app/uploads/{recente}"]
+    assert os.listdir(os.path.join(raiz, "uploads")) == []
+
+
+def test_backend_local_nao_gera_url_remota(monkeypatch, tmp_path):
+    monkeypatch.setattr(armazenamento, "_backend", armazenamento.ArmazenamentoLocal(str(tmp_path)))
+    assert armazenamento.url("uploads/x.pdf") is None
+    assert not armazenamento.existe_remoto("uploads/x.pdf")
+    with pytest.raises(RuntimeError):
+        armazenamento.sincronizar(str(tmp_path))